@@ -0,0 +1,58 @@
+import os
+import time
+from datetime import datetime, timezone
+
+from scrapy.commands import ScrapyCommand
+from scrapy.exceptions import UsageError
+
+from weedeater_crawler.utils.parquet import compact_partition, partitions
+
+
+class Command(ScrapyCommand):
+    requires_project = True
+    default_settings = {"LOG_LEVEL": "INFO"}
+
+    def syntax(self):
+        return "[options]"
+
+    def short_desc(self):
+        return "Merge the small Parquet export files of each partition into larger ones"
+
+    def long_desc(self):
+        return (
+            "Compact PARQUET_DIR (or --path): in every site=*/crawl_date=* partition, files below "
+            "--target-mb are streamed into files of about --target-mb with large row groups, and "
+            "the small files are deleted. Today's partitions are skipped unless --include-today, "
+            "since the crawler may still be adding files to them."
+        )
+
+    def add_options(self, parser):
+        super().add_options(parser)
+        parser.add_argument("--path", help="export directory (default: PARQUET_DIR or data/parquet)")
+        parser.add_argument("--site", help="only this site's partitions")
+        parser.add_argument("--target-mb", type=int, default=256, help="output file size (default: 256)")
+        parser.add_argument("--row-group-size", type=int, default=100_000, help="rows per output row group")
+        parser.add_argument("--include-today", action="store_true", help="also compact today's partitions")
+
+    def run(self, args, opts):
+        root = opts.path or os.getenv("PARQUET_DIR", "data/parquet")
+        if not os.path.isdir(root):
+            raise UsageError(f"No Parquet export directory at {root}")
+        # Partitions are named by the UTC date of crawled_at
+        today = f"crawl_date={datetime.now(timezone.utc).date().isoformat()}"
+        started = time.monotonic()
+        total_in = total_out = 0
+        for directory in partitions(root):
+            if opts.site and directory.parent.name != f"site={opts.site}":
+                continue
+            if directory.name == today and not opts.include_today:
+                continue
+            files_in, files_out = compact_partition(
+                directory, target_bytes=opts.target_mb * 1024 * 1024, row_group_size=opts.row_group_size,
+                compression=os.getenv("PARQUET_COMPRESSION", "zstd"),
+            )
+            if files_in != files_out:
+                print(f"{directory.relative_to(root)}: {files_in} -> {files_out} files")
+            total_in += files_in
+            total_out += files_out
+        print(f"Compacted {total_in} files into {total_out} in {time.monotonic() - started:.1f}s")
@@ -0,0 +1,262 @@
+import os
+import re
+import time
+import sqlite3
+import asyncio
+from pathlib import Path
+from datetime import datetime, timezone
+from multiprocessing import get_context
+from concurrent.futures import ProcessPoolExecutor
+
+from scrapy import Request
+from scrapy.commands import ScrapyCommand
+from scrapy.exceptions import UsageError
+from scrapy.http import HtmlResponse
+
+from weedeater_crawler.spiders.weedeater_spider import WeedeaterSpider
+from weedeater_crawler.utils.archive import (
+    ARCHIVE_SCHEME, SegmentReader, format_ref, iter_index, iter_segments, parse_ref,
+)
+from weedeater_crawler.utils.seeds import load_seeds, site_for_url
+from weedeater_crawler.utils.storage import read_raw_html
+
+SOURCES = ("db", "archive", "dir")
+HTML_SUFFIXES = (".html", ".htm", ".html.gz", ".html.zst", ".htm.gz", ".htm.zst")
+_CANONICAL = re.compile(
+    rb'<link[^>]+rel=["\']canonical["\'][^>]*href=["\']([^"\']+)|'
+    rb'<meta[^>]+property=["\']og:url["\'][^>]*content=["\']([^"\']+)', re.I,
+)
+
+# Per worker process, set up by _init_worker
+_worker = {}
+
+
+def _init_worker(archive_dir):
+    _worker["spider"] = WeedeaterSpider()
+    _worker["sites"] = {s["site"] for s in load_seeds() if s.get("site")}
+    _worker["archive_dir"] = Path(archive_dir) if archive_dir else None
+    _worker["readers"] = {}
+
+
+def _load(path: str):
+    """(body, url, crawled_at) of a stored page; url/crawled_at only when the store records them."""
+    if path.startswith(ARCHIVE_SCHEME):
+        segment, offset = parse_ref(path)
+        readers = _worker["readers"]
+        reader = readers.get(segment)
+        if reader is None:
+            if _worker["archive_dir"] is None:
+                raise FileNotFoundError(f"{path}: no archive directory (RAW_ARCHIVE_DIR)")
+            reader = readers[segment] = SegmentReader(_worker["archive_dir"] / segment)
+        headers, body = reader.read(offset)
+        date = headers.get("WARC-Date")
+        crawled_at = datetime.strptime(date, "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=timezone.utc).isoformat() \
+            if date else None
+        return body, headers.get("WARC-Target-URI"), crawled_at
+    body = read_raw_html(path)
+    url = None
+    if "://" not in path:
+        # Loose HTML files: the page's canonical URL, else the file itself
+        match = _CANONICAL.search(body[:200_000])
+        url = (match.group(1) or match.group(2)).decode("utf-8", "replace") if match else Path(path).resolve().as_uri()
+    return body, url, None
+
+
+def _extract_batch(tasks):
+    """Run parse_product over a batch of (raw_html_path, url, site, crawled_at) in a worker."""
+    spider = _worker["spider"]
+    started = time.process_time()
+    items, errors = [], []
+    for path, url, site, crawled_at in tasks:
+        try:
+            body, stored_url, stored_at = _load(path)
+            url = url or stored_url
+            site = site or site_for_url(url, _worker["sites"])
+            response = HtmlResponse(url, body=body, request=Request(url, meta={"site": site}))
+            for item in spider.parse_product(response):
+                # Keep the snapshot the row already points at; nothing is re-uploaded
+                item.pop('_raw_html_bytes', None)
+                item['raw_html_path'] = path
+                item['crawled_at'] = crawled_at or stored_at or item['crawled_at']
+                items.append(item)
+        except Exception as e:
+            errors.append((path, f"{type(e).__name__}: {e}"))
+    return items, errors, time.process_time() - started
+
+
+def _db_tasks(path, site=None, page_size=1000):
+    # Keyset pagination with short queries, so the SQLite pipeline writing to the
+    # same database is never blocked by a long-lived read
+    conn = sqlite3.connect(path)
+    try:
+        last_id = 0
+        where = "id > ? AND raw_html_path IS NOT NULL AND raw_html_path != ''" + (" AND site = ?" if site else "")
+        while True:
+            params = (last_id, site, page_size) if site else (last_id, page_size)
+            rows = conn.execute(
+                f"SELECT id, raw_html_path, source_url, site, crawled_at FROM products WHERE {where} "
+                "ORDER BY id LIMIT ?", params,
+            ).fetchall()
+            if not rows:
+                return
+            for row_id, raw_html_path, url, row_site, crawled_at in rows:
+                yield raw_html_path, url, row_site, crawled_at
+            last_id = rows[-1][0]
+    finally:
+        conn.close()
+
+
+def _archive_tasks(directory, site=None):
+    # Latest capture per URL, from the segment indexes (segments sort oldest first)
+    latest = {}
+    for segment in iter_segments(directory):
+        for key, offset, _length in iter_index(segment):
+            latest[key] = (segment.name, offset)
+    for segment, offset in latest.values():
+        yield format_ref(segment, offset), None, site, None
+
+
+def _dir_tasks(directory, site=None):
+    for root, _dirs, files in os.walk(directory):
+        for name in sorted(files):
+            if name.lower().endswith(HTML_SUFFIXES):
+                yield os.path.join(root, name), None, site, None
+
+
+def _batches(tasks, size, limit=None):
+    batch, count = [], 0
+    for task in tasks:
+        if limit is not None and count >= limit:
+            break
+        batch.append(task)
+        count += 1
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class ReextractSpider(WeedeaterSpider):
+    # Re-runs parse_product over stored HTML instead of fetching it. Batches go to a
+    # process pool (spawned workers, each with its own spider and extraction engine);
+    # items come back through the normal item pipelines, which upsert on
+    # (site, item_key). Nothing is downloaded, so the Redis scheduler/dupefilter and
+    # the Playwright handler are swapped out.
+    custom_settings = {
+        **WeedeaterSpider.custom_settings,
+        "SCHEDULER": "scrapy.core.scheduler.Scheduler",
+        "DUPEFILTER_CLASS": "scrapy.dupefilters.RFPDupeFilter",
+        "DOWNLOAD_HANDLERS": {
+            "http": "scrapy.core.downloader.handlers.http.HTTPDownloadHandler",
+            "https": "scrapy.core.downloader.handlers.http.HTTPDownloadHandler",
+        },
+    }
+
+    def __init__(self, source="db", path=None, site=None, workers=None, batch_size=50, limit=None,
+                 log_every=10.0, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Never poll the Redis seed queue: the spider closes when the source is exhausted
+        self.seed_source = "yaml"
+        self.source = source
+        self.path = path
+        self.site = site
+        self.workers = int(workers or os.cpu_count() or 1)
+        self.batch_size = int(batch_size)
+        self.limit = int(limit) if limit else None
+        self.log_every = float(log_every)
+        self.archive_dir = os.getenv("RAW_ARCHIVE_DIR", "data/archive")
+        self.pages = self.items = self.errors = 0
+        self.cpu_seconds = 0.0
+
+    def _tasks(self):
+        if self.source == "db":
+            return _db_tasks(self.path or os.getenv("SQLITE_PATH", "data/weedeater.sqlite"), self.site)
+        if self.source == "archive":
+            self.archive_dir = self.path or self.archive_dir
+            return _archive_tasks(self.archive_dir, self.site)
+        return _dir_tasks(self.path, self.site)
+
+    async def start(self):
+        started = last_log = time.monotonic()
+        batches = _batches(self._tasks(), self.batch_size, self.limit)
+        pending = set()
+        with ProcessPoolExecutor(self.workers, mp_context=get_context("spawn"),
+                                 initializer=_init_worker, initargs=(self.archive_dir,)) as pool:
+            while True:
+                # Two batches per worker in flight: workers never idle, memory stays bounded
+                while len(pending) < self.workers * 2:
+                    batch = next(batches, None)
+                    if batch is None:
+                        break
+                    pending.add(asyncio.wrap_future(pool.submit(_extract_batch, batch)))
+                if not pending:
+                    break
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for future in done:
+                    items, errors, cpu_seconds = future.result()
+                    self.pages += len(items) + len(errors)
+                    self.items += len(items)
+                    self.errors += len(errors)
+                    self.cpu_seconds += cpu_seconds
+                    for path, error in errors:
+                        self.logger.warning(f"Re-extraction of {path} failed: {error}")
+                    for item in items:
+                        yield item
+                if time.monotonic() - last_log >= self.log_every:
+                    last_log = time.monotonic()
+                    self._report(last_log - started)
+        self._report(time.monotonic() - started, final=True)
+
+    def _report(self, elapsed, final=False):
+        rate = self.pages / elapsed if elapsed else 0.0
+        per_cpu = self.pages / self.cpu_seconds if self.cpu_seconds else 0.0
+        self.logger.info(
+            f"{'Re-extracted' if final else 'Re-extracting:'} {self.pages} pages ({self.items} items, "
+            f"{self.errors} failed) in {elapsed:.1f}s: {rate:.1f} pages/s, {rate / self.workers:.1f} "
+            f"pages/s per worker ({self.workers}), {per_cpu:.1f} pages per CPU-second"
+        )
+        if final and self.crawler:
+            self.crawler.stats.set_value("reextract/pages", self.pages)
+            self.crawler.stats.set_value("reextract/errors", self.errors)
+            self.crawler.stats.set_value("reextract/pages_per_second", round(rate, 2))
+            self.crawler.stats.set_value("reextract/pages_per_cpu_second", round(per_cpu, 2))
+
+
+class Command(ScrapyCommand):
+    requires_project = True
+    default_settings = {"LOG_LEVEL": "INFO"}
+
+    def syntax(self):
+        return "[options]"
+
+    def short_desc(self):
+        return "Re-run product extraction over stored HTML and upsert the results"
+
+    def long_desc(self):
+        return (
+            "Re-parse product pages without refetching them. Sources: 'db' reads raw_html_path "
+            "from the SQLite products table (s3://, gs://, archive:// or local paths), 'archive' "
+            "reads the latest capture per URL from a RAW_ARCHIVE_DIR segment directory, 'dir' "
+            "reads *.html(.gz|.zst) files. Items go through the configured item pipelines."
+        )
+
+    def add_options(self, parser):
+        super().add_options(parser)
+        parser.add_argument("--source", choices=SOURCES, default="db", help="where the HTML comes from (default: db)")
+        parser.add_argument("--path", help="SQLite file, archive directory or HTML directory "
+                                           "(default: SQLITE_PATH / RAW_ARCHIVE_DIR)")
+        parser.add_argument("--site", help="db: only rows of this site; archive/dir: site of every page "
+                                           "(default: matched from the seeds by host)")
+        parser.add_argument("--workers", type=int, default=os.cpu_count(), help="worker processes (default: CPUs)")
+        parser.add_argument("--batch-size", type=int, default=50, help="pages per worker task")
+        parser.add_argument("--limit", type=int, help="stop after this many pages")
+
+    def run(self, args, opts):
+        if opts.source == "dir" and not opts.path:
+            raise UsageError("--path is required with --source dir")
+        self.crawler_process.crawl(
+            ReextractSpider, source=opts.source, path=opts.path, site=opts.site,
+            workers=opts.workers, batch_size=opts.batch_size, limit=opts.limit,
+        )
+        self.crawler_process.start()
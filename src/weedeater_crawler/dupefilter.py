@@ -0,0 +1,134 @@
+import os
+import json
+import hashlib
+
+from prometheus_client import Counter, Gauge
+from scrapy import signals
+from scrapy.utils.python import to_unicode
+from scrapy_redis.dupefilter import RFPDupeFilter
+
+from .utils.bloom import bloom_filter
+from .utils.recrawl import RecrawlStore
+from .utils.urls import request_url
+
+RECRAWL_REVISITS = Counter('recrawl_revisits', 'Seen URLs let through the dupefilter for a revisit', ['outcome'])
+DUPEFILTER_CHECKS = Counter('dupefilter_checks', 'Dupefilter lookups', ['result'])
+DUPEFILTER_ITEMS = Gauge('dupefilter_items', 'Fingerprints held by the dupefilter', multiprocess_mode='livemax')
+DUPEFILTER_MEMORY = Gauge('dupefilter_memory_bytes', 'Redis memory used by the dupefilter', multiprocess_mode='livemax')
+
+
+def recrawl_store(server, spider_name):
+    if os.getenv("INCREMENTAL_ENABLED", "false").lower() != "true":
+        return None
+    hours = 3600.0
+    return RecrawlStore(
+        server,
+        key=f"{spider_name}:recrawl",
+        initial_interval=float(os.getenv("RECRAWL_INITIAL_HOURS", "24")) * hours,
+        min_interval=float(os.getenv("RECRAWL_MIN_HOURS", "1")) * hours,
+        max_interval=float(os.getenv("RECRAWL_MAX_HOURS", "720")) * hours,
+    )
+
+
+class IncrementalDupeFilter(RFPDupeFilter):
+    # RFPDupeFilter over canonical URLs (tracking/session params and per-seed
+    # `strip_params` removed) that lets an already-seen URL through again once its
+    # revisit interval (kept by RecrawlStore, see IncrementalRecrawlMiddleware) has
+    # elapsed. Without INCREMENTAL_ENABLED no URL is ever revisited.
+    recrawl = None
+
+    @classmethod
+    def from_spider(cls, spider):
+        df = super().from_spider(spider)
+        df.recrawl = recrawl_store(df.server, spider.name)
+        return df
+
+    def request_fingerprint(self, request):
+        fingerprint_data = {
+            "method": to_unicode(request.method),
+            "url": request_url(request),
+            "body": (request.body or b"").hex(),
+        }
+        return hashlib.sha1(json.dumps(fingerprint_data, sort_keys=True).encode()).hexdigest()
+
+    def _add_fingerprint(self, fp) -> bool:
+        """Record fp; True when it was not seen before."""
+        return self.server.sadd(self.key, fp) == 1
+
+    def size(self) -> int:
+        return self.server.scard(self.key)
+
+    def request_seen(self, request):
+        seen = not self._add_fingerprint(self.request_fingerprint(request))
+        DUPEFILTER_CHECKS.labels(result="duplicate" if seen else "new").inc()
+        if self.recrawl is None:
+            return seen
+        url = request_url(request)
+        if not seen:
+            # Claim the first visit too, so copies found before it completes stay filtered
+            self.recrawl.claim_if_due(url)
+            return False
+        if self.recrawl.claim_if_due(url):
+            RECRAWL_REVISITS.labels(outcome="due").inc()
+            return False
+        RECRAWL_REVISITS.labels(outcome="not_due").inc()
+        return True
+
+
+class BloomDupeFilter(IncrementalDupeFilter):
+    # Memory-bounded variant: fingerprints go into a scalable Bloom filter kept in
+    # Redis bitmaps, or in RedisBloom when the module is loaded (BLOOM_BACKEND=auto).
+    # Memory grows with log(items) layers instead of 40 bytes + set overhead per URL,
+    # at the cost of a configurable false-positive rate (BLOOM_ERROR_RATE).
+    bloom = None
+    _REPORT_EVERY = 10_000
+
+    @classmethod
+    def from_spider(cls, spider):
+        df = super().from_spider(spider)
+        df.bloom = bloom_filter(
+            df.server,
+            f"{df.key}:bloom",
+            backend=os.getenv("BLOOM_BACKEND", "auto").lower(),
+            capacity=int(os.getenv("BLOOM_CAPACITY", "1000000")),
+            error_rate=float(os.getenv("BLOOM_ERROR_RATE", "0.001")),
+        )
+        df.checks = df.hits = 0
+        spider.crawler.signals.connect(df.log_report, signal=signals.spider_closed)
+        return df
+
+    def _add_fingerprint(self, fp) -> bool:
+        added = self.bloom.add(fp)
+        self.checks += 1
+        self.hits += not added
+        if self.checks % self._REPORT_EVERY == 0:
+            self.report()
+        return added
+
+    def size(self) -> int:
+        return self.bloom.count()
+
+    def report(self) -> dict:
+        report = {
+            "backend": self.bloom.backend,
+            "items": self.bloom.count(),
+            "memory_bytes": self.bloom.memory_bytes(),
+            "error_rate": self.bloom.error_rate,
+            "checks": self.checks,
+            "hit_rate": self.hits / self.checks if self.checks else 0.0,
+        }
+        DUPEFILTER_ITEMS.set(report["items"])
+        DUPEFILTER_MEMORY.set(report["memory_bytes"])
+        return report
+
+    def log_report(self, spider):
+        report = self.report()
+        spider.logger.info(
+            f"Bloom dupefilter ({report['backend']}): {report['items']} items in "
+            f"{report['memory_bytes'] / 1024 / 1024:.1f} MiB, hit rate {report['hit_rate']:.1%} "
+            f"over {report['checks']} checks"
+        )
+
+    def clear(self):
+        super().clear()
+        self.bloom.clear()
@@ -1,35 +1,215 @@
 import os
-from prometheus_client import Counter, Gauge, start_http_server
+import time
+
+import redis
+from prometheus_client import Counter, Gauge, Histogram, start_http_server
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from scrapy.utils.httpobj import urlparse_cached
+from scrapy_redis.queue import Base as RedisQueue
+from twisted.internet.task import LoopingCall
+
+from .dupefilter import DUPEFILTER_ITEMS
+from .frontier import queue_composition
+from .utils.checkpoint import InFlightLedger, SeedProgress, checkpoint_enabled
+from .utils.profiler import start_profiler_server
+
+PAGES_CRAWLED = Counter('pages_crawled', 'Total pages crawled (responses received)')
+ITEMS_SCRAPED = Counter('items_scraped', 'Total items scraped')
+FAILURES = Counter('crawl_failures', 'Total request failures')
+# Under the multi-process launcher each worker writes its own gauge values;
+# multiprocess_mode says how they combine on the shared endpoint (livesum for
+# per-process amounts, livemax for shared Redis state every worker samples).
+# Ignored in a single process.
+IN_QUEUE = Gauge('redis_inqueue', 'Requests waiting in the scheduler queue', multiprocess_mode='livemax')
+QUEUE_BY_CLASS = Gauge('redis_inqueue_by_class', 'Requests waiting in the Redis queue, by page class', ['page_class'],
+                       multiprocess_mode='livemax')
+IN_FLIGHT = Gauge('requests_in_flight', 'Requests in the downloader', multiprocess_mode='livesum')
+REACTOR_LAG = Gauge('reactor_lag_seconds', 'How late the last sampler tick ran', multiprocess_mode='livemax')
+DOWNLOAD_SECONDS = Histogram(
+    'download_seconds', 'Download time per response (includes the render for rendered pages)',
+    ['site', 'fetch_mode'], buckets=(0.1, 0.25, 0.5, 1, 2, 4, 8, 15, 30, 60, 120),
+)
+
+
+REQUEUED = Counter('checkpoint_requeued', 'In-flight requests pushed back onto the Redis queue', ['source'])
+
+
+def request_site(request) -> str:
+    return request.meta.get("site") or urlparse_cached(request).hostname or ""
+
+
+def engine_scheduler(engine):
+    # Engine.scheduler is new in Scrapy 2.19; older versions keep it on engine.slot
+    scheduler = getattr(engine, "scheduler", None)
+    if scheduler is None:
+        scheduler = getattr(getattr(engine, "slot", None), "scheduler", None)
+    return scheduler
+
 
 class PrometheusExtension:
-    def __init__(self, port: int = 8008):
+    # Serves the metrics and samples what no signal reports: scheduler queue size
+    # (per page class for the Redis priority queue), dupefilter size, requests in the downloader and reactor lag (how late the
+    # sampler's own tick fires), every METRICS_SAMPLE_INTERVAL seconds. With
+    # PROFILER_PORT set, a sampling profiler is served on localhost (utils/profiler.py).
+    def __init__(self, crawler, port: int = 8008, sample_interval: float = 5.0, profiler_port: int = 0):
+        self.crawler = crawler
         self.port = port
         self.started = False
-        self.pages_crawled = Counter('pages_crawled', 'Total pages crawled')
-        self.items_scraped = Counter('items_scraped', 'Total items scraped')
-        self.failures = Counter('crawl_failures', 'Total request failures')
-        self.in_queue = Gauge('redis_inqueue', 'Approx keys in queue')
+        self.sample_interval = sample_interval
+        self.profiler_port = profiler_port
+        self.sampler = LoopingCall(self.sample)
+        self._ticked_at = None
 
     @classmethod
     def from_crawler(cls, crawler):
         port = int(os.getenv('PROMETHEUS_PORT', '8008'))
-        ext = cls(port)
-        crawler.signals.connect(ext.item_scraped, signal=crawler.signals.item_scraped)
-        crawler.signals.connect(ext.request_dropped, signal=crawler.signals.request_dropped)
-        crawler.signals.connect(ext.request_scheduled, signal=crawler.signals.request_scheduled)
-        crawler.signals.connect(ext.spider_opened, signal=crawler.signals.spider_opened)
+        ext = cls(
+            crawler, port,
+            sample_interval=float(os.getenv('METRICS_SAMPLE_INTERVAL', '5')),
+            profiler_port=int(os.getenv('PROFILER_PORT', '0')),
+        )
+        crawler.signals.connect(ext.item_scraped, signal=signals.item_scraped)
+        crawler.signals.connect(ext.request_dropped, signal=signals.request_dropped)
+        crawler.signals.connect(ext.response_received, signal=signals.response_received)
+        crawler.signals.connect(ext.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(ext.spider_closed, signal=signals.spider_closed)
         return ext
 
     def spider_opened(self, spider):
         if not self.started:
-            start_http_server(self.port)
+            # PROMETHEUS_PORT=0: a launcher worker, whose metrics the launcher serves
+            if self.port:
+                start_http_server(self.port)
+            if self.profiler_port:
+                start_profiler_server(self.profiler_port)
+                spider.logger.info(f"Sampling profiler on http://127.0.0.1:{self.profiler_port}/profile?seconds=10")
             self.started = True
+        if self.sample_interval > 0:
+            self.sampler.start(self.sample_interval, now=False)
+
+    def spider_closed(self, spider):
+        if self.sampler.running:
+            self.sampler.stop()
 
     def item_scraped(self, item, response, spider):
-        self.items_scraped.inc()
+        ITEMS_SCRAPED.inc()
 
-    def request_scheduled(self, request, spider):
-        self.pages_crawled.inc()
+    def response_received(self, response, request, spider):
+        PAGES_CRAWLED.inc()
+        latency = request.meta.get("download_latency")
+        if latency is not None:
+            DOWNLOAD_SECONDS.labels(
+                site=request_site(request), fetch_mode=request.meta.get("fetch_mode", "http"),
+            ).observe(latency)
 
     def request_dropped(self, request, spider):
-        self.failures.inc()
+        FAILURES.inc()
+
+    def sample(self):
+        now = time.monotonic()
+        if self._ticked_at is not None:
+            REACTOR_LAG.set(max(0.0, now - self._ticked_at - self.sample_interval))
+        self._ticked_at = now
+        engine = self.crawler.engine
+        if engine is None:
+            return
+        IN_FLIGHT.set(len(engine.downloader.active))
+        scheduler = engine_scheduler(engine)
+        if scheduler is None:
+            return
+        IN_QUEUE.set(len(scheduler))
+        for page_class, count in (queue_composition(scheduler) or {}).items():
+            QUEUE_BY_CLASS.labels(page_class).set(count)
+        df = getattr(scheduler, "df", None)
+        if hasattr(df, "size"):
+            DUPEFILTER_ITEMS.set(df.size())
+
+
+class CheckpointExtension:
+    # Crawl state that outlives the process (CHECKPOINT_ENABLED). Queued requests
+    # already survive in Redis (SCHEDULER_PERSIST); the ones in the downloader are
+    # kept in an InFlightLedger, so when a crawler dies without draining (OOM kill,
+    # a drain past its timeout) the next crawler to start or tick puts them back on
+    # the queue once the dead one's lease (CHECKPOINT_LEASE_SECONDS) has run out. It
+    # also records per-seed progress (pages, items, last listing page; see
+    # SeedProgress). Both are written every CHECKPOINT_FLUSH_INTERVAL seconds, one
+    # pipeline each. The ledger starts at request_reached_downloader, which is
+    # enough because no downloader middleware holds a request on the way in: a
+    # rate-limited one waits in its slot's queue or goes back to the Redis queue.
+    # Storage-state checkpoints live in HybridDownloadHandler.
+    def __init__(self, crawler, server, progress: SeedProgress, flush_interval: float = 10.0, lease: int = 60):
+        self.crawler = crawler
+        self.server = server
+        self.progress = progress
+        self.flush_interval = flush_interval
+        self.lease = lease
+        self.ledger = None
+        self.ticker = LoopingCall(self.tick)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not checkpoint_enabled():
+            raise NotConfigured
+        server = redis.from_url(crawler.settings.get("REDIS_URL"))
+        ext = cls(
+            crawler, server, SeedProgress(server, f"{crawler.spidercls.name}:progress"),
+            flush_interval=float(os.getenv("CHECKPOINT_FLUSH_INTERVAL", "10")),
+            lease=int(os.getenv("CHECKPOINT_LEASE_SECONDS", "60")),
+        )
+        crawler.signals.connect(ext.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(ext.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(ext.request_reached_downloader, signal=signals.request_reached_downloader)
+        crawler.signals.connect(ext.request_left_downloader, signal=signals.request_left_downloader)
+        crawler.signals.connect(ext.response_received, signal=signals.response_received)
+        crawler.signals.connect(ext.item_scraped, signal=signals.item_scraped)
+        return ext
+
+    def spider_opened(self, spider):
+        queue = getattr(engine_scheduler(self.crawler.engine), "queue", None)
+        if isinstance(queue, RedisQueue):
+            self.ledger = InFlightLedger(self.server, queue, ttl=self.lease)
+            self.ledger.register()
+            self._reclaim(spider)
+        if self.flush_interval > 0:
+            self.ticker.start(self.flush_interval, now=False)
+
+    def tick(self):
+        self.progress.flush()
+        if self.ledger is not None:
+            self.ledger.flush()
+            self._reclaim(self.crawler.spider)
+
+    def _reclaim(self, spider):
+        count = self.ledger.reclaim()
+        if count:
+            REQUEUED.labels("reclaimed").inc(count)
+            spider.logger.info(f"Requeued {count} requests left in flight by stopped crawlers")
+
+    def request_reached_downloader(self, request, spider):
+        if self.ledger is not None:
+            self.ledger.add(request)
+
+    def request_left_downloader(self, request, spider):
+        if self.ledger is not None:
+            self.ledger.remove(request)
+
+    def response_received(self, response, request, spider):
+        seed = request.meta.get("seed_url")
+        if seed and request.meta.get("page_type") in ("listing", "product"):
+            self.progress.page(seed, request.meta["page_type"], request.url)
+
+    def item_scraped(self, item, response, spider):
+        seed = response.meta.get("seed_url") if response is not None else None
+        if seed:
+            self.progress.item(seed)
+
+    def spider_closed(self, spider, reason):
+        if self.ticker.running:
+            self.ticker.stop()
+        self.progress.flush()
+        if self.ledger is not None:
+            count = self.ledger.release()
+            if count:
+                REQUEUED.labels("close").inc(count)
+                spider.logger.info(f"Requeued {count} requests still in flight at close ({reason})")
@@ -0,0 +1,259 @@
+import re
+import json
+from collections import Counter as Tally, defaultdict
+from typing import Dict, List, Optional
+
+from lxml import etree
+from parsel.csstranslator import HTMLTranslator
+from prometheus_client import Counter
+
+EXTRACTED_FIELDS = Counter('extraction_fields', 'Product fields by extraction source', ['site', 'source'])
+
+_TRANSLATOR = HTMLTranslator()
+_AVAILABILITY = re.compile(r"InStock|OutOfStock|PreOrder")
+
+
+class Rule:
+    # One selector of a fallback chain, translated from CSS and compiled to an lxml
+    # XPath once at import instead of on every page.
+    __slots__ = ("css", "xpath", "regex", "join")
+
+    def __init__(self, css: str, regex: Optional[str] = None, join: bool = False):
+        self.css = css
+        self.xpath = etree.XPath(_TRANSLATOR.css_to_xpath(css))
+        self.regex = re.compile(regex) if regex else None
+        self.join = join
+
+    def apply(self, root) -> Optional[str]:
+        values = self.xpath(root)
+        if self.join:
+            return " ".join(str(v) for v in values).strip() or None
+        if self.regex is not None:
+            for v in values:
+                m = self.regex.search(str(v))
+                if m:
+                    return m.group(1) if self.regex.groups else m.group(0)
+            return None
+        return str(values[0]) if values else None
+
+
+# Fallback chains for ProductItem fields, in priority order
+PRODUCT_RULES: Dict[str, List[Rule]] = {
+    "product_name": [Rule("h1::text"), Rule("h1 span::text")],
+    "brand": [Rule('[itemprop="brand"]::text'), Rule(".brand::text"), Rule('meta[itemprop="brand"]::attr(content)')],
+    "sku": [Rule('[itemprop="sku"]::text'), Rule("span.sku::text"), Rule('meta[itemprop="sku"]::attr(content)')],
+    "upc": [Rule('[itemprop="gtin13"]::attr(content)'), Rule("[data-upc]::attr(data-upc)")],
+    "price": [Rule('[itemprop="price"]::attr(content)'), Rule(".price ::text", regex=r"\$?([0-9,.]+)")],
+    "currency": [Rule('[itemprop="priceCurrency"]::attr(content)')],
+    "availability": [Rule('[itemprop="availability"]::attr(content)', regex=_AVAILABILITY.pattern)],
+    "description": [Rule('[itemprop="description"] ::text', join=True), Rule(".description ::text", join=True)],
+}
+
+SPEC_ROWS = etree.XPath(_TRANSLATOR.css_to_xpath("table tr, .specs tr, .product-specs tr"))
+SPEC_KEY = etree.XPath(_TRANSLATOR.css_to_xpath("th ::text, .label ::text"))
+SPEC_VALUE = etree.XPath(_TRANSLATOR.css_to_xpath("td ::text, .value ::text"))
+IMAGES = etree.XPath(_TRANSLATOR.css_to_xpath("img::attr(src), img::attr(data-src), img::attr(data-original)"))
+BREADCRUMBS = etree.XPath(_TRANSLATOR.css_to_xpath("nav.breadcrumbs a::text, .breadcrumbs a::text"))
+
+_JSON_LD = etree.XPath('//script[@type="application/ld+json"]/text()')
+_MICRODATA_PRODUCT = etree.XPath('//*[@itemscope][contains(@itemtype, "schema.org/Product")]')
+_ITEMPROPS = etree.XPath(".//*[@itemprop]")
+
+_GTIN_KEYS = ("gtin13", "gtin12", "gtin14", "gtin", "gtin8")
+_MICRODATA_FIELDS = {
+    "name": "product_name", "brand": "brand", "sku": "sku", "price": "price", "lowPrice": "price",
+    "priceCurrency": "currency", "availability": "availability", "description": "description",
+    "category": "category", **{k: "upc" for k in _GTIN_KEYS},
+}
+
+
+def _types(node) -> List[str]:
+    t = node.get("@type") or []
+    return [t] if isinstance(t, str) else list(t)
+
+
+def _walk(node):
+    if isinstance(node, list):
+        for n in node:
+            yield from _walk(n)
+    elif isinstance(node, dict):
+        yield node
+        for key in ("@graph", "mainEntity", "itemListElement"):
+            if key in node:
+                yield from _walk(node[key])
+
+
+def _text(value) -> Optional[str]:
+    if isinstance(value, dict):
+        value = value.get("name") or value.get("@id")
+    if isinstance(value, list):
+        value = value[0] if value else None
+    return str(value).strip() if value not in (None, "") else None
+
+
+def _from_json_ld(node: dict) -> dict:
+    data = {
+        "product_name": _text(node.get("name")),
+        "brand": _text(node.get("brand") or node.get("manufacturer")),
+        "sku": _text(node.get("sku") or node.get("mpn")),
+        "upc": next((_text(node[k]) for k in _GTIN_KEYS if node.get(k)), None),
+        "category": _text(node.get("category")),
+        "description": _text(node.get("description")),
+    }
+    offers = node.get("offers")
+    offer = offers[0] if isinstance(offers, list) and offers else offers
+    if isinstance(offer, dict):
+        price = offer.get("price", offer.get("lowPrice"))
+        if price is None and isinstance(offer.get("priceSpecification"), dict):
+            price = offer["priceSpecification"].get("price")
+        data["price"] = _text(price)
+        data["currency"] = _text(offer.get("priceCurrency"))
+        m = _AVAILABILITY.search(str(offer.get("availability") or ""))
+        data["availability"] = m.group(0) if m else None
+    images = node.get("image")
+    if images:
+        images = images if isinstance(images, list) else [images]
+        data["images"] = [i.get("url") if isinstance(i, dict) else str(i) for i in images]
+    return data
+
+
+def _breadcrumbs_from_json_ld(node: dict) -> List[str]:
+    elements = sorted(node.get("itemListElement") or [], key=lambda e: e.get("position", 0) if isinstance(e, dict) else 0)
+    names = [_text(e.get("name") or e.get("item")) for e in elements if isinstance(e, dict)]
+    return [n for n in names if n]
+
+
+def _owner_scope(el):
+    parent = el.getparent()
+    while parent is not None and parent.get("itemscope") is None:
+        parent = parent.getparent()
+    return parent
+
+
+def structured_data(root) -> dict:
+    """Product fields from JSON-LD Product/Offer and schema.org microdata, JSON-LD first."""
+    data = {}
+    for raw in _JSON_LD(root):
+        try:
+            doc = json.loads(raw, strict=False)
+        except ValueError:
+            continue
+        for node in _walk(doc):
+            types = _types(node)
+            if "Product" in types or "ProductGroup" in types:
+                for k, v in _from_json_ld(node).items():
+                    if v and not data.get(k):
+                        data[k] = v
+            elif "BreadcrumbList" in types and not data.get("breadcrumbs"):
+                data["breadcrumbs"] = _breadcrumbs_from_json_ld(node)
+    for product in _MICRODATA_PRODUCT(root)[:1]:
+        for el in _ITEMPROPS(product):
+            prop = el.get("itemprop")
+            owner = _owner_scope(el)
+            if prop == "name" and owner is not None and owner.get("itemprop") == "brand":
+                prop = "brand"
+            elif prop == "name" and owner is not product:
+                continue
+            field = _MICRODATA_FIELDS.get(prop)
+            if not field or data.get(field) or el.get("itemscope") is not None:
+                continue
+            value = el.get("content") or el.get("href") if el.tag in ("meta", "link") else None
+            value = value or el.get("content") or " ".join(el.itertext()).strip()
+            if field == "availability":
+                m = _AVAILABILITY.search(value or "")
+                value = m.group(0) if m else None
+            if value:
+                data[field] = value
+    return data
+
+
+class ExtractionEngine:
+    # Structured data first, then per-site compiled plans over PRODUCT_RULES.
+    # For the first `learn_pages` pages of a site every fallback chain runs in full
+    # and the winning selector is tallied; after that only the winning selector runs.
+    # A field no selector has matched yet stays out of the plan and keeps running the
+    # full chain, so a page that does have it still gets it. A planned selector that
+    # comes back empty falls back to the full chain; `max_misses` times in a row that
+    # another selector wins drop the field from the plan so it is relearned. Every
+    # `verify_every` pages a site runs the full chains again to catch new selectors.
+    _SKIP = -1  # _run_chain's winner when no selector matched
+
+    def __init__(self, rules: Dict[str, List[Rule]] = None, learn_pages: int = 5,
+                 max_misses: int = 3, verify_every: int = 100):
+        self.rules = rules or PRODUCT_RULES
+        self.learn_pages = learn_pages
+        self.max_misses = max_misses
+        self.verify_every = verify_every
+        self.plans: Dict[str, Dict[str, int]] = {}
+        self._votes = defaultdict(lambda: defaultdict(Tally))
+        self._misses = defaultdict(Tally)
+        self._pages = Tally()
+
+    def extract(self, root, site: str) -> dict:
+        data = structured_data(root)
+        self._pages[site] += 1
+        plan = self.plans.get(site, {})
+        verify = self.verify_every and self._pages[site] % self.verify_every == 0
+        sources = Tally(structured=len(data))
+        for field, rules in self.rules.items():
+            if data.get(field):
+                continue
+            planned = None if verify else plan.get(field)
+            if planned is not None:
+                value = rules[planned].apply(root)
+                if value:
+                    data[field] = value
+                    sources["plan"] += 1
+                    continue
+            value, winner = self._run_chain(rules, root)
+            sources["chain"] += 1
+            data[field] = value
+            self._learn(site, field, winner, planned)
+        for source, n in sources.items():
+            if n:
+                EXTRACTED_FIELDS.labels(site=site, source=source).inc(n)
+        return data
+
+    @staticmethod
+    def _run_chain(rules: List[Rule], root):
+        for i, rule in enumerate(rules):
+            value = rule.apply(root)
+            if value:
+                return value, i
+        return None, ExtractionEngine._SKIP
+
+    def _learn(self, site, field, winner, planned):
+        plan = self.plans.get(site)
+        if plan is not None and field in plan:
+            if winner == plan[field]:
+                self._misses[site][field] = 0
+                return
+            if winner == self._SKIP:
+                return  # the field isn't on this page; not the selector's fault
+            self._misses[site][field] += 1
+            if self._misses[site][field] >= self.max_misses:
+                del plan[field]
+                self._votes[site][field].clear()
+                self._misses[site][field] = 0
+            return
+        votes = self._votes[site][field]
+        votes[winner] += 1
+        if sum(votes.values()) >= self.learn_pages:
+            best = next((rule for rule, _ in votes.most_common() if rule != self._SKIP), None)
+            if best is not None:
+                self.plans.setdefault(site, {})[field] = best
+
+
+def first_match(field: str, root) -> Optional[str]:
+    """Run the full fallback chain for one field."""
+    return ExtractionEngine._run_chain(PRODUCT_RULES[field], root)[0]
+
+
+def extract_specs(root) -> dict:
+    specs = {}
+    for row in SPEC_ROWS(root):
+        key = " ".join(s.strip() for s in SPEC_KEY(row) if s.strip())
+        val = " ".join(s.strip() for s in SPEC_VALUE(row) if s.strip())
+        if key and val:
+            specs[key] = val
+    return specs
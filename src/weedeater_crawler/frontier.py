@@ -0,0 +1,148 @@
+import re
+from typing import Dict, Iterator, Optional, Tuple
+
+from prometheus_client import Counter
+from scrapy.linkextractors import LinkExtractor
+from scrapy_redis.queue import PriorityQueue
+
+PRODUCT_LINK_PATTERNS = ("/product/", "/products/", "/p/")
+DEFAULT_PAGINATION_PATTERNS = (r"[?&](?:page|pg|p|start|offset|Nao)=\d+", r"/page/\d+/?(?:$|\?)")
+DEFAULT_CATEGORY_PATTERNS = (r"/(?:c|b|cat|category|categories|collections?|shop|dept|departments?)/",)
+
+# Base priority per page class. Depth is subtracted within a class (at most
+# CLASS_STEP - 1), so every product outranks every pagination page, pagination
+# outranks categories, and categories outrank facets and anything unrecognised.
+PAGE_CLASSES = ("product", "pagination", "category", "other")
+CLASS_STEP = 100
+PRIORITIES = {"product": 300, "pagination": 200, "category": 100, "other": 0}
+
+# Seed fields every request of a seed carries. Follow-up requests get these and
+# nothing else from the response: copying response.meta wholesale would also drag
+# along download_latency, the proxy, pooled context names and recrawl state.
+SEED_META_KEYS = (
+    "site", "seed_url", "allow_patterns", "deny_patterns", "strip_params", "product_patterns",
+    "pagination_patterns", "category_patterns", "max_depth", "max_listings", "scroll_to_load",
+    "type", "proxy_session",
+)
+
+FRONTIER_LINKS = Counter('frontier_links', 'Links scheduled by the frontier, by page class', ['site', 'page_class'])
+FRONTIER_DROPPED = Counter('frontier_dropped', 'Listing links dropped by depth/fan-out caps', ['site', 'reason'])
+
+
+def seed_meta(s: dict) -> dict:
+    """Request meta for a seeds-file entry (the keys of SEED_META_KEYS it sets)."""
+    meta = {k: s.get(k) for k in SEED_META_KEYS if s.get(k) is not None}
+    meta["seed_url"] = s.get("seed_url") or s["url"]
+    meta["scroll_to_load"] = s.get("scroll_to_load", False)
+    meta["proxy_session"] = s.get("site") if s.get("sticky_proxy") else s.get("proxy_session")
+    return meta
+
+
+def inherited_meta(meta: dict) -> dict:
+    return {k: meta[k] for k in SEED_META_KEYS if k in meta}
+
+
+def priority(page_class: str, depth: int = 0) -> int:
+    return PRIORITIES[page_class] - min(max(depth, 0), CLASS_STEP - 1)
+
+
+def _compile(patterns) -> Optional[re.Pattern]:
+    if not patterns:
+        return None
+    if isinstance(patterns, str):
+        patterns = [patterns]
+    return re.compile("|".join(f"(?:{p})" for p in patterns))
+
+
+class SeedRules:
+    # A seed's link rules, compiled once: the allow/deny link extractor and the
+    # product / pagination / category classifiers. Seeds without product_patterns
+    # fall back to the PRODUCT_LINK_PATTERNS substrings.
+    def __init__(self, meta: dict):
+        self.extractor = LinkExtractor(allow=meta.get("allow_patterns") or (), deny=meta.get("deny_patterns") or ())
+        self.product = _compile(meta.get("product_patterns"))
+        self.pagination = _compile(meta.get("pagination_patterns") or DEFAULT_PAGINATION_PATTERNS)
+        self.category = _compile(meta.get("category_patterns") or DEFAULT_CATEGORY_PATTERNS)
+
+    def is_product(self, url: str) -> bool:
+        if self.product is not None:
+            return self.product.search(url) is not None
+        return any(p in url for p in PRODUCT_LINK_PATTERNS)
+
+    def classify(self, url: str) -> str:
+        if self.is_product(url):
+            return "product"
+        if self.pagination.search(url):
+            return "pagination"
+        if self.category.search(url):
+            return "category"
+        return "other"
+
+
+class Frontier:
+    # Link policy for listing pages: classifies every extracted link, prioritises it
+    # by class and depth, and stops a seed's listings from exploding. Per seed,
+    # listing links deeper than max_depth are dropped, and at most max_listings
+    # distinct listing URLs are scheduled (seed keys override the FRONTIER_* defaults;
+    # 0 disables a cap). Product links are leaves and are never capped. Caps are
+    # counted per crawler process.
+    def __init__(self, max_depth: int = 0, max_listings: int = 0):
+        self.max_depth = max_depth
+        self.max_listings = max_listings
+        self._rules: Dict[str, SeedRules] = {}
+        self._listings: Dict[str, set] = {}
+
+    @staticmethod
+    def _seed_key(meta: dict) -> str:
+        return meta.get("seed_url") or meta.get("site") or ""
+
+    def rules(self, meta: dict) -> SeedRules:
+        key = self._seed_key(meta)
+        rules = self._rules.get(key)
+        if rules is None:
+            rules = self._rules[key] = SeedRules(meta)
+        return rules
+
+    def links(self, response) -> Iterator[Tuple[str, str, int]]:
+        """(url, page_class, priority) for each link of a listing response to follow."""
+        meta = response.meta
+        rules = self.rules(meta)
+        site = meta.get("site") or ""
+        depth = meta.get("depth", 0) + 1
+        max_depth = meta.get("max_depth", self.max_depth)
+        max_listings = meta.get("max_listings", self.max_listings)
+        listings = self._listings.setdefault(self._seed_key(meta), set()) if max_listings else None
+        for link in rules.extractor.extract_links(response):
+            url = link.url
+            page_class = rules.classify(url)
+            if page_class != "product":
+                if max_depth and depth > max_depth:
+                    FRONTIER_DROPPED.labels(site, "depth").inc()
+                    continue
+                if listings is not None and url not in listings:
+                    # Distinct URLs only: the same numbered page links repeat on every page
+                    if len(listings) >= max_listings:
+                        FRONTIER_DROPPED.labels(site, "fanout").inc()
+                        continue
+                    listings.add(url)
+            FRONTIER_LINKS.labels(site, page_class).inc()
+            yield url, page_class, priority(page_class, depth)
+
+
+def queue_composition(scheduler) -> Optional[Dict[str, int]]:
+    """Queued requests per page class, read from the Redis priority queue's score bands."""
+    queue = getattr(scheduler, "queue", None)
+    if not isinstance(queue, PriorityQueue):
+        return None
+    # Scores are -priority; a class spans priorities (base - CLASS_STEP, base]
+    with queue.server.pipeline(transaction=False) as pipe:
+        for page_class in PAGE_CLASSES:
+            base = PRIORITIES[page_class]
+            low, high = -base, -base + CLASS_STEP - 1
+            if page_class == "product":
+                low = "-inf"
+            if page_class == "other":
+                high = "+inf"
+            pipe.zcount(queue.key, low, high)
+        counts = pipe.execute()
+    return dict(zip(PAGE_CLASSES, counts))
@@ -0,0 +1,301 @@
+import os
+import time
+import inspect
+from contextlib import suppress
+
+import redis
+from prometheus_client import Counter, Histogram
+from scrapy.core.downloader.handlers.http11 import HTTP11DownloadHandler
+from scrapy.http import TextResponse
+from scrapy.utils.defer import deferred_from_coro, maybe_deferred_to_future
+from scrapy.utils.httpobj import urlparse_cached
+from scrapy_playwright.handler import ScrapyPlaywrightDownloadHandler
+from twisted.internet.threads import deferToThread
+
+from .utils.browser_pool import POOL_PAGE_REUSE, ContextPool
+from .utils.checkpoint import checkpoint_enabled, context_session, session_store
+from .utils.proxy import BAN_MARKERS
+from .utils.render import RenderDecisionCache, RENDER, STATIC
+
+# Page methods that only wait for the page; anything else (scrolling, clicks,
+# form fills) needs a real browser and skips the plain HTTP attempt.
+_PASSIVE_PAGE_METHODS = {"wait_for_load_state", "wait_for_selector", "wait_for_timeout"}
+
+# Statuses bot walls answer non-browser clients with
+_BOT_WALL_STATUSES = {403, 429, 503}
+
+# Scrapy 2.14 made handler download_request() a coroutine without the spider argument
+_ASYNC_HTTP_HANDLER = inspect.iscoroutinefunction(HTTP11DownloadHandler.download_request)
+
+FETCH_DECISIONS = Counter(
+    'hybrid_fetch_decisions', 'Hybrid fetch path taken per request', ['site', 'decision']
+)
+_RENDER_BUCKETS = (0.25, 0.5, 1, 2, 4, 8, 15, 30, 60, 120)
+RENDER_SECONDS = Histogram(
+    'render_seconds', 'Playwright render time per request, navigation plus page methods', ['site'],
+    buckets=_RENDER_BUCKETS,
+)
+PAGE_METHOD_SECONDS = Histogram(
+    'render_page_methods_seconds', 'Time in PageMethods (scrolling, waits) per render', ['site'],
+    buckets=_RENDER_BUCKETS,
+)
+SESSION_EVENTS = Counter(
+    'playwright_session_checkpoints', 'Context storage states restored and saved', ['event']
+)
+
+
+class HybridDownloadHandler(ScrapyPlaywrightDownloadHandler):
+    # Plain HTTP first, Playwright only when the spider can't find its data in the
+    # server HTML. The outcome is cached per site + URL template so later pages
+    # on the same template go straight to the right path.
+    #
+    # Rendered requests run in pooled per-site contexts (see ContextPool): the
+    # contexts in PLAYWRIGHT_CONTEXTS are templates, instantiated lazily per site
+    # instead of launched at startup; pages go back to the pool after a render
+    # and contexts are recycled after PLAYWRIGHT_CONTEXT_MAX_NAVIGATIONS renders
+    # or when Chromium's RSS exceeds PLAYWRIGHT_BROWSER_RSS_MB.
+    #
+    # With CHECKPOINT_ENABLED, each context's storage state (cookies, localStorage) is
+    # saved to Redis every SESSION_CHECKPOINT_RENDERS renders, before it is recycled
+    # and when the browser closes, keyed by site/template/slot. A new context for that
+    # slot, in this process or after a restart, starts from the saved state, or from
+    # the site's state saved right after a seed login (meta session_login). The state
+    # is loaded once per context, just before its first render and off the reactor
+    # thread; states this process saved are reused without asking Redis.
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        crawler = kwargs.get("crawler") or args[0]
+        self.sessions = None
+        if checkpoint_enabled():
+            self.sessions = session_store(redis.from_url(crawler.settings.get("REDIS_URL")), crawler.spidercls.name)
+        self.saved_sessions = {}  # context_session(key) -> last storage state saved for that slot
+        self.session_every = int(os.getenv("SESSION_CHECKPOINT_RENDERS", "20"))
+        self.hybrid_enabled = os.getenv("HYBRID_FETCH_ENABLED", "true").lower() == "true"
+        self.decisions = RenderDecisionCache(
+            min_samples=int(os.getenv("HYBRID_MIN_SAMPLES", "3")),
+            reprobe_every=int(os.getenv("HYBRID_REPROBE_EVERY", "200")),
+        )
+        self.context_templates = self.config.startup_context_kwargs
+        self.config.startup_context_kwargs = {}
+        rss_mb = int(os.getenv("PLAYWRIGHT_BROWSER_RSS_MB", "1536"))
+        self.pool = ContextPool(
+            contexts_per_site=int(os.getenv("PLAYWRIGHT_CONTEXTS_PER_SITE", "2")),
+            max_navigations=int(os.getenv("PLAYWRIGHT_CONTEXT_MAX_NAVIGATIONS", "200")),
+            max_idle_pages=int(os.getenv("PLAYWRIGHT_IDLE_PAGES_PER_CONTEXT", "2")),
+            rss_budget=rss_mb * 1024 * 1024 if rss_mb else None,
+            idle_timeout=float(os.getenv("PLAYWRIGHT_CONTEXT_IDLE_SECONDS", "300")),
+        )
+
+    def download_request(self, request, spider):
+        if request.meta.get("playwright"):
+            self._assign_context(request)
+        if not self.hybrid_enabled or not self._hybrid_eligible(request):
+            return self._render(request, spider)
+        key = self.decisions.key_for(request)
+        decision = self.decisions.get(key)
+        if decision == RENDER:
+            FETCH_DECISIONS.labels(site=key[0], decision="render_cached").inc()
+            return self._render(request, spider)
+        dfd = self._http_download(request, spider)
+        dfd.addCallback(self._check_static, request, spider, key, decision)
+        return dfd
+
+    def _http_download(self, request, spider):
+        if _ASYNC_HTTP_HANDLER:
+            return deferred_from_coro(HTTP11DownloadHandler.download_request(self, request))
+        return HTTP11DownloadHandler.download_request(self, request, spider)
+
+    def _render(self, request, spider):
+        if not request.meta.get("playwright"):
+            return self._http_download(request, spider)
+        request.meta["fetch_mode"] = RENDER
+        return deferred_from_coro(self._pooled_render(request, spider))
+
+    def _assign_context(self, request):
+        # Route the request to its site's pooled context and give it that context's
+        # UA, for the plain HTTP attempt as well as the render. Contexts are keyed by
+        # site, template and proxy (ProxyRotationMiddleware sets the context proxy).
+        base = request.meta.setdefault("pool_base", request.meta.get("playwright_context", "default"))
+        site = self._site(request)
+        kwargs = request.meta.get("playwright_context_kwargs") or {}
+        pool_key = f"{base}@{kwargs['proxy']['server']}" if kwargs.get("proxy") else base
+        ctx = self.pool.contexts.get(request.meta.get("pool_context"))
+        if ctx is None or ctx.retiring or ctx.key[:2] != (site, pool_key):
+            user_agent = request.headers.get("User-Agent")
+            ctx = self.pool.assign(site, pool_key, user_agent.decode() if user_agent else None)
+        # storage_state only takes effect when scrapy-playwright creates the context
+        request.meta["playwright_context_kwargs"] = {
+            **(self.context_templates.get(base) or {}), **kwargs,
+            **({"user_agent": ctx.user_agent} if ctx.user_agent else {}),
+            **({"storage_state": ctx.session} if ctx.session else {}),
+        }
+        request.meta["playwright_context"] = ctx.name
+        request.meta["pool_context"] = ctx.name
+        if ctx.user_agent:
+            request.headers["User-Agent"] = ctx.user_agent
+        return ctx
+
+    async def _pooled_render(self, request, spider):
+        ctx = self._assign_context(request)
+        if ctx.session is None:
+            ctx.session = self.saved_sessions.get(context_session(ctx.key))
+            if ctx.session is None:
+                ctx.session = await maybe_deferred_to_future(deferToThread(self._restore_session, ctx))
+            if ctx.session:
+                request.meta["playwright_context_kwargs"] = {
+                    **request.meta["playwright_context_kwargs"], "storage_state": ctx.session,
+                }
+        if request.meta.get("playwright_include_page"):
+            # The callback owns the page; keep scrapy-playwright's behaviour
+            self.pool.started(ctx)
+            start = time.perf_counter()
+            try:
+                response = await self._download_request(request, spider)
+                RENDER_SECONDS.labels(site=self._site(request)).observe(time.perf_counter() - start)
+            finally:
+                await self._close_pages(self.pool.finished(ctx))
+                await self._recycle(spider)
+            await self._checkpoint(ctx, login=self._logged_in(request, response))
+            return response
+        page = self.pool.take_idle(ctx)
+        POOL_PAGE_REUSE.labels(source="idle" if page is not None else "new").inc()
+        if page is not None:
+            request.meta["playwright_page"] = page
+        # Keep the page open after the download so it can go back to the pool
+        request.meta["playwright_include_page"] = True
+        self.pool.started(ctx)
+        start = time.perf_counter()
+        try:
+            response = await self._download_request(request, spider)
+            RENDER_SECONDS.labels(site=self._site(request)).observe(time.perf_counter() - start)
+        except Exception:
+            await self._close_pages(self.pool.finished(ctx))
+            page = request.meta.pop("playwright_page", None)
+            if page is not None:
+                await self._close_pages([page])
+            raise
+        finally:
+            request.meta.pop("playwright_include_page", None)
+            await self._recycle(spider)
+        page = request.meta.pop("playwright_page", None)
+        await self._close_pages(self.pool.finished(ctx, page))
+        await self._checkpoint(ctx, login=self._logged_in(request, response))
+        return response
+
+    def _restore_session(self, ctx) -> dict:
+        # Runs in a thread. The slot's own checkpoint, else the site's login session
+        if self.sessions is None:
+            return {}
+        state = self.sessions.get(context_session(ctx.key)) or self.sessions.get(ctx.key[0])
+        if state:
+            SESSION_EVENTS.labels(event="restored").inc()
+        return state or {}
+
+    @staticmethod
+    def _logged_in(request, response) -> bool:
+        return bool(request.meta.get("session_login")) and response.status < 400
+
+    async def _checkpoint(self, ctx, login: bool = False, force: bool = False):
+        if self.sessions is None or ctx.navigations == ctx.saved_at:
+            return
+        if not (login or force or ctx.navigations - ctx.saved_at >= self.session_every):
+            return
+        wrapper = self.context_wrappers.get(ctx.name)
+        if wrapper is None:
+            return
+        ctx.saved_at = ctx.navigations
+        try:
+            state = await wrapper.context.storage_state()
+        except Exception:
+            return  # closed under us
+        self.sessions.put(context_session(ctx.key), state)
+        self.saved_sessions[context_session(ctx.key)] = state
+        SESSION_EVENTS.labels(event="saved").inc()
+        if login:
+            self.sessions.put(ctx.key[0], state)
+            SESSION_EVENTS.labels(event="login").inc()
+
+    async def _apply_page_methods(self, page, request, spider):
+        start = time.perf_counter()
+        try:
+            return await super()._apply_page_methods(page, request, spider)
+        finally:
+            if request.meta.get("playwright_page_methods"):
+                PAGE_METHOD_SECONDS.labels(site=self._site(request)).observe(time.perf_counter() - start)
+
+    @staticmethod
+    def _site(request):
+        return request.meta.get("site") or urlparse_cached(request).hostname or ""
+
+    async def _recycle(self, spider):
+        await self._close_pages(self.pool.maintain())
+        for ctx in self.pool.drained():
+            await self._checkpoint(ctx, force=True)
+            wrapper = self.context_wrappers.get(ctx.name)
+            if wrapper is not None:
+                spider.logger.debug(f"Closing recycled browser context {ctx.name} after {ctx.navigations} renders")
+                with suppress(Exception):
+                    await wrapper.context.close()
+
+    async def _close(self):
+        # Checkpoint every live context before the browser goes away
+        for ctx in list(self.pool.contexts.values()):
+            await self._checkpoint(ctx, force=True)
+        await super()._close()
+
+    @staticmethod
+    async def _close_pages(pages):
+        for page in pages:
+            if not page.is_closed():
+                with suppress(Exception):
+                    await page.close()
+
+    def _check_static(self, response, request, spider, key, decision):
+        if response.status >= 400 and not self._bot_wall(response):
+            # A dead or failing URL (404, 410, 500, ...) goes back to the spider and the
+            # retry middleware; a browser would get the same answer. It says nothing
+            # about the template either, so the decision cache is left alone.
+            FETCH_DECISIONS.labels(site=key[0], decision="http_error").inc()
+            return response
+        if self._has_static_content(response, request, spider):
+            self.decisions.record(key, STATIC)
+            request.meta["fetch_mode"] = STATIC
+            FETCH_DECISIONS.labels(
+                site=key[0], decision="http_cached" if decision == STATIC else "http"
+            ).inc()
+            return response
+        self.decisions.record(key, RENDER)
+        FETCH_DECISIONS.labels(site=key[0], decision="escalated").inc()
+        spider.logger.debug(f"Escalating {request.url} to Playwright (template {key[2]})")
+        return self._render(request, spider)
+
+    @staticmethod
+    def _hybrid_eligible(request) -> bool:
+        if not request.meta.get("playwright") or request.method != "GET":
+            return False
+        if request.meta.get("hybrid_fetch") is False or request.meta.get("playwright_include_page"):
+            return False
+        methods = request.meta.get("playwright_page_methods") or []
+        return all(getattr(m, "method", None) in _PASSIVE_PAGE_METHODS for m in methods)
+
+    @staticmethod
+    def _has_static_content(response, request, spider) -> bool:
+        if 300 <= response.status < 400:
+            # Redirects and 304s go back through the middlewares; the follow-up
+            # request gets its own hybrid decision.
+            return True
+        if response.status >= 400:
+            # A bot wall (see _check_static); a browser may get through
+            return False
+        if not isinstance(response, TextResponse):
+            return True
+        probe = getattr(spider, "has_static_content", None)
+        return bool(probe and probe(response, request))
+
+    @staticmethod
+    def _bot_wall(response) -> bool:
+        if response.status in _BOT_WALL_STATUSES:
+            return True
+        head = response.body[:200_000]
+        return any(marker in head for marker in BAN_MARKERS)
@@ -18,3 +18,5 @@ class ProductItem(Item):
     breadcrumbs = Field()
     raw_html_path = Field()
     _raw_html_bytes = Field()  # Internal field for storing raw HTML before upload
+    _touch = Field()  # Internal: unchanged since the last crawl, sinks only record it as seen
+    _sink_ack = Field()  # Internal: SinkAck of a new/changed item, see ChangeDetectionPipeline
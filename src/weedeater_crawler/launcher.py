@@ -0,0 +1,261 @@
+import os
+import sys
+import time
+import shutil
+import signal
+import logging
+import argparse
+import subprocess
+from typing import List, Optional
+
+from prometheus_client import CollectorRegistry, multiprocess, start_http_server
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+from weedeater_crawler.utils.procs import process_tree, process_tree_rss
+
+logger = logging.getLogger("weedeater.launcher")
+
+# A worker that crashes (or outgrows the memory limit) again within this many seconds
+# of starting waits twice as long as last time before the next start, up to MAX_BACKOFF
+STABLE_SECONDS = 60.0
+MAX_BACKOFF = 60.0
+
+
+class Worker:
+    __slots__ = ("index", "proc", "started_at", "stopping", "stop_deadline", "backoff", "next_start", "rss")
+
+    def __init__(self, index: int):
+        self.index = index
+        self.proc: Optional[subprocess.Popen] = None
+        self.started_at = 0.0
+        self.stopping: Optional[str] = None  # why the launcher sent SIGTERM (drain | memory)
+        self.stop_deadline = 0.0
+        self.backoff = 0.0
+        self.next_start: Optional[float] = 0.0  # None once the worker is not to be restarted
+        self.rss = 0
+
+
+class Launcher:
+    # Runs `workers` `scrapy crawl` processes on one host. They share the scrapy-redis
+    # frontier (seed key, request queue, dupefilter), and each one has its own reactor
+    # and, through its download handler, its own Chromium. Workers write their metrics
+    # to a PROMETHEUS_MULTIPROC_DIR that the launcher serves, summed across workers, on
+    # one port.
+    #
+    # Workers are restarted when they crash (with backoff) and when their process
+    # tree (Python, Playwright driver, Chromium) goes over max_rss: the worker gets a
+    # SIGTERM, drains like a stopped crawl, and starts again. A worker exiting 0 has
+    # finished its crawl and is not restarted. SIGTERM/SIGINT drain all workers; after
+    # drain_timeout, or on a second signal, what is left is killed.
+    def __init__(self, workers: int, crawl_args: List[str], metrics_dir: str, metrics_port: int = 8008,
+                 max_rss: Optional[int] = None, drain_timeout: float = 120.0, check_interval: float = 5.0):
+        self.workers = [Worker(i) for i in range(workers)]
+        self.crawl_args = crawl_args
+        self.metrics_dir = metrics_dir
+        self.metrics_port = metrics_port
+        self.max_rss = max_rss
+        self.drain_timeout = drain_timeout
+        self.check_interval = check_interval
+        self.draining = False
+        self.restarts = {}
+
+    def worker_env(self, worker: Worker) -> dict:
+        env = dict(os.environ)
+        env.update({
+            "PROMETHEUS_MULTIPROC_DIR": self.metrics_dir,
+            "PROMETHEUS_PORT": "0",
+            "WEEDEATER_SEED_SOURCE": "redis",
+            "WEEDEATER_WORKER": str(worker.index),
+        })
+        env.setdefault("SCRAPY_SETTINGS_MODULE", "weedeater_crawler.settings")
+        profiler_port = int(os.getenv("PROFILER_PORT", "0"))
+        if profiler_port:
+            env["PROFILER_PORT"] = str(profiler_port + worker.index)
+        return env
+
+    def start(self, worker: Worker):
+        cmd = [
+            sys.executable, "-m", "scrapy", "crawl", *self.crawl_args,
+            # The launcher's RSS watchdog replaces Scrapy's, which only sees the Python process
+            "-s", "MEMUSAGE_ENABLED=False",
+            "-s", f"LOG_FORMAT=%(asctime)s [worker {worker.index}] [%(name)s] %(levelname)s: %(message)s",
+        ]
+        # Own session: a terminal Ctrl-C reaches the launcher only, which drains the workers
+        worker.proc = subprocess.Popen(cmd, env=self.worker_env(worker), start_new_session=True)
+        worker.started_at = time.monotonic()
+        worker.stopping = None
+        worker.rss = 0
+        logger.info(f"Worker {worker.index} started (pid {worker.proc.pid})")
+
+    def stop(self, worker: Worker, reason: str):
+        if worker.proc is None or worker.stopping:
+            return
+        worker.stopping = reason
+        worker.stop_deadline = time.monotonic() + self.drain_timeout
+        self._signal(worker, signal.SIGTERM)
+
+    def kill(self, worker: Worker):
+        # The whole tree: Playwright starts Chromium in a process group of its own
+        pids = [worker.proc.pid] + (process_tree(worker.proc.pid) or [])
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except OSError:
+                pass
+
+    def _signal(self, worker: Worker, signum: int):
+        try:
+            worker.proc.send_signal(signum)
+        except OSError:
+            pass
+
+    def handle_signal(self, signum, frame):
+        if not self.draining:
+            logger.info(f"Received {signal.Signals(signum).name}, draining {self.alive()} worker(s)")
+            self.draining = True
+            for worker in self.workers:
+                self.stop(worker, "drain")
+            return
+        # Second signal: Scrapy stops without waiting for in-flight requests
+        logger.info(f"Received {signal.Signals(signum).name} again, forcing shutdown")
+        for worker in self.workers:
+            if worker.proc is not None:
+                self._signal(worker, signal.SIGTERM)
+                worker.stop_deadline = min(worker.stop_deadline, time.monotonic() + 10)
+
+    def alive(self) -> int:
+        return sum(1 for w in self.workers if w.proc is not None)
+
+    def reap(self, worker: Worker):
+        code = worker.proc.poll()
+        if code is None:
+            return
+        pid, ran = worker.proc.pid, time.monotonic() - worker.started_at
+        worker.proc = None
+        multiprocess.mark_process_dead(pid, self.metrics_dir)
+        if self.draining:
+            logger.info(f"Worker {worker.index} stopped (exit {code})")
+            worker.next_start = None
+        elif worker.stopping == "memory":
+            # Straight back up, unless it outgrows the limit right after every start
+            self._restart(worker, "memory", 0.0 if ran >= STABLE_SECONDS else self._backoff(worker, ran))
+        elif code == 0:
+            logger.info(f"Worker {worker.index} finished its crawl")
+            worker.next_start = None
+        else:
+            delay = self._backoff(worker, ran)
+            logger.warning(f"Worker {worker.index} exited with {code} after {ran:.0f}s, restarting in {delay:.0f}s")
+            self._restart(worker, "crash", delay)
+
+    @staticmethod
+    def _backoff(worker: Worker, ran: float) -> float:
+        worker.backoff = 1.0 if ran >= STABLE_SECONDS or not worker.backoff else min(worker.backoff * 2, MAX_BACKOFF)
+        return worker.backoff
+
+    def _restart(self, worker: Worker, reason: str, delay: float):
+        self.restarts[reason] = self.restarts.get(reason, 0) + 1
+        worker.next_start = time.monotonic() + delay
+
+    def check_memory(self, worker: Worker):
+        worker.rss = process_tree_rss(worker.proc.pid, include_root=True) or 0
+        if self.max_rss and worker.rss > self.max_rss and not worker.stopping:
+            logger.warning(f"Worker {worker.index} uses {worker.rss / 1048576:.0f}MB "
+                           f"(limit {self.max_rss / 1048576:.0f}MB), restarting it")
+            self.stop(worker, "memory")
+
+    def serve_metrics(self):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry, path=self.metrics_dir)
+        registry.register(_LauncherCollector(self))
+        start_http_server(self.metrics_port, registry=registry)
+        logger.info(f"Serving metrics of {len(self.workers)} worker(s) on :{self.metrics_port}/metrics")
+
+    def run(self) -> int:
+        # Files of a previous run would be summed in as dead processes
+        shutil.rmtree(self.metrics_dir, ignore_errors=True)
+        os.makedirs(self.metrics_dir)
+        signal.signal(signal.SIGTERM, self.handle_signal)
+        signal.signal(signal.SIGINT, self.handle_signal)
+        if self.metrics_port:
+            self.serve_metrics()
+        last_check = 0.0
+        while True:
+            now = time.monotonic()
+            check = now - last_check >= self.check_interval
+            if check:
+                last_check = now
+            for worker in self.workers:
+                if worker.proc is not None:
+                    self.reap(worker)
+                if worker.proc is None:
+                    if not self.draining and worker.next_start is not None and now >= worker.next_start:
+                        self.start(worker)
+                    continue
+                if worker.stopping and now >= worker.stop_deadline:
+                    logger.warning(f"Worker {worker.index} did not stop within {self.drain_timeout:.0f}s, killing it")
+                    self.kill(worker)
+                elif check:
+                    self.check_memory(worker)
+            if not self.alive() and (self.draining or all(w.next_start is None for w in self.workers)):
+                break
+            time.sleep(0.5)
+        logger.info("All workers stopped")
+        return 0
+
+
+class _LauncherCollector:
+    def __init__(self, launcher: Launcher):
+        self.launcher = launcher
+
+    def collect(self):
+        alive = GaugeMetricFamily('launcher_workers', 'Crawler worker processes running')
+        alive.add_metric([], self.launcher.alive())
+        yield alive
+        restarts = CounterMetricFamily('launcher_worker_restarts', 'Worker restarts by reason', labels=['reason'])
+        for reason, count in self.launcher.restarts.items():
+            restarts.add_metric([reason], count)
+        yield restarts
+        rss = GaugeMetricFamily('launcher_worker_rss_bytes', 'RSS of each worker process tree', labels=['worker'])
+        for worker in self.launcher.workers:
+            if worker.proc is not None:
+                rss.add_metric([str(worker.index)], worker.rss)
+        yield rss
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Run several crawler processes on this host, sharing the Redis frontier.",
+        epilog="Arguments after -- go to `scrapy crawl` (e.g. -- -s LOG_LEVEL=DEBUG). Workers read seeds "
+               "from Redis (push them with tools/seed_queue.py).",
+    )
+    parser.add_argument("--workers", type=int, default=int(os.getenv("WEEDEATER_WORKERS", "0")) or os.cpu_count(),
+                        help="worker processes (default: WEEDEATER_WORKERS or the CPU count)")
+    parser.add_argument("--spider", default="weedeater")
+    parser.add_argument("--max-rss-mb", type=int, default=int(os.getenv("WORKER_MAX_RSS_MB", "3072")),
+                        help="restart a worker whose process tree exceeds this (0 disables)")
+    parser.add_argument("--drain-timeout", type=float, default=float(os.getenv("WORKER_DRAIN_TIMEOUT", "120")),
+                        help="seconds a stopping worker gets before it is killed")
+    parser.add_argument("--metrics-port", type=int, default=int(os.getenv("PROMETHEUS_PORT", "8008")),
+                        help="port for the workers' combined metrics (0 disables)")
+    parser.add_argument("--metrics-dir", default=os.getenv("PROMETHEUS_MULTIPROC_DIR", "/tmp/weedeater-metrics"),
+                        help="multiprocess metrics directory (emptied on start)")
+    parser.add_argument("crawl_args", nargs="*", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    if args.workers < 1:
+        parser.error("--workers must be >= 1")
+
+    logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"),
+                        format="%(asctime)s [launcher] %(levelname)s: %(message)s")
+    if os.getenv("WEEDEATER_SEED_SOURCE", "yaml").lower() != "redis":
+        logger.info("Workers read seeds from Redis (WEEDEATER_SEED_SOURCE=redis); "
+                    "push the seeds file with tools/seed_queue.py")
+    launcher = Launcher(
+        args.workers, [args.spider, *args.crawl_args], args.metrics_dir, args.metrics_port,
+        max_rss=args.max_rss_mb * 1024 * 1024 if args.max_rss_mb else None,
+        drain_timeout=args.drain_timeout,
+    )
+    return launcher.run()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
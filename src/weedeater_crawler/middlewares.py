@@ -1,15 +1,40 @@
 import os
+import time
+from time import monotonic
 from typing import Optional
+import redis
+from prometheus_client import Counter, Gauge, Histogram
 from scrapy import signals
-from scrapy.http import Request
-from scrapy.downloadermiddlewares.retry import RetryMiddleware
-from scrapy.exceptions import IgnoreRequest
-from twisted.internet import defer
-from twisted.internet.task import deferLater
-from twisted.internet import reactor
+from scrapy.http import Request, TextResponse
+from scrapy.downloadermiddlewares.retry import RetryMiddleware, get_retry_request
+from scrapy.exceptions import IgnoreRequest, NotConfigured
+from scrapy.utils.httpobj import urlparse_cached
+from scrapy.utils.response import response_status_message
 
+from .dupefilter import recrawl_store
 from .utils.ua import get_user_agent
-from .utils.proxy import get_proxy
+from .utils.proxy import ProxyManager, is_banned, playwright_proxy, proxy_label
+from .utils.ratelimit import RateController, parse_retry_after
+from .utils.recrawl import content_hash
+from .utils.urls import request_url
+from .utils.render import RENDER, STATIC
+
+RECRAWL_SKIPPED = Counter('recrawl_skipped', 'Revisits skipped before extraction', ['site', 'reason'])
+RECRAWL_BYTES_SAVED = Counter('recrawl_bytes_saved', 'Body bytes not transferred thanks to 304 responses', ['site'])
+RECRAWL_RENDERS_SAVED = Counter('recrawl_renders_saved', 'Playwright renders avoided by conditional revisits', ['site'])
+RATE_CONCURRENCY = Gauge('ratelimit_concurrency', 'Concurrency the rate controller allows per downloader slot', ['slot'],
+                         multiprocess_mode='livesum')
+RATE_DELAY = Gauge('ratelimit_delay_seconds', 'Download delay the rate controller sets per downloader slot', ['slot'],
+                   multiprocess_mode='livemax')
+RATE_ALLOWED = Gauge('ratelimit_allowed_rate', 'Requests/s allowed per slot (min of 1/delay and concurrency/latency)', ['slot'],
+                     multiprocess_mode='livesum')
+RATE_THROTTLED = Counter('ratelimit_throttled', 'Throttling responses (429/503) per downloader slot', ['slot', 'status'])
+RATE_WAIT_SECONDS = Counter('ratelimit_wait_seconds', 'Seconds requests waited out a Retry-After block', ['slot'])
+RATE_DEFERRED = Counter('ratelimit_deferred', 'Requests sent back to the scheduler while their slot was blocked', ['slot'])
+PARSE_SECONDS = Histogram(
+    'callback_parse_seconds', 'Time spent inside spider callbacks per response', ['site', 'callback'],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+)
 
 class UserAgentRotationMiddleware:
     def process_request(self, request: Request, spider):
@@ -17,27 +42,277 @@ class UserAgentRotationMiddleware:
         request.headers['User-Agent'] = ua
 
 class ProxyRotationMiddleware:
+    # Picks a proxy per request from the health-scored ProxyManager and feeds the
+    # outcome back: success/latency, connection errors, and bans (403/429/captcha
+    # pages). Bans are retried through another proxy. Requests with `proxy_session`
+    # in meta (seed `sticky_proxy`) keep one proxy per session until it gets banned.
+    # Rendered requests get the proxy through their Playwright context's kwargs,
+    # since Chromium ignores meta['proxy']. A proxy set explicitly in meta is left alone.
+    #
+    # It sits above RateLimitRetryMiddleware (550) and IncrementalRecrawlMiddleware
+    # (580), so it sees every response and download error before they are turned into
+    # retries or dropped, and below HttpCompressionMiddleware (590), so ban pages are
+    # matched on the decoded body.
+    def __init__(self, manager, retry_http_codes=()):
+        self.manager = manager
+        self.retry_http_codes = set(retry_http_codes)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        server = redis.from_url(crawler.settings.get("REDIS_URL")) if os.getenv("PROXY_REDIS_KEY") else None
+        manager = ProxyManager.from_env(server)
+        if manager is None:
+            raise NotConfigured
+        return cls(manager, (int(x) for x in crawler.settings.getlist("RETRY_HTTP_CODES")))
+
+    @staticmethod
+    def _domain(request):
+        return request.meta.get("site") or urlparse_cached(request).hostname or ""
+
     def process_request(self, request: Request, spider):
-        proxy = get_proxy()
-        if proxy:
-            request.meta['proxy'] = proxy
+        if request.meta.get("proxy") and not request.meta.get("proxy_managed"):
+            return
+        # A retry carries the proxy of the failed attempt; prefer another one
+        avoid = request.meta.get("proxy") if request.meta.get("retry_times") else None
+        proxy = self.manager.choose(self._domain(request), request.meta.get("proxy_session"), avoid=avoid)
+        if not proxy:
+            return
+        request.meta["proxy"] = proxy
+        request.meta["proxy_managed"] = True
+        if request.meta.get("playwright"):
+            # HybridDownloadHandler keys its pooled contexts on this proxy
+            request.meta["playwright_context_kwargs"] = {
+                **request.meta.get("playwright_context_kwargs", {}), "proxy": playwright_proxy(proxy)}
+
+    def process_response(self, request, response, spider):
+        proxy = request.meta.get("proxy")
+        if not request.meta.get("proxy_managed") or not proxy:
+            return response
+        banned = is_banned(response.status, response.body)
+        ok = not banned and response.status < 500
+        # Render time isn't proxy latency; only plain HTTP fetches feed the EWMA
+        latency = request.meta.get("download_latency") if request.meta.get("fetch_mode") != RENDER else None
+        self.manager.record(proxy, self._domain(request), ok, latency=latency, banned=banned,
+                            session=request.meta.get("proxy_session"))
+        if banned and response.status not in self.retry_http_codes and not request.meta.get("dont_retry"):
+            # 429 (like the 5xx) is in RETRY_HTTP_CODES: RateLimitRetryMiddleware retries it
+            # and rate limits the slot once this hands the response on
+            retry = get_retry_request(request, spider=spider, reason=f"proxy_banned_{response.status}")
+            if retry is not None:
+                spider.logger.info(f"Ban page via {proxy_label(proxy)} on {request.url}, retrying on another proxy")
+                return retry
+        return response
+
+    def process_exception(self, request, exception, spider):
+        proxy = request.meta.get("proxy")
+        if request.meta.get("proxy_managed") and proxy:
+            self.manager.record(proxy, self._domain(request), ok=False)
 
 class RateLimitRetryMiddleware(RetryMiddleware):
-    # Handle 429 with exponential backoff using Retry-After if present
-    # Use Scrapy's built-in retry mechanism with DOWNLOAD_DELAY instead of blocking with time.sleep()
+    # Retries plus a per-slot (per-domain) AIMD rate controller, see RateController.
+    # 429/503 block the slot for Retry-After (seconds or HTTP-date) on every node via
+    # Redis. Nothing waits in the middleware chain: a blocked slot's lastseen is pushed
+    # past the block so the downloader holds its queue. A block longer than max_hold
+    # seconds would tie up the crawler's CONCURRENT_REQUESTS: once the slot's queue has
+    # a full slot's worth of requests, further ones go back to the scheduler with their
+    # priority lowered by blocked_priority_adjust (once per block, so a crawl of
+    # blocked slots only doesn't spin through the queue) for other domains to go first.
+    # Shorter blocks are waited out in the slot; sending them back only reorders the
+    # frontier.
+    # The controller drives the downloader slot's delay and concurrency directly, so
+    # AutoThrottle should stay off while it is enabled (RATE_CONTROL_ENABLED).
+    def __init__(self, settings, controller=None, blocked_priority_adjust: int = -400, max_hold: float = 10.0):
+        super().__init__(settings)
+        self.controller = controller
+        self.blocked_priority_adjust = blocked_priority_adjust
+        self.max_hold = max_hold
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        controller = None
+        if os.getenv("RATE_CONTROL_ENABLED", "true").lower() == "true":
+            server = None
+            if os.getenv("RATE_CONTROL_SHARED", "true").lower() == "true":
+                server = redis.from_url(settings.get("REDIS_URL"))
+            controller = RateController(
+                server,
+                key_prefix=f"{crawler.spidercls.name}:ratelimit",
+                min_delay=settings.getfloat("DOWNLOAD_DELAY"),
+                max_delay=float(os.getenv("RATE_MAX_DELAY", "60")),
+                max_concurrency=settings.getint("CONCURRENT_REQUESTS_PER_DOMAIN"),
+                latency_factor=float(os.getenv("RATE_LATENCY_FACTOR", "3.0")),
+                rate_step=float(os.getenv("RATE_STEP", "0.1")),
+                sync_interval=float(os.getenv("RATE_SYNC_INTERVAL", "5")),
+                max_retry_after=float(os.getenv("RATE_MAX_RETRY_AFTER", "900")),
+            )
+        # Default: below every page class of the frontier
+        o = cls(settings, controller, int(os.getenv("RATE_BLOCKED_PRIORITY_ADJUST", "-400")),
+                float(os.getenv("RATE_BLOCKED_MAX_HOLD", "10")))
+        o.crawler = crawler
+        if controller is not None:
+            # Same hook as AutoThrottle: response_downloaded fires before the slot
+            # dequeues its next request, so adjustments apply to that request
+            crawler.signals.connect(o.response_downloaded, signal=signals.response_downloaded)
+        return o
+
+    @staticmethod
+    def _slot_key(request):
+        return request.meta.get("download_slot") or urlparse_cached(request).hostname or ""
+
+    def process_request(self, request: Request, spider):
+        if self.controller is None:
+            return None
+        key = self._slot_key(request)
+        wait = self.controller.wait_time(key)
+        state = self.controller.state(key)
+        if wait > self.max_hold:
+            # The slot may not exist yet (first request since the block came in from
+            # another node); the downloader would create it for this request anyway
+            _, slot = self.crawler.engine.downloader._get_slot(request)
+            if len(slot.queue) >= slot.concurrency and request.meta.get("rate_deferred") != state.blocked_until:
+                RATE_DEFERRED.labels(slot=key).inc()
+                deferred = request.replace(dont_filter=True, priority=request.priority + self.blocked_priority_adjust)
+                deferred.meta["rate_deferred"] = state.blocked_until
+                return deferred
+        if wait > 0:
+            RATE_WAIT_SECONDS.labels(slot=key).inc(wait)
+        # Picks up penalties merged from other nodes on the last sync
+        self._apply(key, state)
+        return None
+
+    def response_downloaded(self, response, request, spider):
+        slot = self._slot_key(request)
+        if response.status in (429, 503):
+            retry_after = parse_retry_after(response.headers.get(b'Retry-After'))
+            state = self.controller.throttled(slot, retry_after)
+            self._apply(slot, state)
+            RATE_THROTTLED.labels(slot=slot, status=str(response.status)).inc()
+            spider.logger.warning(
+                f"Throttled ({response.status}) on {request.url}: slot {slot} blocked "
+                f"{state.blocked_until - time.time():.1f}s, delay {state.delay:.2f}s, "
+                f"concurrency {state.concurrency:.1f}")
+        elif response.status < 400 and request.meta.get("fetch_mode") != RENDER:
+            # Render time isn't server latency; only plain HTTP fetches feed the signal
+            latency = request.meta.get("download_latency")
+            if latency is not None:
+                self._apply(slot, self.controller.observe(slot, latency))
+
+    def process_response(self, request, response, spider):
+        if request.meta.get("dont_retry", False) or response.status not in self.retry_http_codes:
+            return response
+        reason = f"rate_limited_{response.status}" if response.status in (429, 503) else response_status_message(response.status)
+        return get_retry_request(request, spider=spider, reason=reason, max_retry_times=self.max_retry_times,
+                                 priority_adjust=self.priority_adjust) or response
+
+    def _apply(self, slot_key, state):
+        slot = self.crawler.engine.downloader.slots.get(slot_key)
+        if slot is not None:
+            slot.concurrency = max(1, int(state.concurrency))
+            slot.delay = state.delay
+            blocked = state.blocked_until - time.time()
+            if blocked > 0 and state.delay > 0:
+                # Nothing waits in process_request; pushing lastseen forward makes the
+                # slot's own delay hold its queued requests until the block ends.
+                slot.lastseen = max(slot.lastseen, monotonic() + blocked - state.delay)
+        RATE_CONCURRENCY.labels(slot=slot_key).set(state.concurrency)
+        RATE_DELAY.labels(slot=slot_key).set(state.delay)
+        RATE_ALLOWED.labels(slot=slot_key).set(state.rate)
+
+class IncrementalRecrawlMiddleware:
+    # Conditional revisits for incremental crawls (INCREMENTAL_ENABLED=true). Stored
+    # ETag/Last-Modified go out as If-None-Match/If-Modified-Since; a 304, or a product
+    # page whose normalized content hash is unchanged, is dropped before extraction
+    # and the pipelines. Validators only reach the server on the plain HTTP path of
+    # the hybrid handler; rendered pages rely on the content hash.
+    def __init__(self, store):
+        self.store = store
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if os.getenv("INCREMENTAL_ENABLED", "false").lower() != "true":
+            raise NotConfigured
+        server = redis.from_url(crawler.settings.get("REDIS_URL"))
+        return cls(recrawl_store(server, crawler.spidercls.name))
+
+    def process_request(self, request: Request, spider):
+        # Sitemaps are always re-read; their lastmods drive what gets revisited
+        if request.method != "GET" or request.meta.get("page_type") == "sitemap":
+            return
+        state = self.store.get(request_url(request))
+        request.meta["recrawl_state"] = state
+        if not state:
+            return
+        if state.get("etag"):
+            request.headers.setdefault("If-None-Match", state["etag"])
+        if state.get("last_modified"):
+            request.headers.setdefault("If-Modified-Since", state["last_modified"])
+
     def process_response(self, request, response, spider):
-        if response.status == 429:
-            retry_after = response.headers.get(b'Retry-After')
-            if retry_after:
-                try:
-                    delay = int(retry_after.decode())
-                except Exception:
-                    delay = 2
-            else:
-                delay = 2
-            # Store the delay in request meta for the retry middleware to respect
-            request.meta['download_delay'] = delay
-            spider.logger.warning(f"Rate limited (429) on {request.url}, will retry after {delay}s")
-            # Let Scrapy's retry middleware handle the retry
-            return self._retry(request, f"rate_limited_429", spider) or response
+        if "recrawl_state" not in request.meta:
+            return response
+        state = request.meta["recrawl_state"]
+        site = request.meta.get("site") or "unknown"
+        if response.status == 304 and state:
+            self.store.record(request_url(request), changed=False)
+            RECRAWL_SKIPPED.labels(site=site, reason="not_modified").inc()
+            RECRAWL_BYTES_SAVED.labels(site=site).inc(state.get("length") or 0)
+            if request.meta.get("playwright") and request.meta.get("fetch_mode") == STATIC:
+                RECRAWL_RENDERS_SAVED.labels(site=site).inc()
+            raise IgnoreRequest(f"Not modified since last crawl: {request.url}")
+        if response.status != 200 or not isinstance(response, TextResponse):
+            return response
+        digest = content_hash(response.body)
+        changed = not state or state.get("hash") != digest
+        etag = response.headers.get("ETag")
+        last_modified = response.headers.get("Last-Modified")
+        self.store.record(
+            request_url(request), changed,
+            etag=etag.decode("latin-1") if etag else None,
+            last_modified=last_modified.decode("latin-1") if last_modified else None,
+            digest=digest, length=len(response.body),
+        )
+        # Listings are always parsed so their links can hit the dupefilter's revisit check
+        if not changed and request.meta.get("page_type") == "product":
+            RECRAWL_SKIPPED.labels(site=site, reason="unchanged").inc()
+            raise IgnoreRequest(f"Content unchanged since last crawl: {request.url}")
         return response
+
+
+class CallbackTimingMiddleware:
+    # Innermost spider middleware: times the spider callback itself, i.e. only the
+    # time spent producing each output, not the other middlewares or the pipelines
+    # consuming the items in between.
+    @staticmethod
+    def _labels(response):
+        request = response.request
+        return {
+            "site": response.meta.get("site") or urlparse_cached(request).hostname or "",
+            "callback": getattr(request.callback, "__name__", None) or "parse",
+        }
+
+    def process_spider_output(self, response, result, spider):
+        elapsed, it = 0.0, iter(result)
+        while True:
+            start = time.perf_counter()
+            try:
+                out = next(it)
+            except StopIteration:
+                break
+            finally:
+                elapsed += time.perf_counter() - start
+            yield out
+        PARSE_SECONDS.labels(**self._labels(response)).observe(elapsed)
+
+    async def process_spider_output_async(self, response, result, spider):
+        elapsed, it = 0.0, result.__aiter__()
+        while True:
+            start = time.perf_counter()
+            try:
+                out = await it.__anext__()
+            except StopAsyncIteration:
+                break
+            finally:
+                elapsed += time.perf_counter() - start
+            yield out
+        PARSE_SECONDS.labels(**self._labels(response)).observe(elapsed)
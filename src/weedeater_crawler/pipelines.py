@@ -1,29 +1,282 @@
 import os
 import json
 import sqlite3
+import time
+import queue
+import random
 import hashlib
+import functools
 import threading
 from pathlib import Path
-from datetime import datetime, timezone
+from collections import OrderedDict
+
+import redis
+from google.api_core import exceptions as gexc
+from prometheus_client import Counter, Gauge, Histogram
+from scrapy import signals
+from scrapy.exceptions import DropItem
+from twisted.internet import reactor
+from twisted.internet.defer import Deferred, DeferredList, DeferredSemaphore
+from twisted.internet.task import LoopingCall
+from twisted.internet.threads import deferToThread, deferToThreadPool
+from twisted.python.failure import Failure
+from twisted.python.threadpool import ThreadPool
+
+from .utils.archive import SegmentArchiveWriter
+from .utils.parquet import PartitionedParquetWriter, to_row
+from .utils.changes import (
+    DEFAULT_TRACKED_FIELDS, JSONLChangeStream, RedisChangeStore, RedisChangeStream, SQLiteChangeStore,
+    field_diff, item_digest, tracked,
+)
+from .utils.storage import (
+    CONTENT_ENCODING_SUFFIXES, compress, ensure_dir, gcs_object_exists, get_firestore,
+    s3_object_exists, upload_file_gcs, upload_file_s3, upload_gcs, upload_s3,
+)
+
+SQLITE_COLUMNS = (
+    "source_url", "crawled_at", "site", "brand", "product_name", "sku", "upc", "category",
+    "price", "currency", "availability", "description", "specs", "images", "breadcrumbs",
+    "raw_html_path", "item_key",
+)
+
+SQLITE_QUEUE_DEPTH = Gauge('sqlite_writer_queue_depth', 'Rows waiting for the SQLite writer thread',
+                           multiprocess_mode='livesum')
+SQLITE_BACKPRESSURE = Counter('sqlite_writer_backpressure', 'Items that waited for room in the SQLite writer queue')
+SQLITE_FAILED_ROWS = Counter('sqlite_writer_failed_rows', 'Rows the SQLite writer gave up on')
+SQLITE_FLUSH_SECONDS = Histogram('sqlite_writer_flush_seconds', 'Time to write and commit one SQLite batch')
+SQLITE_FLUSH_ROWS = Histogram(
+    'sqlite_writer_flush_rows', 'Rows per SQLite batch', buckets=(1, 10, 50, 100, 250, 500, 1000, 5000)
+)
+
+
+PIPELINE_SECONDS = Histogram(
+    'pipeline_process_item_seconds', 'process_item time per pipeline, until its Deferred fires',
+    ['pipeline', 'site'], buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5),
+)
+
+
+def timed(process_item):
+    """Observe process_item time in PIPELINE_SECONDS; Deferred results are timed until they fire."""
+    @functools.wraps(process_item)
+    def wrapper(self, item, spider):
+        start = time.perf_counter()
+        labels = {"pipeline": type(self).__name__, "site": item.get('site') or ""}
+        result = process_item(self, item, spider)
+        if isinstance(result, Deferred):
+            def observe(value):
+                PIPELINE_SECONDS.labels(**labels).observe(time.perf_counter() - start)
+                return value
+            return result.addBoth(observe)
+        PIPELINE_SECONDS.labels(**labels).observe(time.perf_counter() - start)
+        return result
+    return wrapper
+
+
+def item_key(item) -> str:
+    # Natural key shared by every sink: the SKU when the page exposes one, else the URL
+    return str(item.get('sku') or item.get('source_url'))
+
+
+CHANGE_OUTCOMES = Counter('change_detection_items', 'Items by change-detection outcome', ['site', 'outcome'])
+CHANGE_EVENTS = Counter('change_stream_events', 'Field-level change events emitted', ['site', 'field'])
+CHANGE_UNRECORDED = Counter('change_detection_unrecorded', 'Changed items whose hash was not stored because a sink failed',
+                            ['site'])
+
+
+class SinkAck:
+    # Outcome of the sink writes of one new or changed item, carried in item['_sink_ack'].
+    # A sink that writes in the background (the SQLite writer thread, Firestore
+    # batches) calls hold() when it takes the item and release(ok) once the write
+    # committed or failed. The callback runs with the overall outcome once the item
+    # has also finished the pipelines (finish) and nothing is held. Reactor thread only.
+    __slots__ = ("holds", "ok", "finished", "callback")
+
+    def __init__(self, callback=None):
+        self.holds = 0
+        self.ok = True
+        self.finished = False
+        self.callback = callback
+
+    def hold(self):
+        self.holds += 1
+
+    def release(self, ok: bool = True):
+        self.holds -= 1
+        self.ok = self.ok and ok
+        self._check()
+
+    def finish(self, ok: bool = True):
+        self.finished = True
+        self.ok = self.ok and ok
+        self._check()
+
+    def _check(self):
+        if self.finished and self.holds <= 0 and self.callback is not None:
+            callback, self.callback = self.callback, None
+            callback(self.ok)
+
+
+class ChangeDetectionPipeline:
+    # Runs ahead of the sinks and lets only new or changed products through in full.
+    # Each item's normalized fields (crawled_at and storage paths excluded) are hashed
+    # and compared with the last hash stored for its (site, item_key), in the Redis
+    # hash CHANGE_STORE_KEY or a local SQLite index (CHANGE_STORE=sqlite). Unchanged
+    # items are dropped (CHANGE_DETECTION=drop) or passed on as a "last seen" touch
+    # (CHANGE_DETECTION=touch): '_touch' is set and the raw HTML is discarded, so the
+    # archive/upload pipelines skip them, SQLite only updates crawled_at and Firestore
+    # skips them unless FIRESTORE_WRITE_TOUCHES=true. New items and changes to the
+    # CHANGE_TRACKED_FIELDS go to a change stream: a Redis stream (CHANGE_STREAM=redis)
+    # or a JSONL file (CHANGE_STREAM=jsonl). The hash is recorded, and the change
+    # event emitted, only once the item has passed every pipeline and the background
+    # sink writes (SQLite, Firestore) holding its SinkAck have committed; an item a
+    # sink failed on is written again in full next crawl.
+    def __init__(self, crawler=None):
+        self.crawler = crawler
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        pipeline = cls(crawler)
+        crawler.signals.connect(pipeline.item_scraped, signal=signals.item_scraped)
+        crawler.signals.connect(pipeline.item_failed, signal=signals.item_dropped)
+        crawler.signals.connect(pipeline.item_failed, signal=signals.item_error)
+        return pipeline
+
+    def open_spider(self, spider):
+        self.mode = os.getenv("CHANGE_DETECTION", "touch").lower()
+        self.store = self.stream = None
+        if self.mode not in ("drop", "touch"):
+            return
+        self.logger = spider.logger
+        self.tracked_fields = [f.strip() for f in os.getenv(
+            "CHANGE_TRACKED_FIELDS", ",".join(DEFAULT_TRACKED_FIELDS)).split(",") if f.strip()]
+        self.acks = set()
+        self.closing = None
+        server = None
+        redis_url = spider.settings.get("REDIS_URL")
+        if os.getenv("CHANGE_STORE", "redis").lower() == "sqlite":
+            self.store = SQLiteChangeStore(os.getenv("CHANGE_STORE_PATH", "data/item_state.sqlite"))
+        else:
+            server = redis.from_url(redis_url)
+            self.store = RedisChangeStore(server, os.getenv("CHANGE_STORE_KEY", f"{spider.name}:itemstate"))
+        stream = os.getenv("CHANGE_STREAM", "off").lower()
+        if stream == "redis":
+            self.stream = RedisChangeStream(
+                server or redis.from_url(redis_url), os.getenv("CHANGE_STREAM_KEY", f"{spider.name}:changes"),
+                maxlen=int(os.getenv("CHANGE_STREAM_MAXLEN", "1000000")),
+            )
+        elif stream == "jsonl":
+            self.stream = JSONLChangeStream(os.getenv("CHANGE_STREAM_PATH", "data/changes.jsonl"))
+
+    def close_spider(self, spider):
+        if self.store and self.acks:
+            # Sinks are flushing in their own close_spider; their outcomes still count
+            self.closing = Deferred()
+            self.closing.addCallback(lambda _: self._close())
+            return self.closing
+        self._close()
+        return None
+
+    def _close(self):
+        if self.store:
+            self.store.close()
+        if self.stream:
+            self.stream.close()
+
+    @timed
+    def process_item(self, item, spider):
+        if not self.store:
+            return item
+        site, key = item.get('site') or "", item_key(item)
+        digest = item_digest(item)
+        fields = tracked(item, self.tracked_fields)
+        previous = self.store.get(site, key)
+        if previous and previous[0] == digest:
+            CHANGE_OUTCOMES.labels(site, "unchanged").inc()
+            if self.mode == "drop":
+                raise DropItem(f"Unchanged since last crawl: {item.get('source_url')}", log_level="DEBUG")
+            item.pop('_raw_html_bytes', None)
+            item['_touch'] = True
+            return item
+        CHANGE_OUTCOMES.labels(site, "changed" if previous else "new").inc()
+        event = None
+        if self.stream:
+            diff = field_diff(previous[1], fields) if previous else None
+            if previous is None or diff:
+                event = {
+                    "kind": "changed" if previous else "new", "site": site, "item_key": key,
+                    "source_url": item.get('source_url'), "crawled_at": item.get('crawled_at'),
+                    "changes": diff or {f: [None, v] for f, v in fields.items() if v is not None},
+                }
+        ack = SinkAck()
+        ack.callback = functools.partial(self._written, ack, site, key, digest, fields, event)
+        self.acks.add(ack)
+        item['_sink_ack'] = ack
+        return item
+
+    def item_scraped(self, item, response, spider):
+        ack = item.get('_sink_ack')
+        if ack is not None:
+            ack.finish()
+
+    def item_failed(self, item, response, spider, **kwargs):
+        ack = item.get('_sink_ack')
+        if ack is not None:
+            ack.finish(ok=False)
+
+    def _written(self, ack, site, key, digest, fields, event, ok):
+        self.acks.discard(ack)
+        if ok:
+            self.store.put(site, key, digest, fields)
+            if event:
+                self.stream.emit(event)
+                for field in event["changes"] if event["kind"] == "changed" else ():
+                    CHANGE_EVENTS.labels(site, field).inc()
+        else:
+            CHANGE_UNRECORDED.labels(site).inc()
+        if self.closing is not None and not self.acks:
+            closing, self.closing = self.closing, None
+            closing.callback(None)
+
+
+class _Touch(tuple):
+    # (crawled_at, site, item_key) of an unchanged item: only its last-seen time is written
+    __slots__ = ()
 
-from .utils.storage import get_firestore, upload_s3, upload_gcs, ensure_dir
 
 class SQLitePipeline:
-    # WARNING: SQLite has limited concurrent write support. For production concurrent crawls,
-    # consider setting CONCURRENT_ITEMS = 1 in settings.py when using SQLite, or use PostgreSQL/MySQL instead.
+    # Items are queued to a dedicated writer thread that upserts them with executemany
+    # in transactions bounded by SQLITE_BATCH_SIZE rows and SQLITE_FLUSH_INTERVAL seconds.
+    # The database runs in WAL mode so readers never block the crawler. Touches from
+    # ChangeDetectionPipeline only update crawled_at. Each item's SinkAck is held until
+    # the batch holding its row has committed. Transient errors (locked, busy, I/O) are
+    # retried with backoff; a batch the database rejects is written row by row so only
+    # the offending rows fail, and those are reported through their SinkAck.
+    _STOP = object()
 
     def open_spider(self, spider):
+        self.conn = None
         if os.getenv("ENABLE_SQLITE", "true").lower() != "true":
-            self.conn = None
-            self.lock = None
             return
-        path = os.getenv("SQLITE_PATH", "data/weedeater.sqlite")
-        Path(path).parent.mkdir(parents=True, exist_ok=True)
-        # Allow connection to be used across threads with check_same_thread=False
-        # Use threading.Lock() to serialize writes
-        self.conn = sqlite3.connect(path, check_same_thread=False)
-        self.lock = threading.Lock()
-        self.conn.execute(
+        self.path = os.getenv("SQLITE_PATH", "data/weedeater.sqlite")
+        self.batch_size = int(os.getenv("SQLITE_BATCH_SIZE", "200"))
+        self.flush_interval = float(os.getenv("SQLITE_FLUSH_INTERVAL", "2.0"))
+        self.max_retries = int(os.getenv("SQLITE_MAX_RETRIES", "3"))
+        self.retry_backoff = float(os.getenv("SQLITE_RETRY_BACKOFF", "0.5"))
+        self.queue = queue.Queue(maxsize=int(os.getenv("SQLITE_QUEUE_SIZE", "5000")))
+        self.logger = spider.logger
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        # The connection is created here to surface schema errors on startup and is
+        # only used by the writer thread afterwards.
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self._ensure_schema(self.conn)
+        self.writer = threading.Thread(target=self._writer_loop, name="sqlite-writer", daemon=True)
+        self.writer.start()
+
+    @staticmethod
+    def _ensure_schema(conn):
+        conn.execute(
             """
             CREATE TABLE IF NOT EXISTS products (
                 id INTEGER PRIMARY KEY,
@@ -42,71 +295,598 @@ class SQLitePipeline:
                 specs TEXT,
                 images TEXT,
                 breadcrumbs TEXT,
-                raw_html_path TEXT
+                raw_html_path TEXT,
+                item_key TEXT
             )
             """
         )
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(products)")}
+        if "item_key" not in columns:
+            # Databases created before upserts: backfill the key and keep only the
+            # newest row per key so the unique index can be built.
+            with conn:
+                conn.execute("ALTER TABLE products ADD COLUMN item_key TEXT")
+                conn.execute("UPDATE products SET item_key = COALESCE(sku, source_url)")
+                conn.execute(
+                    "DELETE FROM products WHERE id NOT IN "
+                    "(SELECT MAX(id) FROM products GROUP BY site, item_key)"
+                )
+        conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS products_site_key ON products (site, item_key)")
+        conn.commit()
 
     def close_spider(self, spider):
-        if self.conn:
-            self.conn.commit()
-            self.conn.close()
+        if not self.conn:
+            return
+        # A writer that died with the queue full would never take the stop marker
+        while self.writer.is_alive():
+            try:
+                self.queue.put(self._STOP, timeout=1.0)
+                break
+            except queue.Full:
+                pass
+        self.writer.join()
+        lost = 0
+        while True:
+            try:
+                _, ack = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            lost += 1
+            if ack is not None:
+                ack.release(ok=False)
+        if lost:
+            SQLITE_FAILED_ROWS.inc(lost)
+            self.logger.error(f"SQLite writer thread stopped early, {lost} queued rows were not written")
+        self.conn.close()
 
+    @timed
     def process_item(self, item, spider):
         if not self.conn:
             return item
-        # Use lock to ensure thread-safe writes
-        with self.lock:
-            self.conn.execute(
-                """
-                INSERT INTO products (
-                    source_url, crawled_at, site, brand, product_name, sku, upc, category,
-                    price, currency, availability, description, specs, images, breadcrumbs, raw_html_path
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                """,
-                (
-                    item.get('source_url'), item.get('crawled_at'), item.get('site'), item.get('brand'),
-                    item.get('product_name'), item.get('sku'), item.get('upc'), item.get('category'),
-                    item.get('price'), item.get('currency'), item.get('availability'), item.get('description'),
-                    json.dumps(item.get('specs') or {}), json.dumps(item.get('images') or []),
-                    json.dumps(item.get('breadcrumbs') or []), item.get('raw_html_path')
-                )
-            )
+        row = _Touch((item.get('crawled_at'), item.get('site'), item_key(item))) if item.get('_touch') \
+            else self._row(item)
+        ack = item.get('_sink_ack')
+        if ack is not None:
+            ack.hold()
+        try:
+            self.queue.put_nowait((row, ack))
+        except queue.Full:
+            # Writer is behind: wait for room off the reactor thread
+            SQLITE_BACKPRESSURE.inc()
+            d = deferToThread(self._put, (row, ack))
+            if ack is not None:
+                d.addErrback(self._put_failed, ack)
+            return d.addCallback(lambda _: item)
+        finally:
+            SQLITE_QUEUE_DEPTH.set(self.queue.qsize())
         return item
 
+    def _put(self, entry):
+        while True:
+            try:
+                self.queue.put(entry, timeout=1.0)
+                return
+            except queue.Full:
+                if not self.writer.is_alive():
+                    raise RuntimeError("SQLite writer thread is not running")
+
+    @staticmethod
+    def _put_failed(failure, ack):
+        ack.release(ok=False)
+        return failure
+
+    @staticmethod
+    def _row(item):
+        return (
+            item.get('source_url'), item.get('crawled_at'), item.get('site'), item.get('brand'),
+            item.get('product_name'), item.get('sku'), item.get('upc'), item.get('category'),
+            item.get('price'), item.get('currency'), item.get('availability'), item.get('description'),
+            json.dumps(item.get('specs') or {}), json.dumps(item.get('images') or []),
+            json.dumps(item.get('breadcrumbs') or []), item.get('raw_html_path'), item_key(item),
+        )
+
+    def _writer_loop(self):
+        sql = (
+            f"INSERT INTO products ({', '.join(SQLITE_COLUMNS)}) "
+            f"VALUES ({', '.join('?' for _ in SQLITE_COLUMNS)}) "
+            "ON CONFLICT(site, item_key) DO UPDATE SET "
+            + ", ".join(f"{c} = excluded.{c}" for c in SQLITE_COLUMNS if c not in ("site", "item_key"))
+        )
+        batch = []
+        deadline = None
+        stopping = False
+        while not stopping:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                entry = self.queue.get(timeout=timeout)
+                if entry is self._STOP:
+                    stopping = True
+                else:
+                    batch.append(entry)
+                    if deadline is None:
+                        deadline = time.monotonic() + self.flush_interval
+            except queue.Empty:
+                pass
+            if batch and (stopping or len(batch) >= self.batch_size or time.monotonic() >= deadline):
+                self._flush(sql, batch)
+                batch = []
+                deadline = None
+            SQLITE_QUEUE_DEPTH.set(self.queue.qsize())
+
+    def _flush(self, sql, entries):
+        started = time.monotonic()
+        error = self._write(sql, entries)
+        if error is None:
+            SQLITE_FLUSH_SECONDS.observe(time.monotonic() - started)
+            SQLITE_FLUSH_ROWS.observe(len(entries))
+        elif len(entries) > 1 and not isinstance(error, sqlite3.OperationalError):
+            # A row the database rejects (constraint, unsupported value) shouldn't cost
+            # the rest of the batch
+            self.logger.warning(f"SQLite batch of {len(entries)} rows failed ({error}), writing them one by one")
+            for entry in entries:
+                self._flush(sql, [entry])
+            return
+        else:
+            SQLITE_FAILED_ROWS.inc(len(entries))
+            keys = ", ".join(str(row[-1]) for row, _ in entries[:5])
+            self.logger.error(f"SQLite write failed for {len(entries)} row(s) "
+                              f"({keys}{', ...' if len(entries) > 5 else ''}): {error}")
+        for _, ack in entries:
+            if ack is not None:
+                reactor.callFromThread(ack.release, error is None)
+
+    def _write(self, sql, entries):
+        """Write entries in one transaction, retrying transient errors; returns the error it gave up on."""
+        rows = [row for row, _ in entries if not isinstance(row, _Touch)]
+        touches = [row for row, _ in entries if isinstance(row, _Touch)]
+        delay = self.retry_backoff
+        for attempt in range(1, self.max_retries + 2):
+            try:
+                with self.conn:
+                    if rows:
+                        self.conn.executemany(sql, rows)
+                    if touches:
+                        self.conn.executemany(
+                            "UPDATE products SET crawled_at = ? WHERE site IS ? AND item_key = ?", touches,
+                        )
+                return None
+            except sqlite3.OperationalError as e:
+                # Locked, busy, disk I/O: worth another try
+                if attempt > self.max_retries:
+                    return e
+                self.logger.warning(f"SQLite batch of {len(entries)} rows failed ({e}), retry {attempt} in {delay:.1f}s")
+                time.sleep(delay)
+                delay = min(delay * 2, 30.0)
+            except Exception as e:
+                return e
+
 class FirestorePipeline:
+    # Touches (unchanged items, see ChangeDetectionPipeline) cost a billed write each,
+    # so they are skipped unless FIRESTORE_WRITE_TOUCHES=true, which merges crawled_at.
     def open_spider(self, spider):
         self.client = get_firestore()
         self.collection = os.getenv("FIRESTORE_COLLECTION", "weedeater_products")
+        self.write_touches = os.getenv("FIRESTORE_WRITE_TOUCHES", "false").lower() == "true"
 
+    def _document(self, item):
+        """(data, merge) to write for an item, or None for a skipped touch."""
+        if item.get('_touch'):
+            return ({'crawled_at': item.get('crawled_at')}, True) if self.write_touches else None
+        return {k: v for k, v in item.items() if not k.startswith('_')}, False
+
+    @staticmethod
+    def _doc_id(item) -> str:
+        # Use SHA256 to generate deterministic, valid Firestore document IDs
+        # (hash() is not deterministic across Python sessions and can return negative values)
+        return hashlib.sha256(item_key(item).encode('utf-8')).hexdigest()
+
+    @timed
     def process_item(self, item, spider):
         if not self.client:
             return item
-        key = item.get('sku') or item.get('source_url')
-        # Use SHA256 to generate deterministic, valid Firestore document IDs
-        # (hash() is not deterministic across Python sessions and can return negative values)
-        doc_id = hashlib.sha256(str(key).encode('utf-8')).hexdigest()
-        self.client.collection(self.collection).document(doc_id).set(dict(item))
+        document = self._document(item)
+        if document:
+            data, merge = document
+            self.client.collection(self.collection).document(self._doc_id(item)).set(data, merge=merge)
         return item
 
-class CloudStorageRawHTMLPipeline:
-    # Optional: store raw HTML snapshots to S3 or GCS for auditability
+
+FIRESTORE_COMMITS = Counter('firestore_batch_commits', 'Firestore batch commits', ['outcome'])
+FIRESTORE_COALESCED = Counter('firestore_coalesced_writes', 'Firestore writes superseded before commit')
+FIRESTORE_IN_FLIGHT = Gauge('firestore_commits_in_flight', 'Firestore batch commits in flight',
+                            multiprocess_mode='livesum')
+FIRESTORE_COMMIT_SECONDS = Histogram('firestore_commit_seconds', 'Firestore batch commit latency incl. retries')
+
+# Transient Firestore errors worth retrying; anything else fails the batch immediately
+_FIRESTORE_RETRYABLE = (
+    gexc.Aborted, gexc.DeadlineExceeded, gexc.InternalServerError,
+    gexc.ResourceExhausted, gexc.ServiceUnavailable,
+)
+
+
+class BatchedFirestorePipeline(FirestorePipeline):
+    # Buffers writes and commits them as Firestore batches off the reactor thread.
+    # Only the last write per doc_id inside a flush window is kept, at most
+    # FIRESTORE_MAX_IN_FLIGHT commits run at once, and transient errors are retried
+    # with exponential backoff. Items' SinkAcks are held until their batch committed
+    # (or was dropped). Pass `client` to run against a fake or emulator client.
+    MAX_BATCH_WRITES = 500  # Firestore hard limit per batch
+    MAX_BATCH_BYTES = 9 * 1024 * 1024  # stay under the 10 MiB request limit
+
+    def __init__(self, client=None):
+        self._client_override = client
+
+    def open_spider(self, spider):
+        super().open_spider(spider)
+        if self._client_override is not None:
+            self.client = self._client_override
+        self.logger = spider.logger
+        self.batch_size = min(int(os.getenv("FIRESTORE_BATCH_SIZE", "500")), self.MAX_BATCH_WRITES)
+        self.max_retries = int(os.getenv("FIRESTORE_MAX_RETRIES", "5"))
+        self.retry_backoff = float(os.getenv("FIRESTORE_RETRY_BACKOFF", "0.5"))
+        self.semaphore = DeferredSemaphore(int(os.getenv("FIRESTORE_MAX_IN_FLIGHT", "4")))
+        self.pending = {}
+        self.pending_acks = {}  # doc_id -> SinkAcks of the writes coalesced into its pending write
+        self.in_flight = set()
+        self.flusher = LoopingCall(self._flush)
+        if self.client:
+            self.flusher.start(float(os.getenv("FIRESTORE_FLUSH_INTERVAL", "1.0")), now=False)
+
+    def close_spider(self, spider):
+        if not self.client:
+            return None
+        if self.flusher.running:
+            self.flusher.stop()
+        self._flush()
+        return DeferredList(list(self.in_flight))
+
+    @timed
+    def process_item(self, item, spider):
+        if not self.client:
+            return item
+        document = self._document(item)
+        if document is None:
+            return item
+        doc_id = self._doc_id(item)
+        previous = self.pending.get(doc_id)
+        if previous:
+            FIRESTORE_COALESCED.inc()
+            if document[1] and not previous[1]:
+                # A touch after a pending full write: fold it into that write
+                previous[0]['crawled_at'] = document[0]['crawled_at']
+                document = previous
+        self.pending[doc_id] = document
+        ack = item.get('_sink_ack')
+        if ack is not None:
+            ack.hold()
+            self.pending_acks.setdefault(doc_id, []).append(ack)
+        if len(self.pending) >= self.batch_size:
+            self._flush()
+        return item
+
+    def _flush(self):
+        if not self.pending:
+            return
+        pending, self.pending = self.pending, {}
+        acks, self.pending_acks = self.pending_acks, {}
+        for chunk in self._chunks(pending):
+            d = self.semaphore.run(deferToThread, self._commit, chunk)
+            self.in_flight.add(d)
+            chunk_acks = [ack for doc_id, _, _ in chunk for ack in acks.get(doc_id, ())]
+            d.addBoth(self._commit_done, d, len(chunk), chunk_acks)
+        FIRESTORE_IN_FLIGHT.set(len(self.in_flight))
+
+    def _chunks(self, pending):
+        chunk, size = [], 0
+        for doc_id, (data, merge) in pending.items():
+            doc_size = len(json.dumps(data, default=str))
+            if chunk and (len(chunk) >= self.batch_size or size + doc_size > self.MAX_BATCH_BYTES):
+                yield chunk
+                chunk, size = [], 0
+            chunk.append((doc_id, data, merge))
+            size += doc_size
+        if chunk:
+            yield chunk
+
+    def _commit(self, chunk):
+        # Runs in a reactor thread pool worker
+        collection = self.client.collection(self.collection)
+        started = time.monotonic()
+        delay = self.retry_backoff
+        for attempt in range(1, self.max_retries + 1):
+            batch = self.client.batch()
+            for doc_id, data, merge in chunk:
+                batch.set(collection.document(doc_id), data, merge=merge)
+            try:
+                batch.commit()
+                break
+            except _FIRESTORE_RETRYABLE as e:
+                if attempt == self.max_retries:
+                    raise
+                self.logger.warning(f"Firestore commit of {len(chunk)} docs failed ({e}), retry {attempt} in {delay:.1f}s")
+                time.sleep(delay + random.uniform(0, delay))
+                delay = min(delay * 2, 30.0)
+        FIRESTORE_COMMIT_SECONDS.observe(time.monotonic() - started)
+
+    def _commit_done(self, result, d, size, acks):
+        self.in_flight.discard(d)
+        FIRESTORE_IN_FLIGHT.set(len(self.in_flight))
+        failed = isinstance(result, Failure)
+        if failed:
+            FIRESTORE_COMMITS.labels(outcome="failed").inc()
+            self.logger.error(f"Firestore batch of {size} docs dropped: {result.getErrorMessage()}")
+        else:
+            FIRESTORE_COMMITS.labels(outcome="ok").inc()
+        for ack in acks:
+            ack.release(ok=not failed)
+
+PARQUET_ROWS = Counter('parquet_export_rows', 'Rows exported to Parquet', ['site'])
+PARQUET_ROW_GROUPS = Counter('parquet_export_row_groups', 'Row groups written to Parquet', ['outcome'])
+PARQUET_BUFFERED = Gauge('parquet_export_buffered_rows', 'Rows buffered for the next Parquet row groups',
+                         multiprocess_mode='livesum')
+
+
+class ParquetExportPipeline:
+    # Exports items to Parquet under PARQUET_DIR/site=<site>/crawl_date=<date>/ for
+    # analytics that must not touch the crawler's SQLite file. Rows are buffered per
+    # partition and every PARQUET_ROW_GROUP_SIZE rows are handed to a single writer
+    # thread as one row group (see utils/parquet.py); past PARQUET_MAX_BUFFERED_ROWS
+    # in total the largest buffer goes early. Touches (unchanged items) are
+    # skipped: the last exported row already holds their content, so the files form a
+    # change history. `scrapy compact_parquet` merges the small files.
+    def open_spider(self, spider):
+        self.writer = None
+        if os.getenv('ENABLE_PARQUET', 'false').lower() != 'true':
+            return
+        self.logger = spider.logger
+        self.row_group_size = int(os.getenv('PARQUET_ROW_GROUP_SIZE', '10000'))
+        self.max_buffered = int(os.getenv('PARQUET_MAX_BUFFERED_ROWS', '50000'))
+        self.writer = PartitionedParquetWriter(
+            os.getenv('PARQUET_DIR', 'data/parquet'), prefix=spider.name,
+            row_group_size=self.row_group_size,
+            max_file_rows=int(os.getenv('PARQUET_FILE_ROWS', '1000000')),
+            max_open=int(os.getenv('PARQUET_MAX_OPEN_FILES', '32')),
+            compression=os.getenv('PARQUET_COMPRESSION', 'zstd'),
+        )
+        self.buffers = {}
+        self.buffered = 0
+        self.writes = set()
+        # One thread: the writer and its open files are not thread-safe
+        self.pool = ThreadPool(minthreads=1, maxthreads=1, name="parquet-writer")
+        self.pool.start()
+
+    def close_spider(self, spider):
+        if not self.writer:
+            return None
+        for partition in list(self.buffers):
+            self._write(partition)
+        d = DeferredList(list(self.writes))
+        d.addCallback(lambda _: deferToThreadPool(reactor, self.pool, self.writer.close))
+        d.addErrback(lambda f: self.logger.error(f"Closing Parquet files failed: {f.getErrorMessage()}"))
+        d.addBoth(lambda _: self.pool.stop())
+        return d
+
+    @timed
+    def process_item(self, item, spider):
+        if not self.writer or item.get('_touch'):
+            return item
+        partition, row = to_row(item, item_key(item))
+        rows = self.buffers.setdefault(partition, [])
+        rows.append(row)
+        self.buffered += 1
+        if len(rows) >= self.row_group_size:
+            self._write(partition)
+        elif self.buffered >= self.max_buffered:
+            # Many small partitions: write the largest buffer early to bound memory
+            self._write(max(self.buffers, key=lambda p: len(self.buffers[p])))
+        PARQUET_BUFFERED.set(self.buffered)
+        return item
+
+    def _write(self, partition):
+        rows = self.buffers.pop(partition)
+        self.buffered -= len(rows)
+        d = deferToThreadPool(reactor, self.pool, self.writer.write, partition, rows)
+        self.writes.add(d)
+        d.addBoth(self._written, d, partition, len(rows))
+
+    def _written(self, result, d, partition, count):
+        self.writes.discard(d)
+        if isinstance(result, Failure):
+            PARQUET_ROW_GROUPS.labels(outcome="failed").inc()
+            self.logger.error(f"Parquet write of {count} rows for {partition[0]}/{partition[1]} failed: "
+                              f"{result.getErrorMessage()}")
+        else:
+            PARQUET_ROW_GROUPS.labels(outcome="ok").inc()
+            PARQUET_ROWS.labels(partition[0]).inc(count)
+
+
+ARCHIVE_RECORDS = Counter('raw_archive_records', 'Responses appended to the local raw HTML archive')
+ARCHIVE_BYTES = Counter('raw_archive_bytes', 'Uncompressed bytes appended to the local raw HTML archive')
+ARCHIVE_FAILED = Counter('raw_archive_failed_records', 'Responses that could not be written to the local raw HTML archive')
+ARCHIVE_SEGMENTS_SHIPPED = Counter('raw_archive_segments_shipped', 'Archive segments uploaded to S3/GCS', ['outcome'])
+
+
+class RawHTMLArchivePipeline:
+    # Appends the raw response body to rolling zstd segment files under RAW_ARCHIVE_DIR
+    # and replaces the in-item bytes with an 'archive://segment:offset' raw_html_path.
+    # Compression and the segment/index writes run on a single writer thread, and the
+    # segment is flushed before the item gets its reference, so the sinks never store
+    # a reference a reader can't resolve yet. Closed segments (plus their .idx) ship
+    # to S3/GCS in bulk instead of per page.
+    def open_spider(self, spider):
+        self.writer = None
+        if os.getenv('ENABLE_RAW_ARCHIVE', 'false').lower() != 'true':
+            return
+        self.logger = spider.logger
+        self.delete_shipped = os.getenv('RAW_ARCHIVE_DELETE_SHIPPED', 'false').lower() == 'true'
+        self.shipping = set()
+        # Launcher workers share RAW_ARCHIVE_DIR; each appends to segments of its own
+        worker = os.getenv('WEEDEATER_WORKER')
+        self.writer = SegmentArchiveWriter(
+            os.getenv('RAW_ARCHIVE_DIR', 'data/archive'),
+            prefix=f"{spider.name}-w{worker}" if worker else spider.name,
+            max_segment_bytes=int(os.getenv('RAW_ARCHIVE_SEGMENT_MB', '256')) * 1024 * 1024,
+            level=int(os.getenv('RAW_ARCHIVE_ZSTD_LEVEL', '3')),
+            # Called on the writer thread; shipping is started from the reactor
+            on_segment_closed=lambda *paths: reactor.callFromThread(self._ship_segment, *paths),
+        )
+        # One thread: the writer and its open files are not thread-safe
+        self.pool = ThreadPool(minthreads=1, maxthreads=1, name="raw-archive-writer")
+        self.pool.start()
+
+    def close_spider(self, spider):
+        if not self.writer:
+            return None
+        d = deferToThreadPool(reactor, self.pool, self.writer.close)
+        d.addErrback(lambda f: self.logger.error(f"Closing the raw HTML archive failed: {f.getErrorMessage()}"))
+        # The segment closed last queued its shipping ahead of this callback
+        d.addCallback(lambda _: DeferredList(list(self.shipping)))
+        d.addBoth(lambda _: self.pool.stop())
+        return d
+
+    @timed
     def process_item(self, item, spider):
-        html_bytes = item.get('_raw_html_bytes')
-        if not html_bytes:
+        if not self.writer:
+            return item
+        body = item.pop('_raw_html_bytes', None)
+        if not body:
             return item
-        prefix = os.getenv('S3_PREFIX', 'weedeater/')
-        gprefix = os.getenv('GCS_PREFIX', 'weedeater/')
-        # Use SHA256 for deterministic hashing and datetime.now(timezone.utc) instead of deprecated utcnow()
-        url_hash = hashlib.sha256(str(item.get('source_url')).encode('utf-8')).hexdigest()[:16]
-        timestamp = int(datetime.now(timezone.utc).timestamp())
+        d = deferToThreadPool(reactor, self.pool, self._append, item.get('source_url'), body)
+        d.addCallbacks(self._archived, self._append_failed, callbackArgs=(item, len(body)), errbackArgs=(item,))
+        return d
+
+    def _append(self, url, body):
+        # Runs on the writer thread
+        ref = self.writer.append(url, body)
+        self.writer.flush()
+        return ref
+
+    @staticmethod
+    def _archived(ref, item, size):
+        item['raw_html_path'] = ref
+        ARCHIVE_RECORDS.inc()
+        ARCHIVE_BYTES.inc(size)
+        return item
+
+    def _append_failed(self, failure, item):
+        # The archive is an optional copy; the item still goes to the sinks, without a raw_html_path
+        ARCHIVE_FAILED.inc()
+        self.logger.error(f"Raw archive write failed for {item.get('source_url')}: {failure.getErrorMessage()}")
+        return item
+
+    def _ship_segment(self, segment_path, index_path):
+        targets = []
+        if os.getenv('ENABLE_S3', 'false').lower() == 'true':
+            targets.append(("s3", os.getenv('AWS_S3_BUCKET'), os.getenv('S3_PREFIX', 'weedeater/'), upload_file_s3))
+        if os.getenv('ENABLE_GCS', 'false').lower() == 'true':
+            targets.append(("gs", os.getenv('GCS_BUCKET'), os.getenv('GCS_PREFIX', 'weedeater/'), upload_file_gcs))
+        if not targets:
+            return
+        d = deferToThread(self._upload_segment, targets, segment_path, index_path)
+        self.shipping.add(d)
+        d.addBoth(self._shipped, d, segment_path)
+
+    def _upload_segment(self, targets, segment_path, index_path):
+        for scheme, bucket, prefix, upload in targets:
+            for path in (segment_path, index_path):
+                upload(bucket, f"{prefix}archive/{path.name}", path)
+        if self.delete_shipped:
+            segment_path.unlink(missing_ok=True)
+            index_path.unlink(missing_ok=True)
+
+    def _shipped(self, result, d, segment_path):
+        self.shipping.discard(d)
+        if isinstance(result, Failure):
+            ARCHIVE_SEGMENTS_SHIPPED.labels(outcome="failed").inc()
+            self.logger.error(f"Shipping archive segment {segment_path.name} failed: {result.getErrorMessage()}")
+        else:
+            ARCHIVE_SEGMENTS_SHIPPED.labels(outcome="ok").inc()
+
+
+RAW_HTML_UPLOADS = Counter('raw_html_uploads', 'Raw HTML snapshot uploads', ['backend', 'outcome'])
+RAW_HTML_UPLOAD_BYTES = Counter('raw_html_upload_bytes', 'Bytes uploaded for raw HTML snapshots', ['backend'])
+RAW_HTML_UPLOAD_SECONDS = Histogram('raw_html_upload_seconds', 'Raw HTML upload latency', ['backend'])
+
+
+class CloudStorageRawHTMLPipeline:
+    # Optional: store raw HTML snapshots to S3 or GCS for auditability.
+    # Uploads run on a bounded thread pool and the item waits on a Deferred for its
+    # raw_html_path. Keys are content-addressed (sha256 of the HTML) so identical
+    # pages are stored once; bodies are optionally gzip/zstd compressed.
+    _RECENT_KEYS = 100_000
+
+    def open_spider(self, spider):
+        self.logger = spider.logger
+        self.targets = []
         if os.getenv('ENABLE_S3', 'false').lower() == 'true':
-            key = f"{prefix}{timestamp}_{url_hash}.html"
-            upload_s3(os.getenv('AWS_S3_BUCKET'), key, html_bytes)
-            item['raw_html_path'] = f"s3://{os.getenv('AWS_S3_BUCKET')}/{key}"
+            self.targets.append(("s3", os.getenv('AWS_S3_BUCKET'), os.getenv('S3_PREFIX', 'weedeater/'),
+                                 upload_s3, s3_object_exists))
         if os.getenv('ENABLE_GCS', 'false').lower() == 'true':
-            key = f"{gprefix}{timestamp}_{url_hash}.html"
-            upload_gcs(os.getenv('GCS_BUCKET'), key, html_bytes)
-            item['raw_html_path'] = f"gs://{os.getenv('GCS_BUCKET')}/{key}"
-        item.pop('_raw_html_bytes', None)
+            self.targets.append(("gs", os.getenv('GCS_BUCKET'), os.getenv('GCS_PREFIX', 'weedeater/'),
+                                 upload_gcs, gcs_object_exists))
+        encoding = os.getenv('RAW_HTML_COMPRESSION', 'gzip').lower()
+        self.encoding = encoding if encoding in CONTENT_ENCODING_SUFFIXES else None
+        self.check_existing = os.getenv('RAW_HTML_SKIP_EXISTING', 'true').lower() == 'true'
+        self.recent = OrderedDict()
+        self.recent_lock = threading.Lock()
+        self.pool = None
+        if self.targets:
+            self.pool = ThreadPool(minthreads=1, maxthreads=int(os.getenv('RAW_HTML_UPLOAD_WORKERS', '8')),
+                                   name="raw-html-upload")
+            self.pool.start()
+
+    def close_spider(self, spider):
+        if self.pool:
+            self.pool.stop()
+
+    @timed
+    def process_item(self, item, spider):
+        html_bytes = item.pop('_raw_html_bytes', None)
+        if not html_bytes or not self.pool:
+            return item
+        d = deferToThreadPool(reactor, self.pool, self._upload, html_bytes)
+        d.addCallbacks(self._set_path, self._upload_failed, callbackArgs=(item,), errbackArgs=(item,))
+        return d
+
+    def _upload(self, html_bytes):
+        # Runs on the upload pool; returns the path of the last configured backend
+        digest = hashlib.sha256(html_bytes).hexdigest()
+        suffix = CONTENT_ENCODING_SUFFIXES.get(self.encoding, "")
+        body = None
+        path = None
+        for scheme, bucket, prefix, upload, exists in self.targets:
+            key = f"{prefix}sha256/{digest[:2]}/{digest}.html{suffix}"
+            path = f"{scheme}://{bucket}/{key}"
+            if self._seen(path) or (self.check_existing and exists(bucket, key)):
+                RAW_HTML_UPLOADS.labels(backend=scheme, outcome="deduplicated").inc()
+                self._remember(path)
+                continue
+            if body is None:
+                body = compress(html_bytes, self.encoding)
+            started = time.monotonic()
+            upload(bucket, key, body, content_encoding=self.encoding)
+            RAW_HTML_UPLOAD_SECONDS.labels(backend=scheme).observe(time.monotonic() - started)
+            RAW_HTML_UPLOAD_BYTES.labels(backend=scheme).inc(len(body))
+            RAW_HTML_UPLOADS.labels(backend=scheme, outcome="uploaded").inc()
+            self._remember(path)
+        return path
+
+    def _seen(self, path):
+        with self.recent_lock:
+            return path in self.recent
+
+    def _remember(self, path):
+        with self.recent_lock:
+            self.recent[path] = True
+            if len(self.recent) > self._RECENT_KEYS:
+                self.recent.popitem(last=False)
+
+    @staticmethod
+    def _set_path(path, item):
+        item['raw_html_path'] = path
+        return item
+
+    def _upload_failed(self, failure, item):
+        # A missing audit snapshot should not cost us the product row
+        self.logger.error(f"Raw HTML upload failed for {item.get('source_url')}: {failure.getErrorMessage()}")
         return item
@@ -3,6 +3,7 @@ import os
 BOT_NAME = "weedeater-crawler"
 SPIDER_MODULES = ["weedeater_crawler.spiders"]
 NEWSPIDER_MODULE = "weedeater_crawler.spiders"
+COMMANDS_MODULE = "weedeater_crawler.commands"
 
 ROBOTSTXT_OBEY = False  # Set True if you choose to obey
 
@@ -10,8 +11,12 @@ ROBOTSTXT_OBEY = False  # Set True if you choose to obey
 CONCURRENT_REQUESTS = int(os.getenv("CONCURRENT_REQUESTS", "8"))
 CONCURRENT_REQUESTS_PER_DOMAIN = int(os.getenv("CONCURRENT_REQUESTS_PER_DOMAIN", "4"))
 DOWNLOAD_DELAY = float(os.getenv("DOWNLOAD_DELAY", "0.5"))
+# Items processed in parallel per response; the SQLite writer thread absorbs the writes
+CONCURRENT_ITEMS = int(os.getenv("CONCURRENT_ITEMS", "100"))
 
-AUTOTHROTTLE_ENABLED = os.getenv("AUTOTHROTTLE_ENABLED", "true").lower() == "true"
+# RateLimitRetryMiddleware runs a per-domain AIMD controller (RATE_CONTROL_ENABLED)
+# that sets slot delay/concurrency itself; AutoThrottle would fight it, so it is off by default.
+AUTOTHROTTLE_ENABLED = os.getenv("AUTOTHROTTLE_ENABLED", "false").lower() == "true"
 AUTOTHROTTLE_START_DELAY = float(os.getenv("AUTOTHROTTLE_START_DELAY", "0.5"))
 AUTOTHROTTLE_MAX_DELAY = float(os.getenv("AUTOTHROTTLE_MAX_DELAY", "10.0"))
 AUTOTHROTTLE_TARGET_CONCURRENCY = float(os.getenv("AUTOTHROTTLE_TARGET_CONCURRENCY", "2.0"))
@@ -20,12 +25,17 @@ AUTOTHROTTLE_TARGET_CONCURRENCY = float(os.getenv("AUTOTHROTTLE_TARGET_CONCURREN
 MEMUSAGE_LIMIT_MB = int(os.getenv("MEMUSAGE_LIMIT_MB", "2048"))
 
 # Downloader Middlewares
+SPIDER_MIDDLEWARES = {
+    "weedeater_crawler.middlewares.CallbackTimingMiddleware": 990,
+}
+
 DOWNLOADER_MIDDLEWARES = {
     "weedeater_crawler.middlewares.UserAgentRotationMiddleware": 400,
-    "weedeater_crawler.middlewares.ProxyRotationMiddleware": 410,
     "scrapy.downloadermiddlewares.retry.RetryMiddleware": None,
     "weedeater_crawler.middlewares.RateLimitRetryMiddleware": 550,
-    "scrapy_playwright.middleware.ScrapyPlaywrightDownloadHandler": 800,
+    "weedeater_crawler.middlewares.IncrementalRecrawlMiddleware": 580,
+    # Above the retry/recrawl middlewares so it records every outcome, see the class
+    "weedeater_crawler.middlewares.ProxyRotationMiddleware": 585,
 }
 
 # Retry
@@ -34,10 +44,13 @@ RETRY_HTTP_CODES = [429, 500, 502, 503, 504, 522, 524]
 RETRY_TIMES = 5
 
 # Playwright
+# Hybrid handler: plain HTTP first, escalates to Playwright only when the spider
+# can't find its data in the server HTML (see handlers.py).
 DOWNLOAD_HANDLERS = {
-    "http": "scrapy_playwright.handler.ScrapyPlaywrightDownloadHandler",
-    "https": "scrapy_playwright.handler.ScrapyPlaywrightDownloadHandler",
+    "http": "weedeater_crawler.handlers.HybridDownloadHandler",
+    "https": "weedeater_crawler.handlers.HybridDownloadHandler",
 }
+TWISTED_REACTOR = "twisted.internet.asyncioreactor.AsyncioSelectorReactor"
 PLAYWRIGHT_BROWSER_TYPE = "chromium"
 PLAYWRIGHT_DEFAULT_NAVIGATION_TIMEOUT = 60_000
 PLAYWRIGHT_LAUNCH_OPTIONS = {
@@ -45,6 +58,9 @@ PLAYWRIGHT_LAUNCH_OPTIONS = {
     "args": ["--no-sandbox", "--disable-dev-shm-usage", "--disable-gpu"],
 }
 PLAYWRIGHT_DEFAULT_NAVIGATION_WAIT = "networkidle"
+PLAYWRIGHT_MAX_PAGES_PER_CONTEXT = int(os.getenv("PLAYWRIGHT_MAX_PAGES_PER_CONTEXT", "4"))
+# Templates for the per-site context pool (see utils/browser_pool.py); nothing is
+# launched at startup
 PLAYWRIGHT_CONTEXTS = {
     "default": {
         "user_agent": None,  # set per-request via UA middleware
@@ -55,30 +71,43 @@ PLAYWRIGHT_CONTEXTS = {
 }
 PLAYWRIGHT_PROCESS_REQUEST_HEADERS = None
 
-# Block heavy resources for speed
-PLAYWRIGHT_ABORT_REQUEST = re_compile = __import__('re').compile
-PLAYWRIGHT_ABORT_REQUEST = [
-    re_compile(r"\.(?:png|jpg|jpeg|gif|svg|ico)(\?.*)?$", re.I),
-    re_compile(r"https?://www\.google-analytics\.com/.*", re.I),
-    re_compile(r"https?://connect\.facebook\.net/.*", re.I),
-]
+# Abort images, media, fonts, CSS and third-party analytics/chat/review widgets in
+# the browser; per-seed `block` overrides in weedeater_targets.yaml (utils/blocking.py)
+PLAYWRIGHT_ABORT_REQUEST = (
+    "weedeater_crawler.utils.blocking.should_abort"
+    if os.getenv("RESOURCE_BLOCKING", "true").lower() == "true" else None
+)
 
 # Scrapy-Redis for distributed crawling
 SCHEDULER = "scrapy_redis.scheduler.Scheduler"
 SCHEDULER_PERSIST = True
-DUPEFILTER_CLASS = "scrapy_redis.dupefilter.RFPDupeFilter"
+# WEEDEATER_SHARD=<index>/<count>: this node reads its own seed key and request queue
+# (weedeater:start_urls:<index>, weedeater:requests:<index>); the dupefilter stays shared
+if os.getenv("WEEDEATER_SHARD"):
+    SCHEDULER_QUEUE_KEY = f"%(spider)s:requests:{os.getenv('WEEDEATER_SHARD').partition('/')[0]}"
+# With WEEDEATER_SEED_SOURCE=redis the spider waits for new seeds when idle; close after
+# this many idle seconds (0 = keep waiting)
+MAX_IDLE_TIME_BEFORE_CLOSE = int(os.getenv("MAX_IDLE_TIME_BEFORE_CLOSE", "0"))
+# Scalable Bloom filter over canonical URLs (Redis bitmaps or RedisBloom), plus
+# revisits of due URLs when INCREMENTAL_ENABLED=true. Use
+# weedeater_crawler.dupefilter.IncrementalDupeFilter for an exact Redis set.
+DUPEFILTER_CLASS = "weedeater_crawler.dupefilter.BloomDupeFilter"
 REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379")
 
 # Pipelines
 ITEM_PIPELINES = {
+    "weedeater_crawler.pipelines.ChangeDetectionPipeline": 50,
+    "weedeater_crawler.pipelines.RawHTMLArchivePipeline": 90,
     "weedeater_crawler.pipelines.CloudStorageRawHTMLPipeline": 100,
     "weedeater_crawler.pipelines.SQLitePipeline": 200,
-    "weedeater_crawler.pipelines.FirestorePipeline": 300,
+    "weedeater_crawler.pipelines.ParquetExportPipeline": 250,
+    "weedeater_crawler.pipelines.BatchedFirestorePipeline": 300,
 }
 
 # Extensions
 EXTENSIONS = {
     "weedeater_crawler.extensions.PrometheusExtension": 100,
+    "weedeater_crawler.extensions.CheckpointExtension": 110,
 }
 
 LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
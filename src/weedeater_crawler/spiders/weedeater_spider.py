@@ -1,105 +1,359 @@
 import os
 import json
 import time
+import uuid
 import tldextract
 from datetime import datetime, timezone
 from urllib.parse import urljoin
 from typing import Iterable
-from pathlib import Path
 
+import redis
 import scrapy
-from scrapy.linkextractors import LinkExtractor
+from prometheus_client import Counter, Histogram
 from scrapy_playwright.page import PageMethod
+from scrapy_redis.spiders import RedisMixin
 
+from weedeater_crawler.frontier import PRODUCT_LINK_PATTERNS, Frontier, inherited_meta, priority, seed_meta
+from weedeater_crawler.extraction import BREADCRUMBS, IMAGES, ExtractionEngine, extract_specs, first_match, structured_data
 from weedeater_crawler.items import ProductItem
-from weedeater_crawler.utils.nav import infinite_scroll, login_sequence
+from weedeater_crawler.utils.checkpoint import checkpoint_enabled, session_store
+from weedeater_crawler.utils.nav import infinite_scroll, login_sequence, scroll_stats
+from weedeater_crawler.utils.seeds import START_URLS_KEY, decode_seed, load_seeds, parse_shard, shard_key
+from weedeater_crawler.utils.sitemap import LastmodStore, iter_entries, robots_sitemaps
 
+# The old scroll path rendered every scroll listing twice and slept a fixed delay per
+# round; LEGACY_SCROLL_DELAY is that delay, used to estimate the time saved per listing.
+LEGACY_SCROLL_DELAY = 0.6
+SCROLL_ROUNDS = Histogram('listing_scroll_rounds', 'Scroll rounds per infinite-scroll listing', ['site'],
+                          buckets=(1, 2, 3, 4, 6, 8, 12, 20))
+SCROLL_SECONDS = Histogram('listing_scroll_seconds', 'In-page scroll time per infinite-scroll listing', ['site'])
+SCROLL_LINKS = Counter('listing_scroll_links', 'Product links revealed by scrolling', ['site'])
+SCROLL_SECONDS_SAVED = Counter('listing_scroll_seconds_saved',
+                               'Estimated seconds saved vs. the double-navigation fixed-delay scroll', ['site'])
 
-class WeedeaterSpider(scrapy.Spider):
+DISCOVERY_BATCH = 500
+DISCOVERY_URLS = Counter('discovery_urls', 'Product URLs found in sitemaps/feeds', ['site', 'outcome'])
+DISCOVERY_FALLBACKS = Counter('discovery_fallbacks', 'Discovery seeds that fell back to listing renders', ['site'])
+
+
+class WeedeaterSpider(RedisMixin, scrapy.Spider):
+    # Seeds come from the seeds file (WEEDEATER_SEED_SOURCE=yaml, the default) or from
+    # JSON seed payloads in Redis (WEEDEATER_SEED_SOURCE=redis, pushed by
+    # tools/seed_queue.py). In Redis mode the spider reads weedeater:start_urls, or
+    # weedeater:start_urls:<index> with WEEDEATER_SHARD=<index>/<count>, and keeps
+    # polling it when idle.
     name = "weedeater"
     custom_settings = {
         "PLAYWRIGHT_DEFAULT_NAVIGATION_TIMEOUT": 90_000,
     }
 
-    def start_requests(self) -> Iterable[scrapy.Request]:
-        # If running through Redis, seeds can be pushed via rpush to <spider>:start_urls
-        # Fallback: read local YAML
-        # Use environment variable for seeds path with fallback
-        seeds_path_str = os.getenv(
-            'WEEDEATER_SEEDS_PATH',
-            os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), "..", "seeds", "weedeater_targets.yaml")
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.extractor = ExtractionEngine(learn_pages=int(os.getenv("EXTRACTION_LEARN_PAGES", "5")))
+        self.seed_source = os.getenv("WEEDEATER_SEED_SOURCE", "yaml").lower()
+        self.frontier = Frontier(
+            max_depth=int(os.getenv("FRONTIER_MAX_DEPTH", "8")),
+            max_listings=int(os.getenv("FRONTIER_MAX_LISTINGS", "5000")),
         )
-        seeds_path = Path(seeds_path_str)
+        self._discovery = {}
+        self._discovery_owner = uuid.uuid4().hex
+        self._lastmods = None
+        self._lastmod_marks = {}
+        self._file_seeds = None
+        self.sessions = None
+
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super().from_crawler(crawler, *args, **kwargs)
+        if checkpoint_enabled():
+            spider.sessions = session_store(redis.from_url(crawler.settings.get("REDIS_URL")), spider.name)
+        if spider.seed_source == "redis":
+            shard, shards = parse_shard()
+            spider.redis_key = shard_key(START_URLS_KEY, shard, shards)
+            spider.setup_redis(crawler)
+        return spider
+
+    def start_requests(self) -> Iterable[scrapy.Request]:
+        if self.seed_source == "redis":
+            yield from self.next_requests()
+            return
+        for s in load_seeds(log=self.logger):
+            yield from self._seed_requests(s)
 
+    def make_request_from_data(self, data):
+        # One Redis seed payload -> its requests. Bare URLs (the old payload) take their
+        # meta from the matching seeds-file entry, if there is one.
         try:
-            import yaml
-            with open(seeds_path, "r", encoding="utf-8") as f:
-                seeds = yaml.safe_load(f)
-                if not seeds:
-                    seeds = []
-        except FileNotFoundError:
-            self.logger.error(f"Seeds file not found at {seeds_path}")
-            seeds = []
-        except yaml.YAMLError as e:
-            self.logger.error(f"Failed to parse YAML from {seeds_path}: {e}")
-            seeds = []
-        except (IOError, OSError) as e:
-            self.logger.error(f"Failed to read seeds file at {seeds_path}: {e}")
-            seeds = []
-        for s in seeds:
-            url = s["url"]
-            meta = {
-                "site": s.get("site"),
-                "allow_patterns": s.get("allow_patterns"),
-                "deny_patterns": s.get("deny_patterns"),
-                "scroll_to_load": s.get("scroll_to_load", False),
-                "type": s.get("type"),
-                "playwright": True,
-                "playwright_context": "default",
-                "playwright_page_methods": [PageMethod("wait_for_load_state", state="networkidle")],
-            }
-            yield scrapy.Request(url, callback=self.parse_listing, meta=meta)
+            s = decode_seed(data, self.redis_encoding or "utf-8")
+        except ValueError as e:
+            self.logger.warning(f"Undecodable seed payload {data[:200]!r}: {e}")
+            return []
+        if not s.get("url"):
+            self.logger.warning(f"Seed payload without a url: {data[:200]!r}")
+            return []
+        if len(s) == 1:
+            if self._file_seeds is None:
+                self._file_seeds = {f["url"]: f for f in load_seeds(log=self.logger) if f.get("url")}
+            s = self._file_seeds.get(s["url"], s)
+        return list(self._seed_requests(s))
 
-    def parse_listing(self, response: scrapy.http.Response):
-        site = response.meta.get("site") or tldextract.extract(response.url).registered_domain
-        allow = response.meta.get("allow_patterns") or []
-        deny = response.meta.get("deny_patterns") or []
+    def _seed_requests(self, s):
+        if s.get("login") and not self._has_session(s):
+            yield self._login_request(s)
+            return
+        if s.get("discovery") in ("sitemap", "feed"):
+            yield from self._discovery_requests(s)
+        elif s.get("page_type") == "product":
+            yield scrapy.Request(s["url"], callback=self.parse_product, meta=self._product_meta(seed_meta(s)),
+                                 priority=priority("product"))
+        else:
+            yield self._listing_request(s)
+
+    # Seed login: a seed with a `login` block logs in first (one render running
+    # login_sequence in the site's context) and is crawled from the callback. The
+    # handler saves the logged-in storage state as the site's session, so while it is
+    # in the session store (SESSION_TTL_HOURS) restarts skip the login.
+    def _has_session(self, s) -> bool:
+        return self.sessions is not None and self.sessions.get(s.get("site") or "") is not None
+
+    def _login_request(self, s):
+        login = s["login"]
+        email = os.getenv(login.get("email_env", "LOGIN_EMAIL"), "")
+        password = os.getenv(login.get("password_env", "LOGIN_PASSWORD"), "")
+        meta = {
+            **seed_meta(s), "page_type": "login", "playwright": True, "playwright_context": "default",
+            "session_login": True,
+            "playwright_page_methods": login_sequence(
+                email, password, login["email_selector"], login["password_selector"], login["submit_selector"],
+            ),
+        }
+        return scrapy.Request(login.get("url") or s["url"], callback=self.after_login, errback=self.login_failed,
+                              meta=meta, cb_kwargs={"seed": s}, priority=priority("product"), dont_filter=True)
+
+    def after_login(self, response, seed):
+        self.logger.info(f"Logged in to {seed.get('site')} ({response.status})")
+        yield from self._seed_requests({**seed, "login": None})
+
+    def login_failed(self, failure):
+        seed = failure.request.cb_kwargs["seed"]
+        self.logger.warning(f"Login failed for {seed.get('site')}, crawling without a session: {failure.value!r}")
+        yield from self._seed_requests({**seed, "login": None})
+
+    async def start(self):
+        # Scrapy 2.13+ calls start(); newer releases no longer fall back to start_requests()
+        for request in self.start_requests():
+            yield request
+
+    def _listing_request(self, s):
+        meta = self._listing_meta(seed_meta(s), "category")
+        return scrapy.Request(s["url"], callback=self.parse_listing, meta=meta, priority=priority("category"))
+
+    # Sitemap / feed discovery. Each discovery seed tracks its outstanding sitemap
+    # requests; when the last one finishes without yielding a single product URL
+    # (or everything failed) the seed falls back to the listing render. The requests
+    # carry their seed, since the shared queue may hand them to another worker or to
+    # a restarted process. Those only count the requests they queue themselves
+    # ("adopted" state) and never fall back: they don't see the seed's other sources.
+    def _discovery_requests(self, s):
+        self._discovery[s["url"]] = {"seed": s, "pending": 0, "found": 0, "adopted": False}
+        sources = list(s.get("sitemaps") or []) + list(s.get("feeds") or [])
+        if not sources and s.get("discovery") == "sitemap":
+            robots = urljoin(s["url"], "/robots.txt")
+            yield self._discovery_request(s, robots, self.parse_robots, discovery_robots=True)
+            return
+        for url in sources:
+            yield self._discovery_request(s, url, self.parse_sitemap)
+
+    def _discovery_request(self, s, url, callback, **meta):
+        state = self._discovery.setdefault(s["url"], {"seed": s, "pending": 0, "found": 0, "adopted": True})
+        state["pending"] += 1
+        meta.update({
+            "site": s.get("site"),
+            "strip_params": s.get("strip_params"),
+            "page_type": "sitemap",
+            "discovery_seed": s,
+            "discovery_owner": self._discovery_owner,
+        })
+        # Sitemaps are re-read on every run; lastmod decides what gets scheduled
+        return scrapy.Request(url, callback=callback, errback=self.discovery_failed, meta=meta, dont_filter=True)
+
+    def parse_robots(self, response):
+        s = response.meta["discovery_seed"]
+        for url in robots_sitemaps(response.body) or [urljoin(response.url, "/sitemap.xml")]:
+            yield self._discovery_request(s, url, self.parse_sitemap)
+        yield from self._discovery_done(response.meta)
 
-        # Optionally scroll to load more products
+    def parse_sitemap(self, response):
+        s = response.meta["discovery_seed"]
+        rules = self.frontier.rules(seed_meta(s))
+        batch = []
+        found = 0
+        for entry in iter_entries(response.body):
+            url = urljoin(response.url, entry.loc)
+            if entry.kind == "sitemap":
+                yield self._discovery_request(s, url, self.parse_sitemap)
+                continue
+            if not rules.extractor.matches(url) or not rules.is_product(url):
+                continue
+            found += 1
+            batch.append(entry._replace(loc=url))
+            if len(batch) >= DISCOVERY_BATCH:
+                yield from self._discovered_products(batch, s)
+                batch = []
+        yield from self._discovered_products(batch, s)
+        state = self._discovery.get(s["url"])
+        if state is not None:
+            state["found"] += found
+        yield from self._discovery_done(response.meta)
+
+    def _discovered_products(self, entries, s):
+        if not entries:
+            return
+        site = s.get("site") or tldextract.extract(s["url"]).registered_domain
+        previous = self.lastmods.previous([e.loc for e in entries])
+        baseline = {}
+        for entry, prev in zip(entries, previous):
+            meta = self._product_meta(seed_meta(s))
+            dont_filter = False
+            if entry.lastmod is None:
+                # Undated: the dupefilter (and its revisit intervals) decides
+                outcome = "undated"
+            elif prev is None:
+                # First sighting; the URL may already be in the dupefilter from a
+                # listing crawl, so record the lastmod now as the baseline
+                outcome = "new"
+                baseline[entry.loc] = entry.lastmod
+            elif entry.lastmod > prev:
+                # Changed since the last successful fetch: bypass the dupefilter and
+                # record the new lastmod once parse_product has run, under the
+                # sitemap's loc (response.url differs after a redirect)
+                outcome = "changed"
+                dont_filter = True
+                meta["sitemap_lastmod"] = entry.lastmod
+                meta["sitemap_loc"] = entry.loc
+            else:
+                DISCOVERY_URLS.labels(site, "unchanged").inc()
+                continue
+            DISCOVERY_URLS.labels(site, outcome).inc()
+            yield scrapy.Request(entry.loc, callback=self.parse_product, meta=meta, dont_filter=dont_filter,
+                                 priority=priority("product"))
+        self.lastmods.mark(baseline)
+
+    # Request meta: the seed's fields (frontier.SEED_META_KEYS) plus page type and
+    # render options; nothing else is carried over from the parent response.
+    @staticmethod
+    def _product_meta(meta):
+        return {
+            **meta,
+            "page_type": "product",
+            "playwright": True,
+            "playwright_context": "default",
+            "playwright_page_methods": [PageMethod("wait_for_load_state", state="networkidle")],
+        }
+
+    def _listing_meta(self, meta, page_class):
+        meta = {**meta, "page_type": "listing", "page_class": page_class, "playwright": True,
+                "playwright_context": "default"}
+        meta["playwright_page_methods"] = self._listing_page_methods(meta)
+        return meta
+
+    def discovery_failed(self, failure):
+        request = failure.request
+        s = request.meta["discovery_seed"]
+        self.logger.warning(f"Discovery request failed for {request.url}: {failure.value!r}")
+        if request.meta.get("discovery_robots"):
+            # No robots.txt: try the conventional location before giving up
+            yield self._discovery_request(s, urljoin(request.url, "/sitemap.xml"), self.parse_sitemap)
+        yield from self._discovery_done(request.meta)
+
+    def _discovery_done(self, meta):
+        s = meta["discovery_seed"]
+        seed_url = s["url"]
+        state = self._discovery.get(seed_url)
+        if state is None or meta.get("discovery_owner") != self._discovery_owner:
+            return  # queued by another worker or an earlier run, not counted here
+        state["pending"] -= 1
+        if state["pending"] > 0:
+            return
+        if state["found"]:
+            self.logger.info(f"Discovery for {seed_url}: {state['found']} product URLs in sitemaps/feeds")
+            return
+        if state["adopted"]:
+            return
+        site = s.get("site") or tldextract.extract(seed_url).registered_domain
+        DISCOVERY_FALLBACKS.labels(site).inc()
+        self.logger.warning(f"No product URLs discovered for {seed_url}; falling back to listing render")
+        yield self._listing_request(s)
+
+    @property
+    def lastmods(self):
+        if self._lastmods is None:
+            server = redis.from_url(self.settings.get("REDIS_URL"))
+            self._lastmods = LastmodStore(server, f"{self.name}:lastmod")
+        return self._lastmods
+
+    def parse_listing(self, response: scrapy.http.Response):
+        # Scroll listings were scrolled during this same navigation (see _listing_page_methods)
         if response.meta.get("scroll_to_load"):
-            yield response.follow(
-                response.url,
-                callback=self.parse_listing_final,
-                meta={
-                    **response.meta,
-                    "playwright": True,
-                    "playwright_page_methods": [
-                        PageMethod("wait_for_selector", "body"),
-                        *infinite_scroll(max_rounds=12, scroll_delay=0.6),
-                        PageMethod("wait_for_load_state", state="networkidle"),
-                    ],
-                },
-                dont_filter=True,
-            )
+            self._record_scroll(response)
+        yield from self._extract_and_follow(response)
+
+    @staticmethod
+    def _listing_page_methods(meta):
+        # Scroll seeds carry the scroll from their first request, so a listing is
+        # rendered once with all lazily loaded products instead of rendered, then
+        # re-requested and rendered again with scrolling.
+        scroll = meta.get("scroll_to_load")
+        if not scroll:
+            return [PageMethod("wait_for_load_state", state="networkidle")]
+        options = scroll if isinstance(scroll, dict) else {}
+        return [
+            PageMethod("wait_for_selector", "body"),
+            *infinite_scroll(link_patterns=PRODUCT_LINK_PATTERNS, **options),
+            PageMethod("wait_for_load_state", state="networkidle"),
+        ]
+
+    def _record_scroll(self, response):
+        stats = scroll_stats(response.meta)
+        if not stats:
             return
+        site = response.meta.get("site") or tldextract.extract(response.url).registered_domain
+        scroll_seconds = stats["elapsed_ms"] / 1000
+        SCROLL_ROUNDS.labels(site).observe(stats["rounds"])
+        SCROLL_SECONDS.labels(site).observe(scroll_seconds)
+        SCROLL_LINKS.labels(site).inc(max(0, stats["links"] - stats["initial_links"]))
+        # Saved: the extra navigation (this download minus its scroll time) plus the
+        # fixed per-round sleeps the old loop would have spent on the same rounds.
+        navigation = max(0.0, response.meta.get("download_latency", 0.0) - scroll_seconds)
+        sleeps = max(0.0, (stats["rounds"] + 1) * LEGACY_SCROLL_DELAY - scroll_seconds)
+        SCROLL_SECONDS_SAVED.labels(site).inc(navigation + sleeps)
+        self.logger.debug(f"Scrolled {response.url}: {stats['rounds']} rounds, "
+                          f"{stats['initial_links']} -> {stats['links']} product links in {scroll_seconds:.1f}s")
 
-        # No scroll path: continue to link extraction now
-        yield from self._extract_and_follow(response, allow, deny)
-
-    def parse_listing_final(self, response: scrapy.http.Response):
-        allow = response.meta.get("allow_patterns") or []
-        deny = response.meta.get("deny_patterns") or []
-        yield from self._extract_and_follow(response, allow, deny)
-
-    def _extract_and_follow(self, response, allow, deny):
-        # Extract product and pagination links
-        le = LinkExtractor(allow=allow or (), deny=deny or ())
-        for link in le.extract_links(response):
-            href = link.url
-            if any(p in href for p in ["/product/", "/products/", "/p/"]):
-                yield response.follow(href, callback=self.parse_product, meta={**response.meta, "playwright": True})
+    def _extract_and_follow(self, response):
+        # The frontier classifies, prioritises and caps the links (see frontier.py)
+        meta = inherited_meta(response.meta)
+        for url, page_class, prio in self.frontier.links(response):
+            if page_class == "product":
+                yield response.follow(url, callback=self.parse_product, meta=self._product_meta(meta), priority=prio)
             else:
-                yield response.follow(href, callback=self.parse_listing, meta={**response.meta, "playwright": True})
+                yield response.follow(url, callback=self.parse_listing, meta=self._listing_meta(meta, page_class),
+                                      priority=prio)
+
+    def has_static_content(self, response, request) -> bool:
+        # Probe used by HybridDownloadHandler: True when the plain HTTP response
+        # already holds what the request's callback extracts, so no render is needed.
+        callback = getattr(request.callback, "__name__", None)
+        if callback == "parse_product":
+            root = response.selector.root
+            data = structured_data(root)
+            name = data.get('product_name') or first_match('product_name', root)
+            price = data.get('price') or first_match('price', root)
+            return bool(name and name.strip() and price)
+        if callback == "parse_listing":
+            rules = self.frontier.rules(request.meta)
+            return any(rules.is_product(link.url) for link in rules.extractor.extract_links(response))
+        return False
 
     def parse_product(self, response: scrapy.http.Response):
         item = ProductItem()
@@ -107,27 +361,33 @@ class WeedeaterSpider(scrapy.Spider):
         item['crawled_at'] = datetime.now(timezone.utc).isoformat()
         item['site'] = response.meta.get('site')
 
-        # Heuristics for product extraction across varied templates
-        sel = response.css
-        item['product_name'] = sel('h1::text').get() or sel('h1 span::text').get()
-        item['brand'] = sel('[itemprop="brand"]::text').get() or sel('.brand::text').get() or sel('meta[itemprop="brand"]::attr(content)').get()
-        item['sku'] = sel('[itemprop="sku"]::text').get() or sel('span.sku::text').get() or sel('meta[itemprop="sku"]::attr(content)').get()
-        item['upc'] = sel('[itemprop="gtin13"]::attr(content)').get() or sel('[data-upc]::attr(data-upc)').get()
-        item['price'] = sel('[itemprop="price"]::attr(content)').get() or sel('.price ::text').re_first(r"\$?([0-9,.]+)")
-        item['currency'] = sel('[itemprop="priceCurrency"]::attr(content)').get() or 'USD'
-        item['availability'] = sel('[itemprop="availability"]::attr(content)').re_first(r"InStock|OutOfStock|PreOrder")
-        item['description'] = ' '.join(sel('[itemprop="description"] ::text').getall() or sel('.description ::text').getall()).strip()
-        specs = {}
-        for row in sel('table, .specs, .product-specs').css('tr'):
-            key = ' '.join(row.css('th, .label ::text').getall()).strip()
-            val = ' '.join(row.css('td, .value ::text').getall()).strip()
-            if key and val:
-                specs[key] = val
-        item['specs'] = specs or None
-        item['images'] = response.css('img::attr(src), img::attr(data-src), img::attr(data-original)').getall()
-        item['breadcrumbs'] = [b.strip() for b in response.css('nav.breadcrumbs a::text, .breadcrumbs a::text').getall() if b.strip()]
-
-        # Attach raw HTML for audit if enabled via pipeline
-        item['_raw_html_bytes'] = response.text.encode('utf-8')
+        # Structured data (JSON-LD/microdata) first, then the site's compiled selector
+        # plan, falling back to the full heuristic chains (see extraction.py)
+        root = response.selector.root
+        data = self.extractor.extract(root, item['site'] or tldextract.extract(response.url).registered_domain)
+        for field in ('product_name', 'brand', 'sku', 'upc', 'category', 'price', 'currency', 'availability', 'description'):
+            item[field] = data.get(field)
+        item['currency'] = item['currency'] or 'USD'
+        item['description'] = item['description'] or ''
+        item['specs'] = extract_specs(root) or None
+        item['images'] = data.get('images') or [str(src) for src in IMAGES(root)]
+        item['breadcrumbs'] = data.get('breadcrumbs') or [str(b).strip() for b in BREADCRUMBS(root) if b.strip()]
+
+        # Attach raw HTML for audit if enabled via pipeline. The body is passed by
+        # reference (no decode/encode copy); the archive/upload pipelines pop it.
+        item['_raw_html_bytes'] = response.body
 
+        if 'sitemap_lastmod' in response.meta:
+            loc = response.meta.get('sitemap_loc', response.url)
+            self._lastmod_marks[loc] = response.meta['sitemap_lastmod']
+            if len(self._lastmod_marks) >= DISCOVERY_BATCH:
+                self._flush_lastmods()
         yield item
+
+    def _flush_lastmods(self):
+        self.lastmods.mark(self._lastmod_marks)
+        self._lastmod_marks = {}
+
+    def closed(self, reason):
+        if self._lastmod_marks:
+            self._flush_lastmods()
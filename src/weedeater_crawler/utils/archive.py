@@ -0,0 +1,187 @@
+import os
+import re
+import mmap
+import struct
+import hashlib
+import logging
+from pathlib import Path
+from datetime import datetime, timezone
+from typing import Callable, Dict, Iterator, Optional, Tuple
+
+import zstandard
+
+logger = logging.getLogger(__name__)
+
+# Segment layout: a sequence of records, each a 4-byte little-endian length followed by
+# one independent zstd frame holding a WARC-style header block and the raw body.
+# Every frame decompresses on its own, so a record is addressable by its byte offset.
+_LENGTH = struct.Struct("<I")
+# Index layout: fixed-width entries of (first 8 bytes of sha256(url), offset, frame length)
+_INDEX_ENTRY = struct.Struct("<8sQI")
+_SEGMENT_RE = re.compile(r"^(?P<prefix>.+)-(?P<seq>\d{6})\.warc\.zst$")
+
+ARCHIVE_SCHEME = "archive://"
+
+
+def url_hash(url: str) -> bytes:
+    return hashlib.sha256(url.encode("utf-8")).digest()[:8]
+
+
+def format_ref(segment: str, offset: int) -> str:
+    return f"{ARCHIVE_SCHEME}{segment}:{offset}"
+
+
+def parse_ref(ref: str) -> Tuple[str, int]:
+    """Split 'archive://<segment>:<offset>' (or '<segment>:<offset>') into its parts."""
+    if ref.startswith(ARCHIVE_SCHEME):
+        ref = ref[len(ARCHIVE_SCHEME):]
+    segment, _, offset = ref.rpartition(":")
+    return segment, int(offset)
+
+
+class SegmentArchiveWriter:
+    """Append raw response bodies to rolling zstd segment files with an offset index."""
+
+    def __init__(self, directory: str, prefix: str = "raw", max_segment_bytes: int = 256 * 1024 * 1024,
+                 level: int = 3, on_segment_closed: Optional[Callable[[Path, Path], None]] = None):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.prefix = prefix
+        self.max_segment_bytes = max_segment_bytes
+        self.compressor = zstandard.ZstdCompressor(level=level)
+        self.on_segment_closed = on_segment_closed
+        self.seq = self._last_sequence()
+        self.segment = None
+        self.index = None
+        self.segment_path = None
+        self.offset = 0
+
+    def _last_sequence(self) -> int:
+        # Never reopen an old segment: after a crash its tail and index may disagree
+        seqs = [int(m.group("seq")) for m in map(_SEGMENT_RE.match, os.listdir(self.directory))
+                if m and m.group("prefix") == self.prefix]
+        return max(seqs, default=0)
+
+    def _open_segment(self):
+        self.seq += 1
+        self.segment_path = self.directory / f"{self.prefix}-{self.seq:06d}.warc.zst"
+        self.segment = open(self.segment_path, "ab")
+        self.index = open(f"{self.segment_path}.idx", "ab")
+        self.offset = 0
+
+    def _close_segment(self):
+        if not self.segment:
+            return
+        self.segment.close()
+        self.index.close()
+        closed = self.segment_path
+        self.segment = self.index = None
+        if self.on_segment_closed and self.offset:
+            self.on_segment_closed(closed, Path(f"{closed}.idx"))
+
+    def append(self, url: str, body: bytes, status: int = 200, content_type: Optional[str] = None) -> str:
+        """Archive one response body and return its 'archive://segment:offset' reference."""
+        if self.segment is None or self.offset >= self.max_segment_bytes:
+            self._close_segment()
+            self._open_segment()
+        header = (
+            "WARC/1.0\r\n"
+            "WARC-Type: response\r\n"
+            f"WARC-Target-URI: {url}\r\n"
+            f"WARC-Date: {datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')}\r\n"
+            f"HTTP-Status: {status}\r\n"
+            f"Content-Type: {content_type or 'text/html'}\r\n"
+            f"Content-Length: {len(body)}\r\n\r\n"
+        ).encode("utf-8")
+        # Stream header and body through one frame so the body is never concatenated/copied
+        cobj = self.compressor.compressobj(size=len(header) + len(body))
+        frame = cobj.compress(header) + cobj.compress(body) + cobj.flush()
+        offset = self.offset
+        self.segment.write(_LENGTH.pack(len(frame)))
+        self.segment.write(frame)
+        self.index.write(_INDEX_ENTRY.pack(url_hash(url), offset, len(frame)))
+        self.offset += _LENGTH.size + len(frame)
+        return format_ref(self.segment_path.name, offset)
+
+    def flush(self):
+        if self.segment:
+            self.segment.flush()
+            self.index.flush()
+
+    def close(self):
+        self._close_segment()
+
+
+class SegmentReader:
+    """Random-access reader over one segment via mmap and its offset index."""
+
+    def __init__(self, path: str):
+        self.path = Path(path)
+        self._file = open(self.path, "rb")
+        size = os.fstat(self._file.fileno()).st_size
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+        self._decompressor = zstandard.ZstdDecompressor()
+        self._index: Optional[Dict[bytes, int]] = None
+
+    def _load_index(self) -> Dict[bytes, int]:
+        index = {}
+        for key, offset, _length in iter_index(self.path):
+            index[key] = offset  # later captures of a URL win
+        return index
+
+    def read(self, offset: int) -> Tuple[Dict[str, str], bytes]:
+        """Return (headers, body) of the record starting at offset."""
+        if self._mm is None:
+            raise KeyError(offset)
+        (length,) = _LENGTH.unpack_from(self._mm, offset)
+        start = offset + _LENGTH.size
+        record = self._decompressor.decompress(self._mm[start:start + length])
+        head, _, body = record.partition(b"\r\n\r\n")
+        headers = {}
+        for line in head.decode("utf-8", "replace").split("\r\n")[1:]:
+            name, _, value = line.partition(":")
+            headers[name.strip()] = value.strip()
+        return headers, body
+
+    def get(self, url: str) -> Optional[bytes]:
+        if self._index is None:
+            self._index = self._load_index()
+        offset = self._index.get(url_hash(url))
+        if offset is None:
+            return None
+        headers, body = self.read(offset)
+        # The index key is a truncated hash; confirm the URL before returning
+        return body if headers.get("WARC-Target-URI") == url else None
+
+    def __iter__(self) -> Iterator[Tuple[int, Dict[str, str], bytes]]:
+        """Scan records sequentially: yields (offset, headers, body)."""
+        offset = 0
+        size = len(self._mm) if self._mm is not None else 0
+        while offset + _LENGTH.size <= size:
+            (length,) = _LENGTH.unpack_from(self._mm, offset)
+            if offset + _LENGTH.size + length > size:
+                break  # truncated tail from an unclean shutdown
+            headers, body = self.read(offset)
+            yield offset, headers, body
+            offset += _LENGTH.size + length
+
+    def close(self):
+        if self._mm is not None:
+            self._mm.close()
+        self._file.close()
+
+
+def iter_index(segment_path) -> Iterator[Tuple[bytes, int, int]]:
+    """(url hash, offset, frame length) entries of a segment's .idx; nothing when it is missing."""
+    idx_path = Path(f"{segment_path}.idx")
+    if not idx_path.exists():
+        return
+    data = idx_path.read_bytes()
+    # A torn last entry from an unclean shutdown is ignored
+    yield from _INDEX_ENTRY.iter_unpack(data[:len(data) - len(data) % _INDEX_ENTRY.size])
+
+
+def iter_segments(directory: str) -> Iterator[Path]:
+    for name in sorted(os.listdir(directory)):
+        if _SEGMENT_RE.match(name):
+            yield Path(directory) / name
@@ -0,0 +1,138 @@
+from typing import Optional
+from urllib.parse import urlsplit
+
+from prometheus_client import Counter
+
+from .seeds import load_seeds
+
+BLOCKED_REQUESTS = Counter('playwright_blocked_requests', 'Browser subrequests aborted', ['site', 'resource_type'])
+BLOCKED_BYTES = Counter('playwright_blocked_bytes_estimated',
+                        'Estimated transfer bytes avoided by aborted subrequests', ['site', 'resource_type'])
+
+DEFAULT_BLOCKED_TYPES = frozenset({"image", "media", "font", "stylesheet", "ping"})
+
+# Third-party hosts (matched with all subdomains) that never carry product data:
+# analytics, tag managers, ads, session replay, chat and review widgets.
+DEFAULT_BLOCKED_HOSTS = frozenset({
+    # analytics / tag managers
+    "google-analytics.com", "googletagmanager.com", "analytics.google.com", "assets.adobedtm.com",
+    "omtrdc.net", "demdex.net", "tiqcdn.com", "tealiumiq.com", "ensighten.com", "segment.com",
+    "segment.io", "mparticle.com", "newrelic.com", "nr-data.net", "quantserve.com",
+    "scorecardresearch.com", "clarity.ms", "hotjar.com", "fullstory.com", "mouseflow.com",
+    "optimizely.com", "cquotient.com", "heapanalytics.com",
+    # ads / pixels
+    "doubleclick.net", "googlesyndication.com", "googleadservices.com", "connect.facebook.net",
+    "bat.bing.com", "analytics.tiktok.com", "criteo.com", "criteo.net", "taboola.com",
+    "pinimg.com", "ads-twitter.com", "snap.licdn.com",
+    # chat widgets
+    "intercom.io", "intercomcdn.com", "zdassets.com", "zopim.com", "livechatinc.com", "drift.com",
+    "driftt.com", "tawk.to", "olark.com", "gorgias.chat", "liveperson.net",
+    # review widgets
+    "bazaarvoice.com", "powerreviews.com", "yotpo.com", "trustpilot.com", "stamped.io",
+    "judge.me", "reviews.io", "turnto.com",
+})
+
+# Median transfer size per resource type (HTTP Archive, rounded). Aborted requests are
+# never downloaded, so saved bytes can only be estimated.
+TYPICAL_BYTES = {
+    "image": 15_000, "media": 250_000, "font": 30_000, "stylesheet": 12_000, "script": 25_000,
+    "xhr": 3_000, "fetch": 3_000, "ping": 500, "other": 2_000,
+}
+
+_NEVER_BLOCKED = frozenset({"document"})
+
+
+def _suffixes(host: str):
+    # www.googletagmanager.com -> www.googletagmanager.com, googletagmanager.com, com
+    while host:
+        yield host
+        host = host.partition(".")[2]
+
+
+def _matches(host: str, hosts: frozenset) -> bool:
+    return any(suffix in hosts for suffix in _suffixes(host))
+
+
+class BlockPolicy:
+    __slots__ = ("site", "types", "hosts", "allow_hosts")
+
+    def __init__(self, site: str, types=DEFAULT_BLOCKED_TYPES, hosts=DEFAULT_BLOCKED_HOSTS, allow_hosts=frozenset()):
+        self.site = site
+        self.types = frozenset(types)
+        self.hosts = frozenset(hosts)
+        self.allow_hosts = frozenset(allow_hosts)
+
+    @classmethod
+    def from_seed(cls, site: str, block) -> "BlockPolicy":
+        """Defaults adjusted by a seed's `block` entry (false disables blocking for the site)."""
+        if block is False:
+            return cls(site, types=(), hosts=())
+        block = block or {}
+        types = set(block["types"]) if "types" in block else set(DEFAULT_BLOCKED_TYPES)
+        types.difference_update(block.get("allow_types") or ())
+        hosts = set(DEFAULT_BLOCKED_HOSTS) | {h.lower() for h in block.get("hosts") or ()}
+        return cls(site, types - _NEVER_BLOCKED, hosts, {h.lower() for h in block.get("allow_hosts") or ()})
+
+    def blocks(self, host: str, resource_type: str) -> bool:
+        if resource_type in _NEVER_BLOCKED or (self.allow_hosts and _matches(host, self.allow_hosts)):
+            return False
+        return resource_type in self.types or _matches(host, self.hosts)
+
+
+class ResourceBlocker:
+    # PLAYWRIGHT_ABORT_REQUEST predicate. A subrequest is aborted when its resource
+    # type is blocked or its host (or any parent domain) is in the blocked host set,
+    # unless the host is allowed for the site. The site is the host of the page's
+    # main frame, matched against the seeds' `site` (parent domains included), so
+    # requests from third-party iframes use the embedding site's policy. Per-seed
+    # `block` entries override the defaults; see weedeater_targets.yaml.
+    def __init__(self, seeds=None):
+        self._seeds = seeds
+        self._policies = None
+        self._by_host = {}
+        self.default = BlockPolicy("")
+
+    def _load(self):
+        self._policies = {}
+        seeds = self._seeds if self._seeds is not None else load_seeds()
+        for s in seeds:
+            site = (s.get("site") or urlsplit(s.get("url", "")).hostname or "").lower()
+            if site:
+                self._policies[site] = BlockPolicy.from_seed(site, s.get("block"))
+
+    def policy(self, host: str) -> BlockPolicy:
+        policy = self._by_host.get(host)
+        if policy is None:
+            if self._policies is None:
+                self._load()
+            policy = next((self._policies[s] for s in _suffixes(host) if s in self._policies), None)
+            if policy is None:
+                policy = BlockPolicy(host, self.default.types, self.default.hosts)
+            self._by_host[host] = policy
+        return policy
+
+    def __call__(self, request) -> bool:
+        resource_type = request.resource_type
+        if resource_type in _NEVER_BLOCKED:
+            return False
+        host = (urlsplit(request.url).hostname or "").lower()
+        policy = self.policy(_page_host(request) or host)
+        if not policy.blocks(host, resource_type):
+            return False
+        site = policy.site
+        BLOCKED_REQUESTS.labels(site=site, resource_type=resource_type).inc()
+        BLOCKED_BYTES.labels(site=site, resource_type=resource_type).inc(
+            TYPICAL_BYTES.get(resource_type, TYPICAL_BYTES["other"]))
+        return True
+
+
+def _page_host(request) -> Optional[str]:
+    try:
+        url = request.frame.page.main_frame.url
+    except Exception:
+        # Service worker requests have no frame
+        return None
+    return (urlsplit(url).hostname or "").lower() or None
+
+
+should_abort = ResourceBlocker()
@@ -0,0 +1,173 @@
+import math
+import time
+import hashlib
+from typing import Iterable, List
+
+from redis.exceptions import ResponseError
+
+
+def bloom_parameters(capacity: int, error_rate: float):
+    """Return (bits, hash count) for a Bloom filter holding capacity items at error_rate."""
+    bits = math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2))
+    hashes = max(1, round(bits / capacity * math.log(2)))
+    return bits, hashes
+
+
+class BitmapBloomFilter:
+    # Scalable Bloom filter stored in plain Redis bitmaps (SETBIT/GETBIT), usable on any
+    # Redis. When the newest layer reaches its capacity a new layer is added with
+    # `growth` times the capacity and a tighter error rate, so the compound false
+    # positive rate stays under `error_rate` however many items are added.
+    backend = "bitmap"
+    _MAX_BITS = 2 ** 32  # Redis string limit (512 MB)
+    _BATCH = 1000
+
+    def __init__(self, server, key: str, capacity: int = 1_000_000, error_rate: float = 0.001,
+                 growth: int = 2, tightening: float = 0.5, refresh_interval: float = 30.0):
+        self.server = server
+        self.key = key
+        self.meta_key = f"{key}:meta"
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.growth = growth
+        self.tightening = tightening
+        self.refresh_interval = refresh_interval
+        self._layers = 1
+        self._count = 0
+        self._refreshed = 0.0
+
+    def _layer(self, i: int):
+        capacity = self.capacity * self.growth ** i
+        error = self.error_rate * (1 - self.tightening) * self.tightening ** i
+        bits, hashes = bloom_parameters(capacity, error)
+        return f"{self.key}:{i}", capacity, min(bits, self._MAX_BITS), hashes
+
+    def _refresh(self, force: bool = False):
+        # Layer count is shared through Redis so every node writes to the same layer
+        if force or time.monotonic() - self._refreshed > self.refresh_interval:
+            self._layers = int(self.server.hget(self.meta_key, "layers") or 1)
+            self._count = int(self.server.hget(self.meta_key, f"count:{self._layers - 1}") or 0)
+            self._refreshed = time.monotonic()
+
+    @staticmethod
+    def _offsets(item: str, bits: int, hashes: int):
+        digest = hashlib.blake2b(item.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % bits for i in range(hashes)]
+
+    def add_many(self, items: Iterable[str]) -> List[bool]:
+        """Add items; returns True for each item that was not (probably) present."""
+        items = list(items)
+        added = []
+        while len(added) < len(items):
+            self._refresh()
+            layers = [self._layer(i) for i in range(self._layers)]
+            # Never overfill the current layer within one batch
+            room = max(1, min(self._BATCH, layers[-1][1] - self._count))
+            added.extend(self._add_batch(items[len(added):len(added) + room], layers))
+        return added
+
+    def _add_batch(self, items: List[str], layers) -> List[bool]:
+        present = [False] * len(items)
+        if len(layers) > 1:
+            pipe = self.server.pipeline(transaction=False)
+            for item in items:
+                for key, _, bits, hashes in layers[:-1]:
+                    for offset in self._offsets(item, bits, hashes):
+                        pipe.getbit(key, offset)
+            results = iter(pipe.execute())
+            for n in range(len(items)):
+                for _, _, _, hashes in layers[:-1]:
+                    if all([next(results) for _ in range(hashes)]):
+                        present[n] = True
+        key, capacity, bits, hashes = layers[-1]
+        pipe = self.server.pipeline(transaction=False)
+        pending = [n for n in range(len(items)) if not present[n]]
+        for n in pending:
+            for offset in self._offsets(items[n], bits, hashes):
+                pipe.setbit(key, offset, 1)
+        results = iter(pipe.execute())
+        added = [False] * len(items)
+        for n in pending:
+            # All bits already set means the item (probably) was in the current layer
+            added[n] = not all([next(results) for _ in range(hashes)])
+        new = sum(added)
+        if new:
+            self._count = self.server.hincrby(self.meta_key, f"count:{len(layers) - 1}", new)
+            if self._count >= capacity:
+                self.server.hset(self.meta_key, "layers", len(layers) + 1)
+                self._refresh(force=True)
+        return added
+
+    def add(self, item: str) -> bool:
+        return self.add_many([item])[0]
+
+    def count(self) -> int:
+        counts = self.server.hgetall(self.meta_key)
+        return sum(int(v) for k, v in counts.items()
+                   if (k.decode() if isinstance(k, bytes) else k).startswith("count:"))
+
+    def memory_bytes(self) -> int:
+        self._refresh(force=True)
+        return sum(self.server.strlen(self._layer(i)[0]) for i in range(self._layers))
+
+    def clear(self):
+        self._refresh(force=True)
+        self.server.delete(self.meta_key, *[self._layer(i)[0] for i in range(self._layers)])
+        self._layers = 1
+        self._count = 0
+
+
+class RedisBloomFilter:
+    # Same interface backed by the RedisBloom module (BF.* commands), which scales
+    # its own sub-filters server-side.
+    backend = "redisbloom"
+
+    def __init__(self, server, key: str, capacity: int = 1_000_000, error_rate: float = 0.001,
+                 growth: int = 2, **kwargs):
+        self.server = server
+        self.key = key
+        self.error_rate = error_rate
+        try:
+            server.execute_command("BF.RESERVE", key, error_rate, capacity, "EXPANSION", growth)
+        except ResponseError as e:
+            if "exists" not in str(e).lower():
+                raise
+
+    def add_many(self, items: Iterable[str]) -> List[bool]:
+        items = list(items)
+        if not items:
+            return []
+        return [bool(r) for r in self.server.execute_command("BF.MADD", self.key, *items)]
+
+    def add(self, item: str) -> bool:
+        return self.add_many([item])[0]
+
+    def _info(self) -> dict:
+        raw = self.server.execute_command("BF.INFO", self.key)
+        return {raw[i].decode() if isinstance(raw[i], bytes) else raw[i]: raw[i + 1] for i in range(0, len(raw), 2)}
+
+    def count(self) -> int:
+        return int(self._info().get("Number of items inserted", 0))
+
+    def memory_bytes(self) -> int:
+        return int(self._info().get("Size", 0))
+
+    def clear(self):
+        self.server.delete(self.key)
+
+
+def has_redisbloom(server) -> bool:
+    try:
+        server.execute_command("BF.EXISTS", "__weedeater_bloom_probe__", "x")
+        return True
+    except ResponseError:
+        return False
+
+
+def bloom_filter(server, key: str, backend: str = "auto", **kwargs):
+    """Build a scalable Bloom filter; backend is auto | redisbloom | bitmap."""
+    if backend == "redisbloom" or (backend == "auto" and has_redisbloom(server)):
+        return RedisBloomFilter(server, key, **kwargs)
+    return BitmapBloomFilter(server, key, **kwargs)
@@ -0,0 +1,143 @@
+import time
+from typing import Optional
+
+from prometheus_client import Counter, Gauge
+
+from .procs import process_tree_rss
+
+POOL_CONTEXTS = Gauge('playwright_pool_contexts', 'Live Playwright contexts in the pool', ['state'],
+                      multiprocess_mode='livesum')
+POOL_PAGES = Gauge('playwright_pool_pages', 'Playwright pages in the pool', ['state'], multiprocess_mode='livesum')
+POOL_PAGE_REUSE = Counter('playwright_pool_page_requests', 'Rendered requests by page source', ['source'])
+POOL_RECYCLES = Counter('playwright_context_recycles', 'Contexts retired and replaced', ['reason'])
+BROWSER_RSS = Gauge('playwright_browser_rss_bytes', 'RSS of the browser process tree', multiprocess_mode='livesum')
+
+
+class _PooledContext:
+    __slots__ = ("name", "key", "user_agent", "navigations", "active", "idle", "retiring", "last_used",
+                 "session", "saved_at")
+
+    def __init__(self, name: str, key: tuple, user_agent: Optional[str]):
+        self.name = name
+        self.key = key
+        self.user_agent = user_agent
+        self.navigations = 0
+        self.active = 0
+        self.idle = []
+        self.retiring = False
+        self.last_used = time.time()
+        self.session = None  # storage state restored into the context, {} if none (handler)
+        self.saved_at = 0    # navigations when the storage state was last checkpointed
+
+
+class ContextPool:
+    # Bookkeeping for per-site browser contexts. Each (site, base context) gets
+    # contexts_per_site slots, and each slot holds one live context named
+    # "<site>/<base>/<slot>#<generation>". A context keeps the User-Agent of the
+    # request that opened it, and every request routed to it is sent with that UA,
+    # so plain HTTP and rendered fetches look alike. After max_navigations renders,
+    # or when the browser tree exceeds the RSS budget, the slot moves to a new
+    # generation; contexts unused for idle_timeout are retired too. The old context
+    # takes no new work, and it is closed once its in-flight pages finish (see
+    # HybridDownloadHandler). Finished pages wait in `idle` for the next request of
+    # the same context instead of being closed.
+    def __init__(self, contexts_per_site: int = 2, max_navigations: int = 200, max_idle_pages: int = 2,
+                 rss_budget: Optional[int] = None, idle_timeout: float = 300.0, check_interval: float = 10.0):
+        self.contexts_per_site = max(1, contexts_per_site)
+        self.max_navigations = max_navigations
+        self.max_idle_pages = max_idle_pages
+        self.rss_budget = rss_budget
+        self.idle_timeout = idle_timeout
+        self.check_interval = check_interval
+        self.generations = {}  # (site, base, slot) -> generation
+        self.contexts = {}     # name -> _PooledContext
+        self._checked_at = 0.0
+
+    def assign(self, site: str, base: str, user_agent: Optional[str]) -> _PooledContext:
+        best = None
+        for slot in range(self.contexts_per_site):
+            key = (site, base, slot)
+            name = f"{site}/{base}/{slot}#{self.generations.setdefault(key, 0)}"
+            ctx = self.contexts.get(name)
+            if ctx is None:
+                ctx = self.contexts[name] = _PooledContext(name, key, user_agent)
+                self._export()
+                return ctx
+            if best is None or ctx.active < best.active:
+                best = ctx
+        return best
+
+    def take_idle(self, ctx: _PooledContext):
+        while ctx.idle:
+            page = ctx.idle.pop()
+            if not page.is_closed():
+                return page
+        return None
+
+    def started(self, ctx: _PooledContext):
+        ctx.active += 1
+        ctx.last_used = time.time()
+        self._export()
+
+    def finished(self, ctx: _PooledContext, page=None) -> list:
+        """Account for a finished render. Returns pages the caller must close."""
+        ctx.active -= 1
+        ctx.navigations += 1
+        to_close = []
+        if page is not None and not page.is_closed():
+            if ctx.retiring or len(ctx.idle) >= self.max_idle_pages:
+                to_close.append(page)
+            else:
+                ctx.idle.append(page)
+        if not ctx.retiring and self.max_navigations and ctx.navigations >= self.max_navigations:
+            to_close.extend(self.retire(ctx, "navigations"))
+        self._export()
+        return to_close
+
+    def retire(self, ctx: _PooledContext, reason: str) -> list:
+        if ctx.retiring:
+            return []
+        ctx.retiring = True
+        self.generations[ctx.key] += 1
+        POOL_RECYCLES.labels(reason=reason).inc()
+        idle, ctx.idle = ctx.idle, []
+        return idle
+
+    def drained(self) -> list:
+        """Retired contexts with no page in flight: ready to be closed and forgotten."""
+        done = [ctx for ctx in self.contexts.values() if ctx.retiring and ctx.active <= 0]
+        for ctx in done:
+            del self.contexts[ctx.name]
+        if done:
+            self._export()
+        return done
+
+    def maintain(self, now: Optional[float] = None) -> list:
+        """Periodic upkeep; returns pages to close.
+
+        Retires contexts unused for idle_timeout (sites that are done), and when the
+        browser tree is over the RSS budget, the live context with the most renders.
+        """
+        now = now or time.time()
+        if now - self._checked_at < self.check_interval:
+            return []
+        self._checked_at = now
+        to_close = []
+        for ctx in list(self.contexts.values()):
+            if not ctx.retiring and ctx.active <= 0 and now - ctx.last_used > self.idle_timeout:
+                to_close.extend(self.retire(ctx, "idle"))
+        rss = process_tree_rss() if self.rss_budget else None
+        if rss is not None:
+            BROWSER_RSS.set(rss)
+            live = [ctx for ctx in self.contexts.values() if not ctx.retiring]
+            if rss > self.rss_budget and live:
+                # One context per check so the freed memory shows up before the next decision
+                to_close.extend(self.retire(max(live, key=lambda c: c.navigations), "rss"))
+        return to_close
+
+    def _export(self):
+        live = sum(1 for c in self.contexts.values() if not c.retiring)
+        POOL_CONTEXTS.labels(state="live").set(live)
+        POOL_CONTEXTS.labels(state="retiring").set(len(self.contexts) - live)
+        POOL_PAGES.labels(state="active").set(sum(c.active for c in self.contexts.values()))
+        POOL_PAGES.labels(state="idle").set(sum(len(c.idle) for c in self.contexts.values()))
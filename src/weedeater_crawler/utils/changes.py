@@ -0,0 +1,148 @@
+import json
+import sqlite3
+import hashlib
+from pathlib import Path
+from typing import Optional, Tuple
+
+# Fields that never count as a content change: the crawl time, where the raw HTML
+# was stored, and internal fields (leading underscore)
+VOLATILE_FIELDS = ("crawled_at", "raw_html_path")
+DEFAULT_TRACKED_FIELDS = ("price", "currency", "availability", "product_name")
+
+
+def _normalize(value):
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = " ".join(value.split())
+        return value or None
+    if isinstance(value, (list, tuple)):
+        return [_normalize(v) for v in value] or None
+    if isinstance(value, dict):
+        return {str(k): _normalize(v) for k, v in value.items()} or None
+    return value
+
+
+def item_digest(item) -> str:
+    """Stable hash of an item's normalized content fields (key order, whitespace and
+    empty-vs-missing don't matter)."""
+    data = {
+        k: v for k, v in ((k, _normalize(item.get(k))) for k in item.keys()
+                          if not k.startswith("_") and k not in VOLATILE_FIELDS)
+        if v is not None
+    }
+    return hashlib.blake2b(json.dumps(data, sort_keys=True, default=str).encode(), digest_size=16).hexdigest()
+
+
+def tracked(item, fields) -> dict:
+    return {f: _normalize(item.get(f)) for f in fields}
+
+
+def field_diff(old: dict, new: dict) -> dict:
+    """{field: [old, new]} for the tracked fields whose value changed."""
+    return {f: [old.get(f), v] for f, v in new.items() if old.get(f) != v}
+
+
+class RedisChangeStore:
+    # Last digest and tracked field values per (site, item key), in one Redis hash.
+    # Writes are buffered and sent as one multi-field HSET every `batch` puts and on
+    # close; reads see unsent writes.
+    def __init__(self, server, key: str, batch: int = 200):
+        self.server = server
+        self.key = key
+        self.batch = batch
+        self.pending = {}
+
+    @staticmethod
+    def _field(site, key) -> str:
+        return f"{site or ''}|{key}"
+
+    def get(self, site, key) -> Optional[Tuple[str, dict]]:
+        field = self._field(site, key)
+        raw = self.pending.get(field) or self.server.hget(self.key, field)
+        if not raw:
+            return None
+        digest, fields = json.loads(raw)
+        return digest, fields
+
+    def put(self, site, key, digest: str, fields: dict):
+        self.pending[self._field(site, key)] = json.dumps([digest, fields], separators=(",", ":"))
+        if len(self.pending) >= self.batch:
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            self.server.hset(self.key, mapping=self.pending)
+            self.pending = {}
+
+    def close(self):
+        self.flush()
+
+
+class SQLiteChangeStore:
+    # Same as RedisChangeStore in a local SQLite index, for single-node crawls
+    def __init__(self, path: str, batch: int = 500):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS item_state (site TEXT NOT NULL, item_key TEXT NOT NULL, "
+            "digest TEXT NOT NULL, fields TEXT, PRIMARY KEY (site, item_key)) WITHOUT ROWID"
+        )
+        self.conn.commit()
+        self.batch = batch
+        self.pending = {}
+
+    def get(self, site, key) -> Optional[Tuple[str, dict]]:
+        if (site or "", key) in self.pending:
+            digest, fields = self.pending[(site or "", key)]
+            return digest, json.loads(fields)
+        row = self.conn.execute(
+            "SELECT digest, fields FROM item_state WHERE site = ? AND item_key = ?", (site or "", key),
+        ).fetchone()
+        return (row[0], json.loads(row[1] or "{}")) if row else None
+
+    def put(self, site, key, digest: str, fields: dict):
+        self.pending[(site or "", key)] = (digest, json.dumps(fields, separators=(",", ":")))
+        if len(self.pending) >= self.batch:
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            with self.conn:
+                self.conn.executemany("INSERT OR REPLACE INTO item_state VALUES (?, ?, ?, ?)",
+                                      [(*k, *v) for k, v in self.pending.items()])
+            self.pending = {}
+
+    def close(self):
+        self.flush()
+        self.conn.close()
+
+
+class RedisChangeStream:
+    # Change events as entries of a capped Redis stream (XADD ... MAXLEN ~ maxlen)
+    def __init__(self, server, key: str, maxlen: int = 1_000_000):
+        self.server = server
+        self.key = key
+        self.maxlen = maxlen
+
+    def emit(self, event: dict):
+        self.server.xadd(self.key, {"event": json.dumps(event, separators=(",", ":"), default=str)},
+                         maxlen=self.maxlen, approximate=True)
+
+    def close(self):
+        pass
+
+
+class JSONLChangeStream:
+    # Change events appended one JSON object per line
+    def __init__(self, path: str):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.file = open(path, "a", encoding="utf-8")
+
+    def emit(self, event: dict):
+        self.file.write(json.dumps(event, separators=(",", ":"), default=str) + "\n")
+
+    def close(self):
+        self.file.close()
@@ -0,0 +1,198 @@
+import os
+import json
+import time
+import socket
+from typing import Optional
+
+import redis
+
+# Request meta that only describes one download attempt: the pooled page/context it
+# was given, timings, revisit state. A requeued request starts over without them
+# (and can't be serialized with a live Playwright page anyway).
+TRANSIENT_META = (
+    "playwright_page", "playwright_include_page", "playwright_context_kwargs", "pool_context",
+    "download_slot", "download_latency", "fetch_mode", "recrawl_state",
+)
+
+
+def checkpoint_enabled() -> bool:
+    return os.getenv("CHECKPOINT_ENABLED", "true").lower() == "true"
+
+
+def context_session(key: tuple) -> str:
+    """Session name of a pooled context key (site, pool key, slot); the proxy part of
+    the pool key is left out so a session survives proxy rotation."""
+    site, pool_key, slot = key
+    return f"{site}/{pool_key.partition('@')[0]}/{slot}"
+
+
+class SessionStore:
+    # Playwright storage states (cookies + localStorage, as returned by
+    # BrowserContext.storage_state()) in Redis, one key per name: a pooled context
+    # (site/base/slot, see context_session) or a whole site (the state right after a
+    # seed's login). Keys expire after ttl seconds, so a session the site has long
+    # forgotten is not restored forever.
+    def __init__(self, server, prefix: str, ttl: int = 86400):
+        self.server = server
+        self.prefix = prefix
+        self.ttl = ttl
+
+    def get(self, name: str) -> Optional[dict]:
+        raw = self.server.get(f"{self.prefix}:{name}")
+        return json.loads(raw) if raw else None
+
+    def put(self, name: str, state: dict):
+        self.server.set(f"{self.prefix}:{name}", json.dumps(state, separators=(",", ":")), ex=self.ttl or None)
+
+
+def session_store(server, spider_name: str) -> SessionStore:
+    return SessionStore(server, f"{spider_name}:session", ttl=int(float(os.getenv("SESSION_TTL_HOURS", "24")) * 3600))
+
+
+def requeue_copy(request):
+    """The request as it was before the downloader took it, for pushing back on the queue."""
+    meta = {k: v for k, v in request.meta.items() if k not in TRANSIENT_META}
+    if meta.pop("proxy_managed", False):
+        # Picked by ProxyRotationMiddleware; it picks again
+        meta.pop("proxy", None)
+    if "pool_base" in meta:
+        meta["playwright_context"] = meta["pool_base"]
+    meta["requeued"] = meta.get("requeued", 0) + 1
+    return request.replace(meta=meta)
+
+
+class InFlightLedger:
+    # Requests the downloader holds, recorded in Redis so that a crawler killed
+    # outright (OOM, SIGKILL, a drain that timed out) doesn't lose them. Each crawler
+    # process is an owner: it keeps its requests in the hash <queue>:inflight:<owner>
+    # and refreshes the lease <queue>:alive:<owner> (expires after ttl). reclaim()
+    # moves the requests of every owner whose lease ran out back onto the queue; the
+    # rename makes sure only one crawler gets them. A clean close hands back its own.
+    # Adds and removes are buffered and written with the lease refresh in one
+    # pipeline per flush(), so a request that comes and goes between two flushes
+    # never reaches Redis.
+    def __init__(self, server, queue, ttl: int = 60, owner: Optional[str] = None):
+        self.server = server
+        self.queue = queue
+        self.ttl = ttl
+        self.owner = owner or f"{socket.gethostname()}:{os.getpid()}"
+        self.owners_key = f"{queue.key}:owners"
+        self.key = self._key(self.owner)
+        self.entries = {}  # id(request) -> hash field
+        self.added = {}  # hash field -> request, not written yet
+        self.removed = set()  # hash fields to delete
+
+    def _key(self, owner: str) -> str:
+        return f"{self.queue.key}:inflight:{owner}"
+
+    def _lease(self, owner: str) -> str:
+        return f"{self.queue.key}:alive:{owner}"
+
+    def register(self):
+        self.heartbeat()
+        self.server.sadd(self.owners_key, self.owner)
+
+    def heartbeat(self):
+        self.server.set(self._lease(self.owner), "1", ex=self.ttl)
+
+    def add(self, request):
+        field = str(id(request))
+        self.added[field] = request
+        self.entries[id(request)] = field
+
+    def remove(self, request):
+        field = self.entries.pop(id(request), None)
+        if field is not None and self.added.pop(field, None) is None:
+            self.removed.add(field)
+
+    def flush(self):
+        """Write the buffered adds and removes and refresh the lease, in one round trip."""
+        with self.server.pipeline(transaction=False) as pipe:
+            # Deletes first: a new request may have been given the id of one that left
+            if self.removed:
+                pipe.hdel(self.key, *self.removed)
+            if self.added:
+                pipe.hset(self.key, mapping={
+                    field: self.queue._encode_request(requeue_copy(request))
+                    for field, request in self.added.items()
+                })
+            pipe.set(self._lease(self.owner), "1", ex=self.ttl)
+            pipe.execute()
+        self.added, self.removed = {}, set()
+
+    def reclaim(self) -> int:
+        """Requeue the requests of owners whose lease expired; returns how many."""
+        count = 0
+        for raw in self.server.smembers(self.owners_key):
+            owner = raw.decode()
+            if owner == self.owner or self.server.exists(self._lease(owner)):
+                continue
+            claimed = f"{self._key(owner)}:claimed:{self.owner}"
+            try:
+                self.server.rename(self._key(owner), claimed)
+            except redis.ResponseError:
+                pass  # nothing in flight, or another crawler got there first
+            else:
+                count += self._restore(claimed)
+            self.server.srem(self.owners_key, owner)
+        return count
+
+    def release(self) -> int:
+        """Requeue this owner's remaining requests and drop its lease."""
+        self.flush()
+        count = self._restore(self.key)
+        self.entries.clear()
+        self.server.delete(self._lease(self.owner))
+        self.server.srem(self.owners_key, self.owner)
+        return count
+
+    def _restore(self, key: str) -> int:
+        count = 0
+        for data in self.server.hvals(key):
+            try:
+                self.queue.push(self.queue._decode_request(data))
+            except Exception:
+                continue  # e.g. its callback no longer exists
+            count += 1
+        self.server.delete(key)
+        return count
+
+
+class SeedProgress:
+    # Per-seed progress in Redis hashes <prefix>:<seed_url>: listing and product pages
+    # done, items scraped, the last listing page and when the seed was last active.
+    # Counts are HINCRBYs, so every worker crawling a seed adds to the same hash.
+    # Updates are buffered and sent in one pipeline per flush().
+    def __init__(self, server, prefix: str):
+        self.server = server
+        self.prefix = prefix
+        self.counts = {}  # seed -> {field: increment}
+        self.fields = {}  # seed -> {field: value}
+
+    def page(self, seed: str, page_type: str, url: str):
+        counts = self.counts.setdefault(seed, {})
+        field = "listing_pages" if page_type == "listing" else "product_pages"
+        counts[field] = counts.get(field, 0) + 1
+        if page_type == "listing":
+            self.fields.setdefault(seed, {})["last_listing"] = url
+
+    def item(self, seed: str):
+        counts = self.counts.setdefault(seed, {})
+        counts["items"] = counts.get("items", 0) + 1
+
+    def get(self, seed: str) -> dict:
+        return {k.decode(): v.decode() for k, v in self.server.hgetall(f"{self.prefix}:{seed}").items()}
+
+    def flush(self):
+        seeds = set(self.counts) | set(self.fields)
+        if not seeds:
+            return
+        now = str(int(time.time()))
+        with self.server.pipeline(transaction=False) as pipe:
+            for seed in seeds:
+                key = f"{self.prefix}:{seed}"
+                for field, n in self.counts.get(seed, {}).items():
+                    pipe.hincrby(key, field, n)
+                pipe.hset(key, mapping={**self.fields.get(seed, {}), "updated_at": now})
+            pipe.execute()
+        self.counts, self.fields = {}, {}
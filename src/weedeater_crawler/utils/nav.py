@@ -2,12 +2,71 @@ from scrapy_playwright.page import PageMethod
 
 # Helpers for smart navigation and infinite scroll
 
-def infinite_scroll(max_rounds=10, scroll_delay=0.5):
+# Scrolls until the number of distinct product links stops growing. Each round waits
+# for the DOM to go quiet after the scroll (no mutations for quietMs) instead of a fixed
+# sleep, capped at idleMs when nothing changes at all. Returns per-listing stats, which
+# scrapy-playwright stores on the PageMethod's `result` (see scroll_stats).
+SCROLL_JS = """async ({maxRounds, idleMs, quietMs, stableRounds, patterns}) => {
+  const started = performance.now();
+  const links = () => {
+    const seen = new Set();
+    for (const a of document.querySelectorAll('a[href]')) {
+      if (patterns.some(p => a.href.includes(p))) seen.add(a.href);
+    }
+    return seen.size;
+  };
+  const settle = () => new Promise(resolve => {
+    let quiet = null, done = false;
+    const finish = () => {
+      if (done) return;
+      done = true;
+      observer.disconnect();
+      clearTimeout(quiet);
+      clearTimeout(limit);
+      resolve();
+    };
+    const observer = new MutationObserver(() => {
+      clearTimeout(quiet);
+      quiet = setTimeout(finish, quietMs);
+    });
+    observer.observe(document.body, {childList: true, subtree: true});
+    const limit = setTimeout(finish, idleMs);
+  });
+  const initial = links();
+  let count = initial, rounds = 0, stable = 0;
+  while (rounds < maxRounds && stable < stableRounds) {
+    rounds++;
+    const settled = settle();
+    window.scrollTo(0, document.body.scrollHeight);
+    await settled;
+    const now = links();
+    stable = now > count ? 0 : stable + 1;
+    count = now;
+  }
+  return {rounds, initial_links: initial, links: count, elapsed_ms: Math.round(performance.now() - started)};
+}"""
+
+
+def infinite_scroll(max_rounds=12, idle_ms=2000, quiet_ms=300, stable_rounds=2, link_patterns=("/product/", "/products/", "/p/")):
     return [
-        PageMethod("evaluate", "(max, delay) => new Promise(async res => {\n            let lastHeight = 0;\n            for (let i=0;i<max;i++){\n              await new Promise(r=>setTimeout(r, delay*1000));\n              await window.scrollTo(0, document.body.scrollHeight);\n              const h = document.body.scrollHeight;\n              if (h === lastHeight) break;\n              lastHeight = h;\n            }\n            res();\n          })", max_rounds, scroll_delay)
+        PageMethod("evaluate", SCROLL_JS, {
+            "maxRounds": max_rounds,
+            "idleMs": idle_ms,
+            "quietMs": quiet_ms,
+            "stableRounds": stable_rounds,
+            "patterns": list(link_patterns),
+        })
     ]
 
 
+def scroll_stats(meta):
+    # Result of the infinite_scroll evaluate call for a rendered request, or None
+    for method in meta.get("playwright_page_methods") or ():
+        if getattr(method, "method", None) == "evaluate" and method.args and method.args[0] == SCROLL_JS:
+            return getattr(method, "result", None)
+    return None
+
+
 def login_sequence(email: str, password: str, email_sel: str, pass_sel: str, submit_sel: str):
     return [
         PageMethod("fill", email_sel, email),
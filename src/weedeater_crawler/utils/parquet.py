@@ -0,0 +1,194 @@
+import os
+import re
+import json
+import time
+import logging
+from pathlib import Path
+from datetime import date, datetime, timezone
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+logger = logging.getLogger(__name__)
+
+# Files live under <root>/site=<site>/crawl_date=<YYYY-MM-DD>/ (Hive partitioning), so
+# site and crawl_date are path columns and not stored in the files. Low-cardinality
+# strings are Arrow dictionaries, specs a map<string, string>, price a number.
+_DICT = pa.dictionary(pa.int32(), pa.string())
+SCHEMA = pa.schema([
+    ("source_url", pa.string()),
+    ("crawled_at", pa.timestamp("us", tz="UTC")),
+    ("item_key", pa.string()),
+    ("brand", _DICT),
+    ("product_name", pa.string()),
+    ("sku", pa.string()),
+    ("upc", pa.string()),
+    ("category", _DICT),
+    ("price", pa.float64()),
+    ("currency", _DICT),
+    ("availability", _DICT),
+    ("description", pa.string()),
+    ("specs", pa.map_(pa.string(), pa.string())),
+    ("images", pa.list_(pa.string())),
+    ("breadcrumbs", pa.list_(_DICT)),
+    ("raw_html_path", pa.string()),
+])
+DICTIONARY_COLUMNS = ["brand", "category", "currency", "availability", "breadcrumbs"]
+PARTITION_COLUMNS = ("site", "crawl_date")
+IN_PROGRESS = ".inprogress"
+_PRICE = re.compile(r"-?\d[\d,]*(?:\.\d+)?")
+_UNSAFE = re.compile(r"[^A-Za-z0-9._-]")
+
+
+def parse_price(value) -> Optional[float]:
+    if value is None or isinstance(value, (int, float)):
+        return value
+    match = _PRICE.search(str(value))
+    return float(match.group().replace(",", "")) if match else None
+
+
+def parse_time(value) -> datetime:
+    if isinstance(value, datetime):
+        return value
+    try:
+        parsed = datetime.fromisoformat(str(value))
+    except (TypeError, ValueError):
+        return datetime.now(timezone.utc)
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def to_row(item, key: str) -> Tuple[Tuple[str, date], dict]:
+    """((site, crawl_date), row) for a ProductItem."""
+    crawled_at = parse_time(item.get("crawled_at"))
+    specs = item.get("specs") or {}
+    row = {
+        "source_url": item.get("source_url"),
+        "crawled_at": crawled_at,
+        "item_key": key,
+        "brand": item.get("brand"),
+        "product_name": item.get("product_name"),
+        "sku": item.get("sku"),
+        "upc": item.get("upc"),
+        "category": item.get("category"),
+        "price": parse_price(item.get("price")),
+        "currency": item.get("currency"),
+        "availability": item.get("availability"),
+        "description": item.get("description"),
+        "specs": [(str(k), v if isinstance(v, str) or v is None else json.dumps(v, default=str))
+                  for k, v in specs.items()] if isinstance(specs, dict) else None,
+        "images": list(item.get("images") or []),
+        "breadcrumbs": list(item.get("breadcrumbs") or []),
+        "raw_html_path": item.get("raw_html_path"),
+    }
+    return (item.get("site") or "unknown", crawled_at.date()), row
+
+
+def partition_dir(root: Path, site: str, crawl_date) -> Path:
+    return Path(root) / f"site={_UNSAFE.sub('_', site)}" / f"crawl_date={crawl_date}"
+
+
+def open_writer(path: Path, compression: str = "zstd") -> pq.ParquetWriter:
+    return pq.ParquetWriter(str(path), SCHEMA, compression=compression,
+                            use_dictionary=DICTIONARY_COLUMNS + ["source_url", "raw_html_path"])
+
+
+class PartitionedParquetWriter:
+    # Streams rows into one open file per (site, crawl_date) partition: each batch
+    # handed to write() becomes row groups of at most row_group_size rows, so only the
+    # callers' per-partition buffers are held in memory. Files roll over after
+    # max_file_rows rows, at most max_open files stay open (least recently written
+    # closed first), and a file is written as <name>.inprogress and renamed on close,
+    # so readers and compaction only ever see finished files. Not thread-safe: the
+    # pipeline drives it from a single worker thread.
+    def __init__(self, root: str, prefix: str = "part", row_group_size: int = 10_000,
+                 max_file_rows: int = 1_000_000, max_open: int = 32, compression: str = "zstd"):
+        self.root = Path(root)
+        self.prefix = prefix
+        self.row_group_size = row_group_size
+        self.max_file_rows = max_file_rows
+        self.max_open = max_open
+        self.compression = compression
+        self.files: Dict[tuple, list] = {}  # partition -> [writer, path, rows written]
+        self.seq = 0
+
+    def write(self, partition: tuple, rows: List[dict]):
+        for start in range(0, len(rows), self.row_group_size):
+            chunk = rows[start:start + self.row_group_size]
+            entry = self.files.pop(partition, None) or self._open(partition)
+            self.files[partition] = entry  # most recently written last
+            entry[0].write_table(pa.Table.from_pylist(chunk, schema=SCHEMA), row_group_size=self.row_group_size)
+            entry[2] += len(chunk)
+            if entry[2] >= self.max_file_rows:
+                self._close(partition)
+
+    def _open(self, partition: tuple) -> list:
+        while len(self.files) >= self.max_open:
+            self._close(next(iter(self.files)))
+        directory = partition_dir(self.root, *partition)
+        directory.mkdir(parents=True, exist_ok=True)
+        self.seq += 1
+        name = f"{self.prefix}-{time.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}-{self.seq:05d}.parquet"
+        path = directory / name
+        return [open_writer(path.with_name(name + IN_PROGRESS), self.compression), path, 0]
+
+    def _close(self, partition: tuple):
+        writer, path, _rows = self.files.pop(partition)
+        writer.close()
+        os.replace(path.with_name(path.name + IN_PROGRESS), path)
+
+    def close(self):
+        for partition in list(self.files):
+            self._close(partition)
+
+
+def partitions(root: str) -> Iterator[Path]:
+    """Leaf partition directories (site=*/crawl_date=*) under root."""
+    for site_dir in sorted(Path(root).glob("site=*")):
+        for date_dir in sorted(site_dir.glob("crawl_date=*")):
+            if date_dir.is_dir():
+                yield date_dir
+
+
+def compact_partition(directory: Path, target_bytes: int = 256 * 1024 * 1024, row_group_size: int = 100_000,
+                      compression: str = "zstd", batch_rows: int = 65_536) -> Tuple[int, int]:
+    """Merge a partition's finished files into files of about target_bytes.
+
+    Streams record batches, so memory stays around one row group. Inputs are deleted
+    once every output has been renamed into place. Returns (files in, files out).
+    """
+    # Files already at the target size are left alone
+    inputs = sorted(p for p in directory.glob("*.parquet") if p.stat().st_size < target_bytes)
+    if len(inputs) < 2:
+        return len(inputs), len(inputs)
+    outputs, writer, path, written, pending = [], None, None, 0, []
+    stamp = time.strftime('%Y%m%dT%H%M%S')
+
+    def flush(final=False):
+        nonlocal writer, path, written, pending
+        if pending:
+            table = pa.Table.from_batches(pending, schema=SCHEMA)
+            writer.write_table(table, row_group_size=row_group_size)
+            pending = []
+        if final or (writer is not None and os.path.getsize(path.with_name(path.name + IN_PROGRESS)) >= target_bytes):
+            writer.close()
+            outputs.append(path)
+            writer, written = None, 0
+
+    for source in inputs:
+        for batch in pq.ParquetFile(source).iter_batches(batch_size=batch_rows):
+            if writer is None:
+                path = directory / f"compacted-{stamp}-{os.getpid()}-{len(outputs):04d}.parquet"
+                writer = open_writer(path.with_name(path.name + IN_PROGRESS), compression)
+            pending.append(batch.cast(SCHEMA) if batch.schema != SCHEMA else batch)
+            written += batch.num_rows
+            if written >= row_group_size:
+                written = 0
+                flush()
+    if writer is not None:
+        flush(final=True)
+    for path in outputs:
+        os.replace(path.with_name(path.name + IN_PROGRESS), path)
+    for source in inputs:
+        source.unlink()
+    return len(inputs), len(outputs)
@@ -0,0 +1,50 @@
+import os
+from typing import List, Optional
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def process_tree(root_pid: Optional[int] = None) -> Optional[List[int]]:
+    """Pids of root_pid's descendants, from /proc. None when /proc is unavailable."""
+    root_pid = root_pid or os.getpid()
+    children = {}
+    try:
+        pids = [int(p) for p in os.listdir("/proc") if p.isdigit()]
+    except OSError:
+        return None
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/stat", "rb") as f:
+                stat = f.read()
+        except OSError:
+            continue
+        # comm may contain spaces/parens; fields resume after the last ')'
+        ppid = int(stat[stat.rindex(b")") + 2:].split()[1])
+        children.setdefault(ppid, []).append(pid)
+    tree, stack = [], list(children.get(root_pid, ()))
+    while stack:
+        pid = stack.pop()
+        tree.append(pid)
+        stack.extend(children.get(pid, ()))
+    return tree
+
+
+def process_tree_rss(root_pid: Optional[int] = None, include_root: bool = False) -> Optional[int]:
+    """Summed RSS of root_pid's descendants (the Playwright driver and Chromium) from /proc,
+    plus root_pid itself with include_root.
+
+    Shared pages are counted once per process, so this overstates the true footprint
+    a little; it is only compared against a budget. None when /proc is unavailable.
+    """
+    root_pid = root_pid or os.getpid()
+    pids = process_tree(root_pid)
+    if pids is None:
+        return None
+    total = 0
+    for pid in [root_pid] + pids if include_root else pids:
+        try:
+            with open(f"/proc/{pid}/statm", "rb") as f:
+                total += int(f.read().split()[1]) * _PAGE_SIZE
+        except OSError:
+            continue
+    return total
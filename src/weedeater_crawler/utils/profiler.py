@@ -0,0 +1,70 @@
+import sys
+import time
+import threading
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+from urllib.parse import parse_qs, urlsplit
+
+MAX_SECONDS = 120.0
+
+
+def sample_stacks(seconds: float = 10.0, interval: float = 0.005, thread_id: Optional[int] = None) -> Counter:
+    """Sample every thread's Python stack for `seconds`.
+
+    Returns collapsed stacks ("thread;outer;...;inner" -> samples), the input format of
+    flamegraph.pl / speedscope. Sampling runs in the calling thread, so the profiled
+    threads pay only for sys._current_frames() while the GIL is held.
+    """
+    me = threading.get_ident()
+    names = {t.ident: t.name for t in threading.enumerate()}
+    stacks = Counter()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        for ident, frame in sys._current_frames().items():
+            if ident == me or (thread_id is not None and ident != thread_id):
+                continue
+            calls = []
+            while frame is not None:
+                code = frame.f_code
+                calls.append(f"{code.co_name} ({code.co_filename.rsplit('/', 1)[-1]}:{frame.f_lineno})")
+                frame = frame.f_back
+            calls.append(names.get(ident, str(ident)))
+            stacks[";".join(reversed(calls))] += 1
+        time.sleep(interval)
+    return stacks
+
+
+class _ProfileHandler(BaseHTTPRequestHandler):
+    # GET /profile?seconds=10[&interval=0.005][&thread=main] -> collapsed stacks
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        if parts.path != "/profile":
+            self.send_error(404)
+            return
+        query = parse_qs(parts.query)
+        try:
+            seconds = min(float(query.get("seconds", ["10"])[0]), MAX_SECONDS)
+            interval = max(float(query.get("interval", ["0.005"])[0]), 0.001)
+        except ValueError:
+            self.send_error(400, "seconds and interval must be numbers")
+            return
+        thread_id = threading.main_thread().ident if query.get("thread") == ["main"] else None
+        stacks = sample_stacks(seconds, interval, thread_id)
+        body = "".join(f"{stack} {count}\n" for stack, count in stacks.most_common()).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_profiler_server(port: int, addr: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """Serve /profile on a daemon thread. Bound to localhost unless addr says otherwise."""
+    server = ThreadingHTTPServer((addr, port), _ProfileHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="profiler", daemon=True).start()
+    return server
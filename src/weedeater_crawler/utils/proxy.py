@@ -1,15 +1,222 @@
 import os
+import time
 import random
+from typing import Optional
+from urllib.parse import urlsplit
 
-_PROXY_POOL = None
-
-def get_proxy():
-    global _PROXY_POOL
-    pool = os.getenv("PROXY_POOL", "").strip()
-    if not pool:
-        return None
-    if _PROXY_POOL is None:
-        _PROXY_POOL = [p.strip() for p in pool.split(",") if p.strip()]
-    if not _PROXY_POOL:
-        return None
-    return random.choice(_PROXY_POOL)
+from prometheus_client import Counter, Gauge
+
+PROXY_REQUESTS = Counter('proxy_requests', 'Requests per proxy by outcome', ['proxy', 'outcome'])
+PROXY_LATENCY = Gauge('proxy_latency_seconds', 'Latency EWMA per proxy', ['proxy'], multiprocess_mode='livemax')
+PROXY_SCORE = Gauge('proxy_score', 'Success-rate EWMA per proxy', ['proxy'], multiprocess_mode='livemin')
+PROXY_EJECTED = Gauge('proxy_ejected', '1 while a proxy is ejected from the pool', ['proxy'],
+                       multiprocess_mode='livemax')
+PROXY_EJECTIONS = Counter('proxy_ejections', 'Proxy ejections', ['proxy', 'scope'])
+PROXY_POOL_SIZE = Gauge('proxy_pool_size', 'Proxies currently loaded', multiprocess_mode='livemax')
+
+# Substrings of block/captcha interstitials served with a 200
+BAN_MARKERS = (b"g-recaptcha", b"h-captcha", b"cf-chl-", b"px-captcha", b"captcha-delivery", b"/captcha/")
+
+
+def proxy_label(proxy: str) -> str:
+    """scheme://host:port, i.e. the proxy URL without credentials (for logs and metric labels)."""
+    parts = urlsplit(proxy)
+    host = parts.hostname or ""
+    return f"{parts.scheme}://{host}:{parts.port}" if parts.port else f"{parts.scheme}://{host}"
+
+
+def playwright_proxy(proxy: str) -> dict:
+    """Proxy URL in the form Playwright's browser.new_context(proxy=...) expects."""
+    parts = urlsplit(proxy)
+    settings = {"server": proxy_label(proxy)}
+    if parts.username:
+        settings["username"] = parts.username
+        settings["password"] = parts.password or ""
+    return settings
+
+
+def is_banned(status: int, body: bytes) -> bool:
+    if status in (403, 429):
+        return True
+    head = body[:200_000]
+    return status == 200 and any(marker in head for marker in BAN_MARKERS)
+
+
+class _Health:
+    __slots__ = ("score", "latency", "failures", "ejected_until", "backoff", "probing")
+
+    def __init__(self):
+        self.score = 1.0
+        self.latency = None
+        self.failures = 0
+        self.ejected_until = 0.0
+        self.backoff = 0.0
+        self.probing = False
+
+
+class ProxyManager:
+    # Health-scored proxy pool. Every proxy has a success-rate EWMA and a latency EWMA
+    # overall and per target domain; choose() picks at random weighted by
+    # score_proxy * score_domain / latency. After eject_after consecutive failures a
+    # proxy is ejected (globally for connection errors, for that domain only on
+    # 403/429/captcha bans) for eject_base seconds, doubling per ejection up to
+    # eject_max. When that expires it is re-probed with a single request: success
+    # restores it, failure ejects it again. Sessions (e.g. a site that pins cookies
+    # to an exit IP) stick to one proxy for sticky_ttl seconds while it is healthy;
+    # a ban through it unpins the session, so its next request (the retry) picks
+    # another one.
+    # The list reloads every reload_interval seconds from a file (one URL per line)
+    # or a Redis set, keeping the health of proxies still listed.
+    def __init__(self, proxies=(), server=None, redis_key: Optional[str] = None, path: Optional[str] = None,
+                 reload_interval: float = 30.0, eject_after: int = 3, eject_base: float = 60.0,
+                 eject_max: float = 1800.0, sticky_ttl: float = 600.0, alpha: float = 0.2):
+        self.static = [p for p in proxies if p]
+        self.server = server
+        self.redis_key = redis_key
+        self.path = path
+        self.reload_interval = reload_interval
+        self.eject_after = eject_after
+        self.eject_base = eject_base
+        self.eject_max = eject_max
+        self.sticky_ttl = sticky_ttl
+        self.alpha = alpha
+        self.proxies = []
+        self.health = {}   # proxy -> _Health
+        self.domains = {}  # (proxy, domain) -> _Health
+        self.sessions = {}  # session -> (proxy, expires)
+        self._loaded_at = 0.0
+        self._mtime = None
+        self._file = []
+        self.reload()
+
+    @classmethod
+    def from_env(cls, server=None):
+        """Manager configured from PROXY_POOL / PROXY_FILE / PROXY_REDIS_KEY, or None without proxies."""
+        pool = [p.strip() for p in os.getenv("PROXY_POOL", "").split(",") if p.strip()]
+        path = os.getenv("PROXY_FILE") or None
+        redis_key = os.getenv("PROXY_REDIS_KEY") or None
+        if not (pool or path or redis_key):
+            return None
+        return cls(
+            pool, server=server if redis_key else None, redis_key=redis_key, path=path,
+            reload_interval=float(os.getenv("PROXY_RELOAD_SECONDS", "30")),
+            eject_after=int(os.getenv("PROXY_EJECT_AFTER", "3")),
+            eject_base=float(os.getenv("PROXY_EJECT_SECONDS", "60")),
+            eject_max=float(os.getenv("PROXY_EJECT_MAX_SECONDS", "1800")),
+            sticky_ttl=float(os.getenv("PROXY_STICKY_SECONDS", "600")),
+        )
+
+    def reload(self, now: Optional[float] = None):
+        self._loaded_at = now or time.time()
+        if self.path:
+            try:
+                mtime = os.path.getmtime(self.path)
+                if mtime != self._mtime:
+                    with open(self.path, "r", encoding="utf-8") as f:
+                        self._file = [line.strip() for line in f if line.strip() and not line.startswith("#")]
+                    self._mtime = mtime
+            except OSError:
+                pass
+        proxies = self.static + self._file
+        if self.server is not None and self.redis_key:
+            proxies += sorted(p.decode() if isinstance(p, bytes) else p for p in self.server.smembers(self.redis_key))
+        proxies = list(dict.fromkeys(proxies))
+        if proxies == self.proxies:
+            return
+        current = set(proxies)
+        for proxy in list(self.health):
+            if proxy not in current:
+                del self.health[proxy]
+                PROXY_EJECTED.labels(proxy=proxy_label(proxy)).set(0)
+        self.domains = {k: v for k, v in self.domains.items() if k[0] in current}
+        self.proxies = proxies
+        PROXY_POOL_SIZE.set(len(proxies))
+
+    def _health(self, proxy: str, domain: Optional[str] = None) -> _Health:
+        table, key = (self.health, proxy) if domain is None else (self.domains, (proxy, domain))
+        health = table.get(key)
+        if health is None:
+            health = table[key] = _Health()
+        return health
+
+    def _available(self, health: _Health, now: float) -> bool:
+        if health.ejected_until <= 0:
+            return True
+        # Half-open: one probe request once the ejection has expired
+        return health.ejected_until <= now and not health.probing
+
+    def choose(self, domain: str, session: Optional[str] = None, avoid: Optional[str] = None,
+               now: Optional[float] = None) -> Optional[str]:
+        """A proxy for the domain; `avoid` (the proxy a retried request failed through) is
+        only picked again when nothing else is available."""
+        now = now or time.time()
+        if now - self._loaded_at >= self.reload_interval:
+            self.reload(now)
+        if not self.proxies:
+            return None
+        if session is not None:
+            sticky = self.sessions.get(session)
+            if sticky and sticky[1] > now and sticky[0] in self.health and \
+                    self._health(sticky[0]).ejected_until <= 0 and self._health(sticky[0], domain).ejected_until <= 0:
+                self.sessions[session] = (sticky[0], now + self.sticky_ttl)
+                return sticky[0]
+        known = [h.latency for h in self.health.values() if h.latency]
+        default_latency = sum(known) / len(known) if known else 1.0
+        candidates, weights = [], []
+        for proxy in self.proxies:
+            overall, per_domain = self._health(proxy), self._health(proxy, domain)
+            if proxy == avoid or not (self._available(overall, now) and self._available(per_domain, now)):
+                continue
+            latency = per_domain.latency or overall.latency or default_latency
+            candidates.append(proxy)
+            weights.append(max(overall.score * per_domain.score, 0.01) / max(latency, 0.05))
+        if not candidates and avoid in self.proxies and \
+                self._available(self._health(avoid), now) and self._available(self._health(avoid, domain), now):
+            proxy = avoid
+        elif not candidates:
+            # Everything is ejected: fall back to the proxy whose ejection ends first
+            proxy = min(self.proxies, key=lambda p: max(self._health(p).ejected_until,
+                                                        self._health(p, domain).ejected_until))
+        else:
+            proxy = random.choices(candidates, weights)[0]
+        for health in (self._health(proxy), self._health(proxy, domain)):
+            if health.ejected_until > 0 and health.ejected_until <= now:
+                health.probing = True
+        if session is not None:
+            self.sessions[session] = (proxy, now + self.sticky_ttl)
+        return proxy
+
+    def record(self, proxy: str, domain: str, ok: bool, latency: Optional[float] = None,
+               banned: bool = False, session: Optional[str] = None, now: Optional[float] = None):
+        now = now or time.time()
+        if banned and session is not None and self.sessions.get(session, (None,))[0] == proxy:
+            del self.sessions[session]
+        if proxy not in self.health:
+            return
+        label = proxy_label(proxy)
+        overall, per_domain = self._health(proxy), self._health(proxy, domain)
+        # A ban says nothing about the proxy's health for other domains
+        scopes = ((per_domain, "domain"),) if banned else ((overall, "proxy"), (per_domain, "domain"))
+        for health, scope in scopes:
+            health.score += self.alpha * ((1.0 if ok else 0.0) - health.score)
+            if ok:
+                if latency is not None:
+                    health.latency = latency if health.latency is None else \
+                        health.latency + self.alpha * (latency - health.latency)
+                health.failures = 0
+                health.ejected_until = 0.0
+                health.backoff = 0.0
+                health.probing = False
+                continue
+            health.failures += 1
+            if health.probing or health.failures >= self.eject_after:
+                health.backoff = min(self.eject_max, health.backoff * 2 if health.backoff else self.eject_base)
+                health.ejected_until = now + health.backoff
+                health.probing = False
+                health.failures = 0
+                PROXY_EJECTIONS.labels(proxy=label, scope=scope).inc()
+        PROXY_REQUESTS.labels(proxy=label, outcome="ok" if ok else ("banned" if banned else "error")).inc()
+        PROXY_SCORE.labels(proxy=label).set(overall.score)
+        PROXY_EJECTED.labels(proxy=label).set(1 if overall.ejected_until > now else 0)
+        if overall.latency is not None:
+            PROXY_LATENCY.labels(proxy=label).set(overall.latency)
@@ -0,0 +1,152 @@
+import time
+from datetime import timezone
+from email.utils import parsedate_to_datetime
+from typing import Optional
+
+
+def parse_retry_after(value, now: Optional[float] = None) -> Optional[float]:
+    """Seconds to wait from a Retry-After header: delta-seconds or an HTTP-date."""
+    if not value:
+        return None
+    if isinstance(value, bytes):
+        value = value.decode("latin-1")
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    now = now if now is not None else time.time()
+    return max(0.0, when.timestamp() - now)
+
+
+class SlotState:
+    __slots__ = ("concurrency", "delay", "blocked_until", "latency", "baseline",
+                 "penalized_at", "synced_at")
+
+    def __init__(self, concurrency: float, delay: float):
+        self.concurrency = concurrency
+        self.delay = delay
+        self.blocked_until = 0.0
+        self.latency = None
+        self.baseline = None
+        self.penalized_at = 0.0
+        self.synced_at = 0.0
+
+    @property
+    def rate(self) -> float:
+        """Requests/s currently allowed: bounded by the delay and by concurrency / latency."""
+        limits = []
+        if self.delay > 0:
+            limits.append(1.0 / self.delay)
+        if self.latency:
+            limits.append(self.concurrency / self.latency)
+        return min(limits) if limits else 0.0
+
+
+class RateController:
+    # AIMD congestion control per downloader slot (one per domain by default).
+    # - 429/503: concurrency halves, the delay doubles (at least backoff_floor), and the
+    #   slot is blocked until Retry-After (or one delay) has passed.
+    # - latency: an EWMA above latency_factor x the slot's baseline cuts concurrency
+    #   by a quarter, at most once per cooldown.
+    # - otherwise each fast response adds 1/concurrency to concurrency (about +1 per
+    #   window) and rate_step req/s to the delay-bound rate.
+    # Penalties are published to a Redis hash per slot; every node merges them on its
+    # next sync, so one node's ban slows the whole fleet. Recovery stays local.
+    def __init__(self, server=None, key_prefix: str = "weedeater:ratelimit",
+                 min_delay: float = 0.0, max_delay: float = 60.0, backoff_floor: float = 1.0,
+                 min_concurrency: float = 1.0, max_concurrency: float = 8.0,
+                 latency_factor: float = 3.0, rate_step: float = 0.1,
+                 sync_interval: float = 5.0, max_retry_after: float = 900.0, cooldown: float = 1.0):
+        self.server = server
+        self.key_prefix = key_prefix
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.backoff_floor = backoff_floor
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.latency_factor = latency_factor
+        self.rate_step = rate_step
+        self.sync_interval = sync_interval
+        self.max_retry_after = max_retry_after
+        self.cooldown = cooldown
+        self.slots = {}
+
+    def state(self, slot: str) -> SlotState:
+        state = self.slots.get(slot)
+        if state is None:
+            state = self.slots[slot] = SlotState(self.max_concurrency, self.min_delay)
+        return state
+
+    def wait_time(self, slot: str, now: Optional[float] = None) -> float:
+        now = now if now is not None else time.time()
+        state = self.state(slot)
+        if self.server is not None and now - state.synced_at >= self.sync_interval:
+            self._sync(slot, state, now)
+        return max(0.0, state.blocked_until - now)
+
+    def throttled(self, slot: str, retry_after: Optional[float] = None, now: Optional[float] = None) -> SlotState:
+        now = now if now is not None else time.time()
+        state = self.state(slot)
+        state.concurrency = max(self.min_concurrency, state.concurrency / 2)
+        state.delay = min(self.max_delay, max(state.delay * 2, self.backoff_floor))
+        wait = min(retry_after, self.max_retry_after) if retry_after is not None else state.delay
+        state.blocked_until = max(state.blocked_until, now + wait)
+        state.penalized_at = now
+        if self.server is not None:
+            self._publish(slot, state, wait)
+        return state
+
+    def observe(self, slot: str, latency: float, now: Optional[float] = None) -> SlotState:
+        now = now if now is not None else time.time()
+        state = self.state(slot)
+        state.latency = latency if state.latency is None else 0.8 * state.latency + 0.2 * latency
+        if state.baseline is None or state.latency < state.baseline:
+            state.baseline = state.latency
+        else:
+            # Let the baseline drift up slowly so a permanently slower site isn't
+            # treated as congested forever
+            state.baseline += (state.latency - state.baseline) * 0.01
+        if state.latency > self.latency_factor * state.baseline:
+            if now - state.penalized_at >= self.cooldown:
+                state.concurrency = max(self.min_concurrency, state.concurrency * 0.75)
+                state.penalized_at = now
+            return state
+        state.concurrency = min(self.max_concurrency, state.concurrency + 1.0 / state.concurrency)
+        if state.delay > self.min_delay:
+            state.delay = max(self.min_delay, 1.0 / (1.0 / state.delay + self.rate_step))
+        return state
+
+    def _key(self, slot: str) -> str:
+        return f"{self.key_prefix}:{slot}"
+
+    def _publish(self, slot: str, state: SlotState, wait: float):
+        key = self._key(slot)
+        pipe = self.server.pipeline(transaction=False)
+        pipe.hset(key, mapping={
+            "blocked_until": state.blocked_until,
+            "delay": state.delay,
+            "concurrency": state.concurrency,
+            "penalized_at": state.penalized_at,
+        })
+        pipe.expire(key, int(max(wait, self.max_delay, self.sync_interval) * 4) + 1)
+        pipe.execute()
+
+    def _sync(self, slot: str, state: SlotState, now: float):
+        state.synced_at = now
+        remote = self.server.hgetall(self._key(slot))
+        if not remote:
+            return
+        remote = {k.decode() if isinstance(k, bytes) else k: float(v) for k, v in remote.items()}
+        state.blocked_until = max(state.blocked_until, remote.get("blocked_until", 0.0))
+        # Adopt another node's penalty once; afterwards this node recovers on its own
+        if remote.get("penalized_at", 0.0) > state.penalized_at:
+            state.penalized_at = remote["penalized_at"]
+            state.delay = max(state.delay, remote.get("delay", 0.0))
+            state.concurrency = min(state.concurrency, remote.get("concurrency", state.concurrency))
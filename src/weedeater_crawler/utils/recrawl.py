@@ -0,0 +1,89 @@
+import re
+import json
+import time
+import hashlib
+from typing import Optional
+
+from w3lib.url import canonicalize_url
+
+# Markup that changes on every response without the product changing: inline scripts
+# (JSON-LD is kept, it carries price/availability), styles, comments and CSRF inputs.
+_VOLATILE = re.compile(
+    rb"<script\b(?![^>]*ld\+json)[^>]*>.*?</script>"
+    rb"|<style\b[^>]*>.*?</style>"
+    rb"|<!--.*?-->"
+    rb"|<input\b[^>]*name=[\"']?(?:csrf[^\"' >]*|authenticity_token|__RequestVerificationToken)[^>]*>",
+    re.S | re.I,
+)
+_WHITESPACE = re.compile(rb"\s+")
+_BETWEEN_TAGS = re.compile(rb">\s+<")
+
+
+def content_hash(body: bytes) -> str:
+    """Hash of the page body with volatile markup removed and whitespace collapsed."""
+    text = _BETWEEN_TAGS.sub(b"><", _VOLATILE.sub(b"", body))
+    return hashlib.sha256(_WHITESPACE.sub(b" ", text).strip()).hexdigest()
+
+
+def recrawl_key(url: str) -> str:
+    return hashlib.sha1(canonicalize_url(url).encode("utf-8")).hexdigest()
+
+
+class RecrawlStore:
+    # Per-URL revisit state kept in one Redis hash next to the dupefilter set:
+    # validators (ETag/Last-Modified), normalized content hash, body length, and an
+    # adaptive revisit interval that halves when a page changes and grows by half
+    # when it doesn't, clamped to [min_interval, max_interval]. A due URL is claimed
+    # through a short-lived <key>:claim:<url hash> key (SET NX), so of the crawlers
+    # that find it due at the same time only one revisits it.
+    def __init__(self, server, key: str, initial_interval: float = 86400.0,
+                 min_interval: float = 3600.0, max_interval: float = 30 * 86400.0, claim_ttl: int = 60):
+        self.server = server
+        self.key = key
+        self.initial_interval = initial_interval
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.claim_ttl = claim_ttl
+
+    def get(self, url: str) -> Optional[dict]:
+        raw = self.server.hget(self.key, recrawl_key(url))
+        return json.loads(raw) if raw else None
+
+    def put(self, url: str, state: dict):
+        self.server.hset(self.key, recrawl_key(url), json.dumps(state, separators=(",", ":")))
+
+    def claim_if_due(self, url: str, now: Optional[float] = None) -> bool:
+        """True if url is due for a revisit and this caller claimed it; pushes next_due out
+        so later callers see it claimed."""
+        now = now or time.time()
+        state = self.get(url) or {}
+        if state.get("next_due", 0) > now:
+            return False
+        # The claim only has to outlive the next_due update below
+        if not self.server.set(f"{self.key}:claim:{recrawl_key(url)}", 1, nx=True, ex=self.claim_ttl):
+            return False
+        # Read again: another crawler may have claimed and released it since
+        state = self.get(url) or {}
+        if state.get("next_due", 0) > now:
+            return False
+        state["next_due"] = now + state.get("interval", self.initial_interval)
+        self.put(url, state)
+        return True
+
+    def record(self, url: str, changed: bool, etag: Optional[str] = None, last_modified: Optional[str] = None,
+               digest: Optional[str] = None, length: Optional[int] = None, now: Optional[float] = None) -> dict:
+        now = now or time.time()
+        state = self.get(url) or {}
+        interval = state.get("interval", self.initial_interval)
+        if "checked_at" in state:
+            interval = interval * 0.5 if changed else interval * 1.5
+        state["interval"] = min(self.max_interval, max(self.min_interval, interval))
+        state["checked_at"] = now
+        state["next_due"] = now + state["interval"]
+        if changed:
+            state["changed_at"] = now
+        for name, value in (("etag", etag), ("last_modified", last_modified), ("hash", digest), ("length", length)):
+            if value is not None:
+                state[name] = value
+        self.put(url, state)
+        return state
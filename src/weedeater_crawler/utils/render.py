@@ -0,0 +1,62 @@
+import re
+from urllib.parse import urlparse
+
+import tldextract
+
+# Fetch paths chosen by the hybrid download handler
+STATIC = "http"
+RENDER = "render"
+
+_DIGITS = re.compile(r"\d+")
+
+
+def url_template(url: str) -> str:
+    # Collapse a URL to its page template: keep the top-level section, mask the
+    # rest so /p/Some-Trimmer/123 and /p/Other-Trimmer/456 share one entry.
+    parsed = urlparse(url)
+    parts = [p for p in parsed.path.split("/") if p]
+    if not parts:
+        return "/"
+    template = "/" + _DIGITS.sub("#", parts[0].lower()) + "/*" * (len(parts) - 1)
+    if parsed.query:
+        template += "?"
+    return template
+
+
+class RenderDecisionCache:
+    # Remembers whether a (site, callback, URL template) needs a browser render.
+    # A decision is locked once `min_samples` consecutive fetches agree; a locked
+    # render decision still retries plain HTTP every `reprobe_every` requests in
+    # case the site changed templates.
+    def __init__(self, min_samples: int = 3, reprobe_every: int = 200):
+        self.min_samples = min_samples
+        self.reprobe_every = reprobe_every
+        self._streaks = {}
+        self._decisions = {}
+        self._hits = {}
+
+    def key_for(self, request):
+        site = request.meta.get("site") or tldextract.extract(request.url).registered_domain
+        callback = getattr(request.callback, "__name__", None) or "parse"
+        return site, callback, url_template(request.url)
+
+    def get(self, key):
+        decision = self._decisions.get(key)
+        if decision == RENDER and self.reprobe_every:
+            self._hits[key] = self._hits.get(key, 0) + 1
+            if self._hits[key] % self.reprobe_every == 0:
+                return None
+        return decision
+
+    def record(self, key, outcome: str):
+        last, streak = self._streaks.get(key, (None, 0))
+        streak = streak + 1 if last == outcome else 1
+        self._streaks[key] = (outcome, streak)
+        if streak >= self.min_samples:
+            self._decisions[key] = outcome
+        elif self._decisions.get(key) not in (None, outcome):
+            # The template stopped behaving like its cached decision; relearn it
+            self._decisions.pop(key, None)
+
+    def snapshot(self):
+        return dict(self._decisions)
@@ -0,0 +1,88 @@
+import os
+import json
+import zlib
+import logging
+from pathlib import Path
+from typing import Optional, Tuple
+from urllib.parse import urlsplit
+
+import tldextract
+import yaml
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SEEDS_PATH = Path(__file__).resolve().parents[3] / "seeds" / "weedeater_targets.yaml"
+START_URLS_KEY = "weedeater:start_urls"
+
+
+def seeds_path() -> Path:
+    return Path(os.getenv("WEEDEATER_SEEDS_PATH", str(DEFAULT_SEEDS_PATH)))
+
+
+def load_seeds(path: Optional[Path] = None, log: Optional[logging.Logger] = None) -> list:
+    """Seed entries from weedeater_targets.yaml (or WEEDEATER_SEEDS_PATH); [] when unreadable."""
+    path = Path(path) if path else seeds_path()
+    log = log or logger
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return yaml.safe_load(f) or []
+    except FileNotFoundError:
+        log.error(f"Seeds file not found at {path}")
+    except yaml.YAMLError as e:
+        log.error(f"Failed to parse YAML from {path}: {e}")
+    except (IOError, OSError) as e:
+        log.error(f"Failed to read seeds file at {path}: {e}")
+    return []
+
+
+def site_for_url(url: str, sites) -> str:
+    """The seed site owning url's host (parent domains included), else its registered domain."""
+    host = (urlsplit(url).hostname or "").lower()
+    suffix = host
+    while suffix:
+        if suffix in sites:
+            return suffix
+        suffix = suffix.partition(".")[2]
+    return tldextract.extract(url).registered_domain or host
+
+
+# Redis seed queue. Every entry is one JSON object: a seeds-file entry (url, site,
+# allow_patterns, scroll_to_load, ...), so distributed runs keep the per-seed meta.
+# With WEEDEATER_SHARD="<index>/<count>" each node reads <key>:<index>; seeds are
+# assigned by registered domain, so a site's whole frontier stays on one node.
+
+def encode_seed(seed: dict) -> str:
+    return json.dumps(seed, separators=(",", ":"), default=str)
+
+
+def decode_seed(data, encoding: str = "utf-8") -> dict:
+    """A queued seed; bare URLs (the old payload) become {"url": ...}."""
+    if isinstance(data, bytes):
+        data = data.decode(encoding)
+    data = data.strip()
+    if data.startswith("{"):
+        return json.loads(data)
+    return {"url": data}
+
+
+def shard_of(url: str, shards: int) -> int:
+    if shards <= 1:
+        return 0
+    domain = tldextract.extract(url).registered_domain or (urlsplit(url).hostname or "")
+    return zlib.crc32(domain.lower().encode()) % shards
+
+
+def shard_key(key: str, shard: int, shards: int) -> str:
+    return key if shards <= 1 else f"{key}:{shard}"
+
+
+def parse_shard(value: Optional[str] = None) -> Tuple[int, int]:
+    """(index, count) from WEEDEATER_SHARD ("2/8"); (0, 1) when unsharded."""
+    value = os.getenv("WEEDEATER_SHARD", "") if value is None else value
+    if not value:
+        return 0, 1
+    index, _, count = value.partition("/")
+    index, count = int(index), int(count or 1)
+    if not 0 <= index < count:
+        raise ValueError(f"WEEDEATER_SHARD={value!r}: expected <index>/<count> with 0 <= index < count")
+    return index, count
@@ -0,0 +1,108 @@
+import io
+import gzip
+from collections import namedtuple
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Iterator, Optional
+
+from lxml import etree
+
+from .recrawl import recrawl_key
+
+# Discovery from sitemaps (urlset / sitemapindex) and product feeds (RSS 2.0 incl.
+# Google Shopping `g:` items, Atom). Documents are parsed with iterparse and each
+# entry is cleared once read, so a 50k-URL sitemap never becomes a full tree; gzip
+# bodies are decompressed as the parser reads them.
+SitemapEntry = namedtuple("SitemapEntry", "kind loc lastmod")
+
+GZIP_MAGIC = b"\x1f\x8b"
+# element local name -> entry kind
+_ENTRY_TAGS = {"url": "url", "sitemap": "sitemap", "item": "url", "entry": "url"}
+_LOC_TAGS = ("loc", "link")
+_DATE_TAGS = ("lastmod", "updated", "pubDate")
+
+
+def _local(tag) -> str:
+    return tag.rsplit("}", 1)[-1] if isinstance(tag, str) else ""
+
+
+def parse_lastmod(value: Optional[str]) -> Optional[float]:
+    """W3C datetime (sitemaps, Atom) or RFC 822 date (RSS) as a UTC timestamp."""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        dt = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        try:
+            dt = parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.timestamp()
+
+
+def _entry(el, kind) -> Optional[SitemapEntry]:
+    loc = lastmod = None
+    for child in el:
+        name = _local(child.tag)
+        if name in _LOC_TAGS and not loc:
+            # Atom links carry the URL in href; RSS/sitemaps in the text
+            loc = (child.get("href") or child.text or "").strip()
+        elif name in _DATE_TAGS and lastmod is None:
+            lastmod = parse_lastmod(child.text)
+    return SitemapEntry(kind, loc, lastmod) if loc else None
+
+
+def iter_entries(body: bytes) -> Iterator[SitemapEntry]:
+    """Stream entries out of a sitemap, sitemap index or feed body (plain or gzipped)."""
+    source = io.BytesIO(body)
+    if body[:2] == GZIP_MAGIC:
+        source = gzip.GzipFile(fileobj=source)
+    parser = etree.iterparse(source, events=("end",), recover=True, huge_tree=True,
+                             resolve_entities=False, no_network=True)
+    try:
+        for _, el in parser:
+            kind = _ENTRY_TAGS.get(_local(el.tag))
+            if kind is None:
+                continue
+            entry = _entry(el, kind)
+            el.clear()
+            # Drop already-processed siblings so the partial tree stays small
+            parent = el.getparent()
+            if parent is not None:
+                while el.getprevious() is not None:
+                    del parent[0]
+            if entry:
+                yield entry
+    except (etree.XMLSyntaxError, OSError, EOFError):
+        # Truncated downloads / corrupt gzip: keep what was read so far
+        return
+
+
+def robots_sitemaps(body: bytes) -> list:
+    urls = []
+    for line in body.decode("utf-8", "replace").splitlines():
+        name, _, value = line.partition(":")
+        if name.strip().lower() == "sitemap" and value.strip():
+            urls.append(value.strip())
+    return urls
+
+
+class LastmodStore:
+    # Last seen <lastmod> per product URL, kept in one Redis hash so a sitemap pass
+    # schedules only URLs whose lastmod moved. Lookups and writes are batched.
+    def __init__(self, server, key: str):
+        self.server = server
+        self.key = key
+
+    def previous(self, urls) -> list:
+        if not urls:
+            return []
+        values = self.server.hmget(self.key, [recrawl_key(u) for u in urls])
+        return [float(v) if v is not None else None for v in values]
+
+    def mark(self, lastmods: dict):
+        if lastmods:
+            self.server.hset(self.key, mapping={recrawl_key(u): ts for u, ts in lastmods.items()})
@@ -1,18 +1,28 @@
 import os
+import gzip
 import time
 import json
 import logging
+import threading
 from pathlib import Path
 from typing import Optional
 
 import boto3
+import zstandard
+from botocore.exceptions import ClientError
 from google.cloud import storage as gcs_storage
 import firebase_admin
 from firebase_admin import credentials, firestore
 
 _firestore_client = None
+_s3_client = None
+_gcs_client = None
+_client_lock = threading.Lock()
 logger = logging.getLogger(__name__)
 
+# Supported Content-Encoding values and the key suffix used for each
+CONTENT_ENCODING_SUFFIXES = {"gzip": ".gz", "zstd": ".zst"}
+
 
 def ensure_dir(path: str):
     Path(path).parent.mkdir(parents=True, exist_ok=True)
@@ -37,25 +47,131 @@ def get_firestore():
     return _firestore_client
 
 
-def upload_s3(bucket: str, key: str, data: bytes, content_type: str = "text/html"):
+def get_s3_client():
+    """Return a process-wide S3 client; boto3 clients are thread-safe and reuse connections."""
+    global _s3_client
+    if _s3_client is None:
+        with _client_lock:
+            if _s3_client is None:
+                _s3_client = boto3.client(
+                    "s3",
+                    region_name=os.getenv("AWS_REGION", "us-east-1"),
+                    # S3-compatible stand-ins (MinIO, moto server) for local runs
+                    endpoint_url=os.getenv("S3_ENDPOINT_URL") or None,
+                )
+    return _s3_client
+
+
+def get_gcs_client():
+    """Return a process-wide GCS client."""
+    global _gcs_client
+    if _gcs_client is None:
+        with _client_lock:
+            if _gcs_client is None:
+                _gcs_client = gcs_storage.Client()
+    return _gcs_client
+
+
+def compress(data: bytes, encoding: Optional[str]) -> bytes:
+    """Compress data for the given Content-Encoding (gzip, zstd or None)."""
+    if not encoding:
+        return data
+    if encoding == "gzip":
+        return gzip.compress(data, compresslevel=6)
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor(level=3).compress(data)
+    raise ValueError(f"Unsupported content encoding: {encoding}")
+
+
+def decompress(data: bytes, encoding: Optional[str]) -> bytes:
+    """Reverse compress() for the given Content-Encoding."""
+    if not encoding:
+        return data
+    if encoding == "gzip":
+        return gzip.decompress(data)
+    if encoding == "zstd":
+        return zstandard.ZstdDecompressor().decompress(data)
+    raise ValueError(f"Unsupported content encoding: {encoding}")
+
+
+def upload_s3(bucket: str, key: str, data: bytes, content_type: str = "text/html",
+              content_encoding: Optional[str] = None):
     """Upload data to S3 with error handling."""
     try:
-        s3 = boto3.client("s3", region_name=os.getenv("AWS_REGION", "us-east-1"))
-        s3.put_object(Bucket=bucket, Key=key, Body=data, ContentType=content_type)
-        logger.info(f"Successfully uploaded to S3: s3://{bucket}/{key}")
+        extra = {"ContentEncoding": content_encoding} if content_encoding else {}
+        get_s3_client().put_object(Bucket=bucket, Key=key, Body=data, ContentType=content_type, **extra)
+        logger.debug(f"Successfully uploaded to S3: s3://{bucket}/{key}")
     except Exception as e:
         logger.error(f"Failed to upload to S3 bucket '{bucket}' key '{key}': {e}")
         raise
 
 
-def upload_gcs(bucket: str, key: str, data: bytes, content_type: str = "text/html"):
+def upload_gcs(bucket: str, key: str, data: bytes, content_type: str = "text/html",
+               content_encoding: Optional[str] = None):
     """Upload data to GCS with error handling."""
     try:
-        client = gcs_storage.Client()
-        b = client.bucket(bucket)
-        blob = b.blob(key)
+        blob = get_gcs_client().bucket(bucket).blob(key)
+        if content_encoding:
+            blob.content_encoding = content_encoding
         blob.upload_from_string(data, content_type=content_type)
-        logger.info(f"Successfully uploaded to GCS: gs://{bucket}/{key}")
+        logger.debug(f"Successfully uploaded to GCS: gs://{bucket}/{key}")
     except Exception as e:
         logger.error(f"Failed to upload to GCS bucket '{bucket}' key '{key}': {e}")
         raise
+
+
+def upload_file_s3(bucket: str, key: str, path: str, content_type: str = "application/octet-stream"):
+    """Stream a local file to S3 (multipart for large files)."""
+    try:
+        get_s3_client().upload_file(str(path), bucket, key, ExtraArgs={"ContentType": content_type})
+        logger.info(f"Successfully uploaded to S3: s3://{bucket}/{key}")
+    except Exception as e:
+        logger.error(f"Failed to upload '{path}' to S3 bucket '{bucket}' key '{key}': {e}")
+        raise
+
+
+def upload_file_gcs(bucket: str, key: str, path: str, content_type: str = "application/octet-stream"):
+    """Stream a local file to GCS (resumable for large files)."""
+    try:
+        get_gcs_client().bucket(bucket).blob(key).upload_from_filename(str(path), content_type=content_type)
+        logger.info(f"Successfully uploaded to GCS: gs://{bucket}/{key}")
+    except Exception as e:
+        logger.error(f"Failed to upload '{path}' to GCS bucket '{bucket}' key '{key}': {e}")
+        raise
+
+
+def s3_object_exists(bucket: str, key: str) -> bool:
+    try:
+        get_s3_client().head_object(Bucket=bucket, Key=key)
+        return True
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+            return False
+        raise
+
+
+def gcs_object_exists(bucket: str, key: str) -> bool:
+    return get_gcs_client().bucket(bucket).blob(key).exists()
+
+
+def download_s3(bucket: str, key: str) -> bytes:
+    return get_s3_client().get_object(Bucket=bucket, Key=key)["Body"].read()
+
+
+def download_gcs(bucket: str, key: str) -> bytes:
+    # raw_download: return the stored bytes, without GCS's decompressive transcoding
+    return get_gcs_client().bucket(bucket).blob(key).download_as_bytes(raw_download=True)
+
+
+def read_raw_html(path: str) -> bytes:
+    """Body of a raw HTML snapshot at s3://, gs:// or a local path, decompressed by key suffix."""
+    if path.startswith(("s3://", "gs://")):
+        scheme, _, rest = path.partition("://")
+        bucket, _, key = rest.partition("/")
+        data = download_s3(bucket, key) if scheme == "s3" else download_gcs(bucket, key)
+    else:
+        data = Path(path).read_bytes()
+    for encoding, suffix in CONTENT_ENCODING_SUFFIXES.items():
+        if path.endswith(suffix):
+            return decompress(data, encoding)
+    return data
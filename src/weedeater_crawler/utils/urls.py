@@ -0,0 +1,33 @@
+import re
+from fnmatch import fnmatchcase
+from typing import Iterable, Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from w3lib.url import canonicalize_url
+
+# Query parameters that never change the page content. Seeds can add their own
+# (glob patterns allowed) with `strip_params` in weedeater_targets.yaml. Generic
+# names some sites use for content (ref as a product reference, sid as a store id)
+# are left to the seeds.
+DEFAULT_STRIP_PARAMS = (
+    "utm_*", "gclid", "gclsrc", "dclid", "fbclid", "msclkid", "yclid", "mc_cid", "mc_eid",
+    "_ga", "_gl", "srsltid", "ref_", "cm_mmc", "cmpid", "icid", "sessionid", "session_id",
+    "jsessionid", "phpsessid", "aspsessionid*",
+)
+_PATH_SESSION = re.compile(r";(?:jsessionid|phpsessid|sid)=[^/?#]*", re.I)
+
+
+def canonical_url(url: str, strip_params: Optional[Iterable[str]] = None) -> str:
+    """Canonical form used for fingerprints: sorted query, no fragment, no tracking/session params."""
+    patterns = tuple(p.lower() for p in (*DEFAULT_STRIP_PARAMS, *(strip_params or ())))
+    parts = urlsplit(_PATH_SESSION.sub("", url))
+    query = [
+        (k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+        if not any(fnmatchcase(k.lower(), p) for p in patterns)
+    ]
+    return canonicalize_url(urlunsplit(parts._replace(query=urlencode(query), fragment="")))
+
+
+def request_url(request) -> str:
+    """Canonical URL of a request, honoring the seed's strip_params carried in meta."""
+    return canonical_url(request.url, request.meta.get("strip_params"))
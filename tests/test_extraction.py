@@ -0,0 +1,25 @@
+from lxml import html
+
+from weedeater_crawler.extraction import ExtractionEngine
+
+
+def page(body: str):
+    return html.fromstring(f"<html><body><h1 class='product-title'>Trimmer</h1>{body}</body></html>")
+
+
+def test_field_absent_while_learning_is_still_extracted():
+    engine = ExtractionEngine(learn_pages=5)
+    for _ in range(5):
+        assert engine.extract(page(""), "example.com").get("sku") is None
+    assert "sku" not in engine.plans.get("example.com", {})
+    data = engine.extract(page('<span class="sku">ABC</span>'), "example.com")
+    assert data["sku"] == "ABC"
+
+
+def test_planned_selector_survives_pages_without_the_field():
+    engine = ExtractionEngine(learn_pages=2, max_misses=1)
+    for _ in range(2):
+        engine.extract(page('<span class="sku">ABC</span>'), "example.com")
+    planned = engine.plans["example.com"]["sku"]
+    engine.extract(page(""), "example.com")
+    assert engine.plans["example.com"]["sku"] == planned
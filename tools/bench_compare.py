@@ -0,0 +1,82 @@
+"""Compare two tools/bench_crawl.py result files.
+
+Usage: python tools/bench_compare.py BASELINE.json CANDIDATE.json [--threshold 10]
+
+Prints, per scenario present in both files, each metric's value and % change, marking
+regressions (throughput down; latency, memory or elapsed time up). With --threshold,
+exits 1 when any regression exceeds that many percent.
+"""
+import sys
+import json
+import argparse
+
+# metric -> True when higher is better
+METRICS = {
+    "pages_per_s": True,
+    "items_per_s": True,
+    "latency_p50_ms": False,
+    "latency_p95_ms": False,
+    "peak_rss_mb": False,
+    "browser_peak_rss_mb": False,
+    "elapsed_s": False,
+}
+
+
+def load(path):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def delta(old, new):
+    if old is None or new is None or old == 0:
+        return None
+    return (new - old) / old * 100
+
+
+def compare(base, cand, threshold=None):
+    """Rows of (scenario, metric, old, new, pct, regressed) for scenarios in both runs."""
+    rows = []
+    for name, old in base["scenarios"].items():
+        new = cand["scenarios"].get(name)
+        if new is None or old.get("failed") or new.get("failed"):
+            continue
+        for metric, higher_is_better in METRICS.items():
+            pct = delta(old.get(metric), new.get(metric))
+            worse = pct is not None and (pct < 0 if higher_is_better else pct > 0)
+            regressed = worse and threshold is not None and abs(pct) > threshold
+            rows.append((name, metric, old.get(metric), new.get(metric), pct, worse, regressed))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument("--threshold", type=float, help="fail on a regression larger than this many percent")
+    args = parser.parse_args()
+    base, cand = load(args.baseline), load(args.candidate)
+    print(f"baseline {base['meta'].get('commit')} ({base['meta'].get('timestamp')})  "
+          f"candidate {cand['meta'].get('commit')} ({cand['meta'].get('timestamp')})")
+
+    for name in sorted(set(base["scenarios"]) ^ set(cand["scenarios"])):
+        print(f"{name:<16} only in {'baseline' if name in base['scenarios'] else 'candidate'}")
+    for name in sorted(set(base["scenarios"]) & set(cand["scenarios"])):
+        for label, res in (("baseline", base["scenarios"][name]), ("candidate", cand["scenarios"][name])):
+            if res.get("failed"):
+                print(f"{name:<16} failed in {label}")
+
+    rows = compare(base, cand, args.threshold)
+    regressions = 0
+    for name, metric, old, new, pct, worse, regressed in rows:
+        change = f"{pct:+7.1f}%" if pct is not None else "     n/a"
+        mark = "  REGRESSION" if regressed else ("  worse" if worse else "")
+        print(f"{name:<16} {metric:<20} {old!s:>10} -> {new!s:>10} {change}{mark}")
+        regressions += regressed
+    if regressions:
+        print(f"{regressions} regression(s) above {args.threshold:g}%")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,232 @@
+"""Crawl WeedeaterSpider against the synthetic catalog and record throughput, latency and memory.
+
+Usage: python tools/bench_crawl.py [--modes http,hybrid,render] [--sinks noop,sqlite,archive]
+                                   [--products-per-category 240] [--out bench_crawl.json] [--set KEY=VALUE ...]
+
+Every mode x sink scenario runs in its own process (fresh reactor, fresh RSS) against
+tools/catalog_server.py, which serves paginated and infinite-scroll listings, JSON-LD,
+microdata and plain product pages, injected 429s and slow responses.
+  modes:  http    plain HTTP download handler, no browser
+          hybrid  the project's HybridDownloadHandler (HTTP first, Playwright on demand)
+          render  HybridDownloadHandler with HYBRID_FETCH_ENABLED=false: every page rendered
+  sinks:  noop (no pipelines), sqlite (SQLitePipeline), archive (RawHTMLArchivePipeline)
+The scheduler and dupefilter are Scrapy's in-memory ones unless --redis is given, and
+DOWNLOAD_DELAY defaults to 0; anything else comes from the project settings and can be
+overridden with --set. Results go to --out as JSON; compare two runs with
+tools/bench_compare.py.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import resource
+import subprocess
+import tempfile
+from pathlib import Path
+
+import yaml
+
+sys.path.insert(0, str(Path(__file__).parent))
+from catalog_server import Catalog, serve  # noqa: E402
+
+MODES = ("http", "hybrid", "render")
+SINKS = ("noop", "sqlite", "archive")
+PIPELINES = {
+    "noop": {},
+    "sqlite": {"weedeater_crawler.pipelines.SQLitePipeline": 200},
+    "archive": {"weedeater_crawler.pipelines.RawHTMLArchivePipeline": 90},
+}
+HTTP_HANDLERS = {
+    "http": "scrapy.core.downloader.handlers.http11.HTTP11DownloadHandler",
+    "https": "scrapy.core.downloader.handlers.http11.HTTP11DownloadHandler",
+}
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * q))]
+
+
+def run_child(config_path):
+    # Runs inside the scenario process: one crawl, then the measurements as JSON on stdout
+    from scrapy import signals
+    from scrapy.crawler import CrawlerProcess
+    from scrapy.utils.project import get_project_settings
+    from twisted.internet.task import LoopingCall
+
+    from weedeater_crawler.spiders.weedeater_spider import WeedeaterSpider
+    from weedeater_crawler.utils.procs import process_tree_rss
+
+    config = json.loads(Path(config_path).read_text())
+    settings = get_project_settings()
+    settings.setdict(config["settings"], priority="cmdline")
+    process = CrawlerProcess(settings)
+    crawler = process.create_crawler(WeedeaterSpider)
+    latencies = []
+    browser = {"peak": 0}
+
+    def response_received(response, request, spider):
+        if "download_latency" in request.meta:
+            latencies.append(request.meta["download_latency"])
+
+    def sample_browser():
+        browser["peak"] = max(browser["peak"], process_tree_rss(os.getpid()) or 0)
+
+    def spider_opened(spider):
+        # Created here: LoopingCall() imports the default reactor before Scrapy installs its own
+        browser["sampler"] = LoopingCall(sample_browser)
+        browser["sampler"].start(0.5)
+
+    def spider_closed(spider):
+        if browser["sampler"].running:
+            browser["sampler"].stop()
+
+    crawler.signals.connect(response_received, signal=signals.response_received)
+    crawler.signals.connect(spider_opened, signal=signals.spider_opened)
+    crawler.signals.connect(spider_closed, signal=signals.spider_closed)
+    process.crawl(crawler)
+    process.start()
+
+    stats = crawler.stats.get_stats()
+    elapsed = stats.get("elapsed_time_seconds") or 0.0
+    pages = stats.get("response_received_count", 0)
+    items = stats.get("item_scraped_count", 0)
+    latencies.sort()
+    print(json.dumps({
+        "elapsed_s": round(elapsed, 3),
+        "pages": pages,
+        "items": items,
+        "pages_per_s": round(pages / elapsed, 2) if elapsed else None,
+        "items_per_s": round(items / elapsed, 2) if elapsed else None,
+        "latency_p50_ms": round(percentile(latencies, 0.5) * 1000, 1) if latencies else None,
+        "latency_p95_ms": round(percentile(latencies, 0.95) * 1000, 1) if latencies else None,
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "browser_peak_rss_mb": round(browser["peak"] / 1024 / 1024, 1),
+        "responses_429": stats.get("downloader/response_status_count/429", 0),
+        "errors": stats.get("log_count/ERROR", 0),
+        "finish_reason": stats.get("finish_reason"),
+    }))
+
+
+def scenario(mode, sink, args, base_url, workdir):
+    env = {
+        **os.environ,
+        "SCRAPY_SETTINGS_MODULE": "weedeater_crawler.settings",
+        "WEEDEATER_SEEDS_PATH": str(workdir / "seeds.yaml"),
+        "PROMETHEUS_PORT": "0",
+        "RATE_CONTROL_SHARED": "false",
+        "INCREMENTAL_ENABLED": "false",
+        "CHECKPOINT_ENABLED": "false",
+        "PROXY_POOL": "", "PROXY_FILE": "", "PROXY_REDIS_KEY": "",
+        "ENABLE_SQLITE": "true" if sink == "sqlite" else "false",
+        "SQLITE_PATH": str(workdir / f"{mode}-{sink}.sqlite"),
+        "ENABLE_RAW_ARCHIVE": "true" if sink == "archive" else "false",
+        "RAW_ARCHIVE_DIR": str(workdir / f"{mode}-{sink}-archive"),
+        "ENABLE_S3": "false", "ENABLE_GCS": "false", "ENABLE_FIRESTORE": "false",
+        "HYBRID_FETCH_ENABLED": "false" if mode == "render" else "true",
+    }
+    settings = {
+        "ITEM_PIPELINES": PIPELINES[sink],
+        "DOWNLOAD_DELAY": 0,
+        "LOG_LEVEL": "WARNING",
+        "CLOSESPIDER_TIMEOUT": args.timeout,
+    }
+    if not args.redis:
+        settings.update({"SCHEDULER": "scrapy.core.scheduler.Scheduler",
+                         "DUPEFILTER_CLASS": "scrapy.dupefilters.RFPDupeFilter"})
+    if mode == "http":
+        settings["DOWNLOAD_HANDLERS"] = HTTP_HANDLERS
+    for override in args.set or ():
+        key, _, value = override.partition("=")
+        settings[key] = yaml.safe_load(value)
+    config = workdir / f"{mode}-{sink}.json"
+    config.write_text(json.dumps({"settings": settings}))
+    started = time.monotonic()
+    proc = subprocess.run([sys.executable, __file__, "--child", str(config)], env=env,
+                          capture_output=True, text=True, timeout=args.timeout + 120)
+    lines = [line for line in proc.stdout.splitlines() if line.startswith("{")]
+    if proc.returncode != 0 or not lines:
+        return {"failed": True, "returncode": proc.returncode, "wall_s": round(time.monotonic() - started, 1),
+                "stderr_tail": proc.stderr.strip().splitlines()[-5:]}
+    return json.loads(lines[-1])
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=Path(__file__).parent).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    parser.add_argument("--modes", default=",".join(MODES))
+    parser.add_argument("--sinks", default=",".join(SINKS))
+    parser.add_argument("--products-per-category", type=int, default=240)
+    parser.add_argument("--throttle-every", type=int, default=50)
+    parser.add_argument("--slow-every", type=int, default=20)
+    parser.add_argument("--slow-ms", type=int, default=800)
+    parser.add_argument("--timeout", type=int, default=600, help="CLOSESPIDER_TIMEOUT per scenario")
+    parser.add_argument("--redis", action="store_true", help="keep the project's Redis scheduler and dupefilter")
+    parser.add_argument("--set", action="append", metavar="KEY=VALUE", help="extra Scrapy setting (YAML value)")
+    parser.add_argument("--out", default="bench_crawl.json")
+    args = parser.parse_args()
+    if args.child:
+        run_child(args.child)
+        return 0
+
+    modes = [m for m in args.modes.split(",") if m]
+    sinks = [s for s in args.sinks.split(",") if s]
+    unknown = set(modes) - set(MODES) | set(sinks) - set(SINKS)
+    if unknown:
+        parser.error(f"unknown mode/sink: {', '.join(sorted(unknown))}")
+
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="bench_crawl_") as tmp:
+        workdir = Path(tmp)
+        for mode in modes:
+            for sink in sinks:
+                # A fresh catalog per scenario so every crawl sees the same first-hit 429s
+                catalog = Catalog(args.products_per_category, args.throttle_every, args.slow_every, args.slow_ms)
+                server = serve(catalog)
+                base_url = f"http://127.0.0.1:{server.server_address[1]}"
+                (workdir / "seeds.yaml").write_text(yaml.safe_dump(catalog.seeds(base_url)))
+                name = f"{mode}/{sink}"
+                res = scenario(mode, sink, args, base_url, workdir)
+                res["expected_items"] = catalog.product_count
+                server.shutdown()
+                server.server_close()
+                results[name] = res
+                if res.get("failed"):
+                    print(f"{name:<16} FAILED (exit {res['returncode']}): {' | '.join(res['stderr_tail'][-2:])}")
+                else:
+                    print(f"{name:<16} {res['pages_per_s'] or 0:>7} pages/s {res['items_per_s'] or 0:>7} items/s  "
+                          f"p50={res['latency_p50_ms']}ms p95={res['latency_p95_ms']}ms  "
+                          f"rss={res['peak_rss_mb']}MB browser={res['browser_peak_rss_mb']}MB  "
+                          f"items={res['items']}/{res['expected_items']}")
+
+    import scrapy
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump({
+            "meta": {
+                "commit": git_commit(),
+                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+                "python": platform.python_version(),
+                "scrapy": scrapy.__version__,
+                "machine": platform.machine(),
+                "cpus": os.cpu_count(),
+                "args": {k: v for k, v in vars(args).items() if k not in ("child", "out")},
+            },
+            "scenarios": results,
+        }, f, indent=2)
+    print(f"Wrote {args.out}")
+    return 0 if not any(r.get("failed") for r in results.values()) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
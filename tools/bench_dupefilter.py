@@ -0,0 +1,117 @@
+"""Compare Redis memory and throughput of RFPDupeFilter's set against the Bloom dupefilter.
+
+Usage: python tools/bench_dupefilter.py [--urls 10000000] [--error-rate 0.001] [--out bench.json]
+
+Uses REDIS_URL (default redis://localhost:6379) and keys under bench:dupefilter:*,
+which are deleted before and after the run. Fingerprints are computed the same way
+as the crawler's (canonical URL + method + body, sha1).
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import hashlib
+
+import redis
+
+from weedeater_crawler.utils.bloom import bloom_filter
+from weedeater_crawler.utils.urls import canonical_url
+
+CHUNK = 10_000
+SITES = ["husqvarna.com", "stihlusa.com", "echo-usa.com", "lowes.com", "homedepot.com"]
+NOISE = ["utm_source=mail", "gclid=abc123", "sessionid=s42", "sort=price", "fbclid=x9"]
+
+
+def synthetic_urls(n, seed=7):
+    # Roughly a third of the URLs are near-duplicates differing only in tracking params
+    rng = random.Random(seed)
+    for i in range(n):
+        product = rng.randrange(n * 2 // 3)
+        url = f"https://www.{SITES[product % len(SITES)]}/products/trimmer-{product}?color={product % 4}"
+        if rng.random() < 0.5:
+            url += "&" + rng.choice(NOISE)
+        yield url
+
+
+def fingerprint(url):
+    data = {"method": "GET", "url": canonical_url(url), "body": ""}
+    return hashlib.sha1(json.dumps(data, sort_keys=True).encode()).hexdigest()
+
+
+def chunks(iterable, size):
+    chunk = []
+    for x in iterable:
+        chunk.append(x)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def bench_set(r, key, n):
+    started = time.perf_counter()
+    new = 0
+    for chunk in chunks((fingerprint(u) for u in synthetic_urls(n)), CHUNK):
+        pipe = r.pipeline(transaction=False)
+        for fp in chunk:
+            pipe.sadd(key, fp)
+        new += sum(pipe.execute())
+    elapsed = time.perf_counter() - started
+    return {"filter": "RFPDupeFilter (set)", "unique": new, "seconds": round(elapsed, 2),
+            "urls_per_second": round(n / elapsed), "memory_bytes": r.memory_usage(key, samples=0) or 0}
+
+
+def bench_bloom(r, key, n, capacity, error_rate, backend):
+    bloom = bloom_filter(r, key, backend=backend, capacity=capacity, error_rate=error_rate)
+    started = time.perf_counter()
+    new = 0
+    for chunk in chunks((fingerprint(u) for u in synthetic_urls(n)), CHUNK):
+        new += sum(bloom.add_many(chunk))
+    elapsed = time.perf_counter() - started
+    # Probe with fingerprints that were never added to measure the false-positive rate
+    probes = [hashlib.sha1(f"probe-{i}".encode()).hexdigest() for i in range(100_000)]
+    false_positives = sum(not added for added in bloom.add_many(probes))
+    return {"filter": f"BloomDupeFilter ({bloom.backend})", "unique": new, "seconds": round(elapsed, 2),
+            "urls_per_second": round(n / elapsed), "memory_bytes": bloom.memory_bytes(),
+            "observed_false_positive_rate": false_positives / len(probes)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--urls", type=int, default=10_000_000)
+    parser.add_argument("--capacity", type=int, default=1_000_000)
+    parser.add_argument("--error-rate", type=float, default=0.001)
+    parser.add_argument("--backend", default="auto", choices=["auto", "bitmap", "redisbloom"])
+    parser.add_argument("--out", help="write results as JSON to this path")
+    args = parser.parse_args()
+
+    r = redis.from_url(os.getenv("REDIS_URL", "redis://localhost:6379"))
+    keys = r.keys("bench:dupefilter:*")
+    if keys:
+        r.delete(*keys)
+    try:
+        results = {
+            "urls": args.urls,
+            "results": [
+                bench_set(r, "bench:dupefilter:set", args.urls),
+                bench_bloom(r, "bench:dupefilter:bloom", args.urls, args.capacity, args.error_rate, args.backend),
+            ],
+        }
+    finally:
+        keys = r.keys("bench:dupefilter:*")
+        if keys:
+            r.delete(*keys)
+    for res in results["results"]:
+        print(f"{res['filter']:<32} unique={res['unique']:>10} "
+              f"mem={res['memory_bytes'] / 1024 / 1024:8.1f} MiB  {res['urls_per_second']:>8} urls/s")
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,102 @@
+"""Compare per-page product extraction time of the legacy parsel selector chains against ExtractionEngine.
+
+Usage: python tools/bench_extraction.py [--fixtures tools/fixtures/products] [--pages 2000] [--out bench.json]
+
+Each fixture is treated as one site's template: it is parsed --pages times, each time
+from a fresh HtmlResponse, so the numbers include lxml tree construction as a crawl would.
+The engine is measured after its learning window, i.e. on the compiled per-site plan.
+"""
+import sys
+import json
+import time
+import argparse
+import statistics
+from pathlib import Path
+
+from scrapy.http import HtmlResponse
+
+from weedeater_crawler.extraction import BREADCRUMBS, IMAGES, ExtractionEngine, extract_specs
+
+URL = "https://bench.example.com/products/trimmer"
+
+
+def legacy_extract(response):
+    # Verbatim copy of the selector chains parse_product used before ExtractionEngine
+    item = {}
+    sel = response.css
+    item['product_name'] = sel('h1::text').get() or sel('h1 span::text').get()
+    item['brand'] = sel('[itemprop="brand"]::text').get() or sel('.brand::text').get() or sel('meta[itemprop="brand"]::attr(content)').get()
+    item['sku'] = sel('[itemprop="sku"]::text').get() or sel('span.sku::text').get() or sel('meta[itemprop="sku"]::attr(content)').get()
+    item['upc'] = sel('[itemprop="gtin13"]::attr(content)').get() or sel('[data-upc]::attr(data-upc)').get()
+    item['price'] = sel('[itemprop="price"]::attr(content)').get() or sel('.price ::text').re_first(r"\$?([0-9,.]+)")
+    item['currency'] = sel('[itemprop="priceCurrency"]::attr(content)').get() or 'USD'
+    item['availability'] = sel('[itemprop="availability"]::attr(content)').re_first(r"InStock|OutOfStock|PreOrder")
+    item['description'] = ' '.join(sel('[itemprop="description"] ::text').getall() or sel('.description ::text').getall()).strip()
+    specs = {}
+    for row in sel('table, .specs, .product-specs').css('tr'):
+        key = ' '.join(row.css('th, .label ::text').getall()).strip()
+        val = ' '.join(row.css('td, .value ::text').getall()).strip()
+        if key and val:
+            specs[key] = val
+    item['specs'] = specs or None
+    item['images'] = response.css('img::attr(src), img::attr(data-src), img::attr(data-original)').getall()
+    item['breadcrumbs'] = [b.strip() for b in response.css('nav.breadcrumbs a::text, .breadcrumbs a::text').getall() if b.strip()]
+    return item
+
+
+def engine_extract(engine, site):
+    def extract(response):
+        root = response.selector.root
+        item = engine.extract(root, site)
+        item['specs'] = extract_specs(root) or None
+        item['images'] = item.get('images') or [str(src) for src in IMAGES(root)]
+        item['breadcrumbs'] = item.get('breadcrumbs') or [str(b).strip() for b in BREADCRUMBS(root) if b.strip()]
+        return item
+    return extract
+
+
+def timed(extract, body, pages):
+    samples = []
+    for _ in range(pages):
+        started = time.perf_counter()
+        extract(HtmlResponse(URL, body=body, encoding="utf-8"))
+        samples.append((time.perf_counter() - started) * 1e6)
+    samples.sort()
+    return {
+        "mean_us": round(statistics.fmean(samples), 1),
+        "p50_us": round(samples[len(samples) // 2], 1),
+        "p95_us": round(samples[int(len(samples) * 0.95)], 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--fixtures", default=str(Path(__file__).parent / "fixtures" / "products"))
+    parser.add_argument("--pages", type=int, default=2000)
+    parser.add_argument("--learn-pages", type=int, default=5)
+    parser.add_argument("--out", help="write results as JSON to this path")
+    args = parser.parse_args()
+
+    results = []
+    for path in sorted(Path(args.fixtures).glob("*.html")):
+        body = path.read_bytes()
+        engine = ExtractionEngine(learn_pages=args.learn_pages)
+        extract = engine_extract(engine, path.stem)
+        for _ in range(args.learn_pages):
+            extract(HtmlResponse(URL, body=body, encoding="utf-8"))
+        legacy = timed(legacy_extract, body, args.pages)
+        compiled = timed(extract, body, args.pages)
+        results.append({"fixture": path.name, "legacy": legacy, "engine": compiled,
+                        "speedup": round(legacy["mean_us"] / compiled["mean_us"], 2)})
+
+    for res in results:
+        print(f"{res['fixture']:<28} legacy mean={res['legacy']['mean_us']:8.1f}us p95={res['legacy']['p95_us']:8.1f}us  "
+              f"engine mean={res['engine']['mean_us']:8.1f}us p95={res['engine']['p95_us']:8.1f}us  x{res['speedup']}")
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump({"pages": args.pages, "results": results}, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,222 @@
+"""Deterministic synthetic weedeater catalog for crawl benchmarks.
+
+Usage: python tools/catalog_server.py [--port 8099] [--products-per-category 240] [--throttle-every 50] [--slow-every 20]
+
+Serves, for each category:
+  /c/<category>?page=N          paginated listing (PAGE_SIZE products per page, next/numbered links)
+  /s/<category>                 infinite-scroll listing: SCROLL_BATCH links in the HTML, the rest
+                                appended by script from /api/s/<category>?offset=N as the page scrolls
+  /products/<category>-<n>/     product page; even n carry JSON-LD, odd n schema.org microdata
+                                (every fourth one plain markup without itemprops)
+Every --throttle-every-th product answers its first request with 429 + Retry-After: 1, and every
+--slow-every-th page is delayed by --slow-ms. Content depends only on the arguments, so two runs
+serve byte-identical sites.
+"""
+import sys
+import json
+import time
+import zlib
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+CATEGORIES = ("trimmers", "edgers", "brushcutters")
+SCROLL_CATEGORIES = ("edgers",)
+BRANDS = ("PowerCut", "TrimPro", "EdgeMaster", "GreenLine", "YardHawk")
+PAGE_SIZE = 24
+SCROLL_BATCH = 12
+
+SCROLL_SCRIPT = """
+<script>
+let offset = %(offset)d, loading = false, done = false;
+window.addEventListener('scroll', async () => {
+  if (loading || done || window.innerHeight + window.scrollY < document.body.scrollHeight - 200) return;
+  loading = true;
+  const res = await fetch('/api/s/%(category)s?offset=' + offset);
+  const links = await res.json();
+  const list = document.getElementById('grid');
+  for (const href of links) {
+    const card = document.createElement('div');
+    card.className = 'card';
+    card.style.height = '300px';
+    card.innerHTML = '<a href="' + href + '">' + href + '</a>';
+    list.appendChild(card);
+  }
+  offset += links.length;
+  done = links.length === 0;
+  loading = false;
+});
+</script>
+"""
+
+
+def product_path(category, n):
+    return f"/products/{category}-{n}/"
+
+
+def product_page(category, n):
+    brand = BRANDS[n % len(BRANDS)]
+    name = f"{brand} {20 + n % 40}cc {category[:-1].title()} {n}"
+    sku = f"{category[:2].upper()}-{n:05d}"
+    price = f"{99 + (n * 37) % 400}.{n % 100:02d}"
+    specs = "".join(f"<tr><th>Spec {i}</th><td>{(n * (i + 3)) % 97} units</td></tr>" for i in range(8))
+    filler = "".join(f"<p>Feature paragraph {i} for {name}: balanced, durable, easy to start.</p>" for i in range(30))
+    crumbs = f'<nav class="breadcrumbs"><a href="/">Home</a><a href="/c/{category}">{category.title()}</a></nav>'
+    if n % 2 == 0:
+        ld = json.dumps({
+            "@context": "https://schema.org", "@type": "Product", "name": name, "sku": sku,
+            "brand": {"@type": "Brand", "name": brand}, "description": f"{name} for home and pro use.",
+            "image": [f"/img/{sku}-{i}.jpg" for i in range(4)],
+            "offers": {"@type": "Offer", "price": price, "priceCurrency": "USD",
+                       "availability": "https://schema.org/InStock"},
+        })
+        head = f'<script type="application/ld+json">{ld}</script>'
+        body = f"<h1>{name}</h1>{crumbs}<table>{specs}</table>{filler}"
+    elif n % 4 == 1:
+        head = ""
+        body = (
+            f'<div itemscope itemtype="https://schema.org/Product"><h1 itemprop="name">{name}</h1>{crumbs}'
+            f'<span itemprop="brand">{brand}</span><span itemprop="sku">{sku}</span>'
+            f'<div itemprop="offers" itemscope itemtype="https://schema.org/Offer">'
+            f'<meta itemprop="price" content="{price}"><meta itemprop="priceCurrency" content="USD">'
+            f'<link itemprop="availability" href="https://schema.org/InStock"></div>'
+            f'<div itemprop="description">{name} for home and pro use.</div><table>{specs}</table>{filler}</div>'
+        )
+    else:
+        head = ""
+        body = (
+            f'<h1>{name}</h1>{crumbs}<div class="brand">{brand}</div><span class="sku">{sku}</span>'
+            f'<div class="price">${price}</div><div class="description">{name} for home and pro use.</div>'
+            f'<table class="specs">{specs}</table>{filler}'
+        )
+    images = "".join(f'<img src="/img/{sku}-{i}.jpg" alt="">' for i in range(4))
+    return f"<!doctype html><html><head><title>{name}</title>{head}</head><body>{body}{images}</body></html>"
+
+
+def listing_page(category, page, pages, per_category):
+    start = (page - 1) * PAGE_SIZE
+    cards = "".join(f'<div class="card"><a href="{product_path(category, n)}">Product {n}</a></div>'
+                    for n in range(start, min(start + PAGE_SIZE, per_category)))
+    nav = "".join(f'<a href="/c/{category}?page={p}">{p}</a>' for p in range(1, pages + 1))
+    if page < pages:
+        nav += f'<a class="next" rel="next" href="/c/{category}?page={page + 1}">Next</a>'
+    return f"<!doctype html><html><body><h1>{category.title()}</h1><div id='grid'>{cards}</div><nav>{nav}</nav></body></html>"
+
+
+def scroll_page(category, per_category):
+    cards = "".join(f'<div class="card" style="height:300px"><a href="{product_path(category, n)}">Product {n}</a></div>'
+                    for n in range(min(SCROLL_BATCH, per_category)))
+    script = SCROLL_SCRIPT % {"offset": SCROLL_BATCH, "category": category}
+    return f"<!doctype html><html><body><h1>{category.title()}</h1><div id='grid'>{cards}</div>{script}</body></html>"
+
+
+class Catalog:
+    def __init__(self, per_category=240, throttle_every=50, slow_every=20, slow_ms=800):
+        self.per_category = per_category
+        self.throttle_every = throttle_every
+        self.slow_every = slow_every
+        self.slow_ms = slow_ms
+        self.pages = -(-per_category // PAGE_SIZE)
+        self.throttled = set()
+        self.lock = threading.Lock()
+
+    @property
+    def product_count(self):
+        return self.per_category * len(CATEGORIES)
+
+    def seeds(self, base_url):
+        seeds = []
+        for category in CATEGORIES:
+            scroll = category in SCROLL_CATEGORIES
+            seeds.append({
+                "url": f"{base_url}/s/{category}" if scroll else f"{base_url}/c/{category}?page=1",
+                "site": "catalog.bench",
+                "allow_patterns": [f"/c/{category}", f"/s/{category}", "/products/"],
+                "type": "distributor",
+                "scroll_to_load": scroll,
+            })
+        return seeds
+
+    def _every(self, path, every):
+        return every and zlib.crc32(path.encode()) % every == 0
+
+    def handle(self, path, query):
+        """(status, headers, body) for a request."""
+        if self._every(path, self.slow_every):
+            time.sleep(self.slow_ms / 1000)
+        parts = [p for p in path.split("/") if p]
+        if len(parts) == 2 and parts[0] == "products":
+            category, _, n = parts[1].rpartition("-")
+            if category in CATEGORIES and n.isdigit() and int(n) < self.per_category:
+                if self._every(path, self.throttle_every):
+                    with self.lock:
+                        first = path not in self.throttled
+                        self.throttled.add(path)
+                    if first:
+                        return 429, {"Retry-After": "1"}, b"Too Many Requests"
+                return 200, {}, product_page(category, int(n)).encode()
+        if len(parts) == 2 and parts[0] == "c" and parts[1] in CATEGORIES:
+            page = int((query.get("page") or ["1"])[0])
+            if 1 <= page <= self.pages:
+                return 200, {}, listing_page(parts[1], page, self.pages, self.per_category).encode()
+        if len(parts) == 2 and parts[0] == "s" and parts[1] in CATEGORIES:
+            return 200, {}, scroll_page(parts[1], self.per_category).encode()
+        if len(parts) == 3 and parts[:2] == ["api", "s"] and parts[2] in CATEGORIES:
+            offset = int((query.get("offset") or ["0"])[0])
+            links = [product_path(parts[2], n) for n in range(offset, min(offset + SCROLL_BATCH, self.per_category))]
+            return 200, {"Content-Type": "application/json"}, json.dumps(links).encode()
+        return 404, {}, b"Not Found"
+
+
+def make_handler(catalog):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            parts = urlsplit(self.path)
+            status, headers, body = catalog.handle(parts.path, parse_qs(parts.query))
+            self.send_response(status)
+            self.send_header("Content-Type", headers.pop("Content-Type", "text/html; charset=utf-8"))
+            self.send_header("Content-Length", str(len(body)))
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def serve(catalog, port=0, addr="127.0.0.1"):
+    """Start the catalog on a daemon thread; returns the server (server.server_address has the port)."""
+    server = ThreadingHTTPServer((addr, port), make_handler(catalog))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="catalog", daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--products-per-category", type=int, default=240)
+    parser.add_argument("--throttle-every", type=int, default=50)
+    parser.add_argument("--slow-every", type=int, default=20)
+    parser.add_argument("--slow-ms", type=int, default=800)
+    args = parser.parse_args()
+    catalog = Catalog(args.products_per_category, args.throttle_every, args.slow_every, args.slow_ms)
+    server = serve(catalog, args.port)
+    print(f"Serving {catalog.product_count} products on http://127.0.0.1:{server.server_address[1]}/")
+    for seed in catalog.seeds(f"http://127.0.0.1:{server.server_address[1]}"):
+        print(f"  {seed['url']}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,47 +1,155 @@
+"""Push seeds into the Redis start-URL queue as JSON payloads.
+
+Usage: python tools/seed_queue.py [SEEDS.yaml] [--urls FILE ...] [--shards N] [--page-type product]
+
+Every seeds-file entry is pushed whole (url, site, allow_patterns, scroll_to_load, ...),
+so WEEDEATER_SEED_SOURCE=redis crawls keep the per-seed meta. --urls adds bulk URL
+lists (one per line; .gz allowed; "-" for stdin), e.g. sitemap dumps; each URL inherits
+the settings of the seeds-file entry for its site. Pushes are chunked RPUSHes sent
+through a non-transactional pipeline. With --shards N, payloads go to
+<key>:0..<key>:N-1 by registered domain; run crawler i with WEEDEATER_SHARD=i/N.
+"""
 import os
 import sys
-import yaml
+import gzip
+import time
+import argparse
+
 import redis
 
-if __name__ == "__main__":
+from weedeater_crawler.utils.seeds import (
+    START_URLS_KEY, encode_seed, load_seeds, shard_key, shard_of, site_for_url,
+)
+
+# Seed fields that describe one entry rather than its site
+PER_SEED_FIELDS = ("url", "discovery", "sitemaps", "feeds")
+
+
+def iter_urls(path):
+    if path == "-":
+        f = sys.stdin
+    elif path.endswith(".gz"):
+        f = gzip.open(path, "rt", encoding="utf-8")
+    else:
+        f = open(path, "r", encoding="utf-8")
     try:
-        # Load seeds from YAML file
-        seeds_file = os.getenv("WEEDEATER_SEEDS_PATH", "seeds/weedeater_targets.yaml")
-        try:
-            with open(seeds_file, "r", encoding="utf-8") as f:
-                seeds = yaml.safe_load(f)
-        except FileNotFoundError:
-            print(f"ERROR: Seeds file not found at '{seeds_file}'", file=sys.stderr)
-            sys.exit(1)
-        except yaml.YAMLError as e:
-            print(f"ERROR: Failed to parse YAML from '{seeds_file}': {e}", file=sys.stderr)
-            sys.exit(1)
-
-        if not seeds:
-            print("WARNING: No seeds found in YAML file", file=sys.stderr)
-            sys.exit(0)
-
-        # Connect to Redis
-        redis_url = os.getenv("REDIS_URL", "redis://localhost:6379")
-        try:
-            r = redis.from_url(redis_url)
-            # Test connection
-            r.ping()
-        except redis.ConnectionError as e:
-            print(f"ERROR: Failed to connect to Redis at '{redis_url}': {e}", file=sys.stderr)
-            sys.exit(1)
-        except Exception as e:
-            print(f"ERROR: Redis connection error: {e}", file=sys.stderr)
-            sys.exit(1)
-
-        # Push seeds to Redis
-        key = "weedeater:start_urls"
-        for s in seeds:
-            r.rpush(key, s["url"])  # minimal seeding; meta comes from YAML in spider
-
-        print(f"Successfully seeded {len(seeds)} urls into Redis key '{key}'")
-        sys.exit(0)
-
-    except Exception as e:
-        print(f"ERROR: Unexpected error: {e}", file=sys.stderr)
-        sys.exit(1)
+        for line in f:
+            url = line.strip()
+            if url and not url.startswith("#"):
+                yield url
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+
+def url_payloads(paths, seeds, page_type):
+    # Site templates from the seeds file: a bulk URL carries its site's patterns/options,
+    # and its seed_url, so the spider shares one set of frontier rules and caps per site
+    templates = {}
+    for s in seeds:
+        if s.get("site") and s["site"] not in templates:
+            templates[s["site"]] = {k: v for k, v in s.items() if k not in PER_SEED_FIELDS}
+            templates[s["site"]]["seed_url"] = s["url"]
+    for path in paths:
+        for url in iter_urls(path):
+            site = site_for_url(url, templates)
+            payload = {**templates.get(site, {"site": site}), "url": url}
+            if page_type:
+                payload["page_type"] = page_type
+            yield payload
+
+
+class ShardedPusher:
+    # Buffers payloads per key and sends them as RPUSH key v1..vN (chunk_size values),
+    # flushing the pipeline every `depth` commands.
+    def __init__(self, server, key, shards=1, chunk_size=1000, depth=20):
+        self.pipe = server.pipeline(transaction=False)
+        self.key = key
+        self.shards = shards
+        self.chunk_size = chunk_size
+        self.depth = depth
+        self.buffers = {}
+        self.queued = 0
+        self.pushed = 0
+        self.per_key = {}
+
+    def push(self, payload):
+        key = shard_key(self.key, shard_of(payload["url"], self.shards), self.shards)
+        buffer = self.buffers.setdefault(key, [])
+        buffer.append(encode_seed(payload))
+        if len(buffer) >= self.chunk_size:
+            self._queue(key)
+
+    def _queue(self, key):
+        values = self.buffers.pop(key, None)
+        if not values:
+            return
+        self.pipe.rpush(key, *values)
+        self.per_key[key] = self.per_key.get(key, 0) + len(values)
+        self.pushed += len(values)
+        self.queued += 1
+        if self.queued >= self.depth:
+            self.pipe.execute()
+            self.queued = 0
+
+    def flush(self):
+        for key in list(self.buffers):
+            self._queue(key)
+        if self.queued:
+            self.pipe.execute()
+            self.queued = 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("seeds", nargs="?", help="seeds YAML (default: WEEDEATER_SEEDS_PATH)")
+    parser.add_argument("--urls", action="append", default=[], metavar="FILE",
+                        help="file of URLs to push as well (.gz ok, '-' for stdin); repeatable")
+    parser.add_argument("--no-seeds", action="store_true",
+                        help="push only --urls; the seeds file is still used for site settings")
+    parser.add_argument("--page-type", choices=("listing", "product"),
+                        help="page type of --urls entries (default: crawled as listings)")
+    parser.add_argument("--key", default=START_URLS_KEY)
+    parser.add_argument("--shards", type=int, default=1, help="split across <key>:0..N-1 by registered domain")
+    parser.add_argument("--chunk-size", type=int, default=1000, help="values per RPUSH")
+    args = parser.parse_args()
+    if args.shards < 1:
+        parser.error("--shards must be >= 1")
+
+    seeds = load_seeds(args.seeds)
+    if not seeds and not args.urls:
+        print("WARNING: No seeds to push", file=sys.stderr)
+        return 0
+
+    redis_url = os.getenv("REDIS_URL", "redis://localhost:6379")
+    try:
+        server = redis.from_url(redis_url)
+        server.ping()
+    except redis.RedisError as e:
+        print(f"ERROR: Failed to connect to Redis at '{redis_url}': {e}", file=sys.stderr)
+        return 1
+
+    started = time.monotonic()
+    pusher = ShardedPusher(server, args.key, args.shards, args.chunk_size)
+    try:
+        if not args.no_seeds:
+            for s in seeds:
+                if s.get("url"):
+                    pusher.push(s)
+        for payload in url_payloads(args.urls, seeds, args.page_type):
+            pusher.push(payload)
+        pusher.flush()
+    except (OSError, redis.RedisError) as e:
+        print(f"ERROR: Seeding stopped after {pusher.pushed} payloads: {e}", file=sys.stderr)
+        return 1
+
+    elapsed = time.monotonic() - started
+    for key, count in sorted(pusher.per_key.items()):
+        print(f"  {key}: {count}")
+    print(f"Seeded {pusher.pushed} payloads into {len(pusher.per_key)} key(s) in {elapsed:.1f}s "
+          f"({pusher.pushed / elapsed if elapsed else 0:.0f}/s)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())